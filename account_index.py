@@ -0,0 +1,42 @@
+import polars as pl
+
+def name_lookup(key, *sources):
+    # Each source is a frame of (key, Account_Name) in priority order; the
+    # first name seen for an account wins, as with the old per-account scans.
+    names = pl.concat(
+        [source.select(pl.col(key).cast(pl.Utf8), pl.col("Account_Name").cast(pl.Utf8)) for source in sources]
+    ).unique(subset=key, keep="first", maintain_order=True)
+    return dict(zip(names[key].to_list(), names["Account_Name"].to_list()))
+
+class AccountIndex:
+    # Built once per run from the combined transactions of every account:
+    # row partitions, debit/credit totals and counts, and account names.
+    # The report loops iterate over it instead of filtering the full GL and
+    # SWIFT frames for each account.
+
+    def __init__(self, transactions, key, names=None):
+        self.key = key
+        self.names = names or {}
+        transactions = transactions.filter(pl.col(key).is_not_null())
+        self.partitions = transactions.partition_by(key, as_dict=True, maintain_order=True)
+        totals = transactions.group_by(key, maintain_order=True).agg(
+            (pl.col("Dr/Cr") == "Cr").sum().alias("credit_count"),
+            pl.col("Credit_Amount").filter(pl.col("Dr/Cr") == "Cr").sum().alias("credit_total"),
+            (pl.col("Dr/Cr") == "Dr").sum().alias("debit_count"),
+            pl.col("Debit_Amount").filter(pl.col("Dr/Cr") == "Dr").sum().alias("debit_total"),
+        )
+        self.accounts = totals[key].to_list()
+        self.totals = {row.pop(key): row for row in totals.to_dicts()}
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def __iter__(self):
+        for account in self.accounts:
+            yield account, self.transactions(account), self.totals[account]
+
+    def transactions(self, account):
+        return self.partitions[(account,)]
+
+    def account_name(self, account):
+        return self.names.get(account, "N/A")
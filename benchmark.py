@@ -0,0 +1,993 @@
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import random
+import resource
+import runpy
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from types import SimpleNamespace
+
+import polars as pl
+
+from script_loader import HERE, load_script
+
+
+CURRENCIES = ["USD", "EUR", "GBP", "JPY", "CHF"]
+REPORT_DATE = date(2024, 1, 31)
+
+SWIFT_BALANCE_COLUMNS = [
+    "Opening Balance", "Opening Balance Date", "Opening Balance Currency",
+    "Intermidiate start Balance", "intermidiate Balance Date", "intermidiate Balance Currency",
+    "intermidiate End Balance", "intermidiate End Date", "intermidiate End Currency",
+    "Closing Balance", "Closing Balance Date", "Closing Balance Currency",
+]
+
+
+def pick(n, seed, choices):
+    return pl.int_range(n, eager=True).hash(seed) % len(choices)
+
+
+def weighted_pick(i, seed, weights):
+    # Index into weights for every row of i, drawn from the row hash.
+    total = sum(weights)
+    bounds, cumulative = [], 0.0
+    for weight in weights[:-1]:
+        cumulative += weight / total
+        bounds.append(int(cumulative * 1_000_000))
+    draw = (i.hash(seed) % 1_000_000).cast(pl.Int64)
+    return pl.Series(bounds, dtype=pl.Int64).search_sorted(draw, side="right").cast(pl.Int64)
+
+
+def consolidated_frame(rows, accounts, source, seed=0, start=0, currencies=None, ageing=None):
+    # One ConsolidatedReport sheet. currencies maps currency -> weight and
+    # ageing maps (low, high) day buckets -> weight.
+    currencies = currencies or dict.fromkeys(["USD", "EUR", "GBP", "JPY"], 1)
+    ageing = ageing or {(0, 119): 1}
+    buckets = list(ageing)
+    i = pl.int_range(start, start + rows, eager=True)
+    acct = (i.hash(seed + 1) % accounts).cast(pl.Int64)
+    cents = (i.hash(seed + 2) % 10_000_000).cast(pl.Int64) - 5_000_000
+    bucket = weighted_pick(i, seed + 3, list(ageing.values()))
+    low = pl.Series([b[0] for b in buckets], dtype=pl.Int64).gather(bucket)
+    span = pl.Series([b[1] - b[0] + 1 for b in buckets], dtype=pl.Int64).gather(bucket)
+    days = low + (i.hash(seed + 7) % span).cast(pl.Int64)
+    # Statement dates are AGEING days before 2024-01-31, so ageing computed
+    # from them as of that date gives back AGEING.
+    return pl.DataFrame({"acct": acct, "amount": cents / 100, "days": days}).select(
+        pl.format("ACCOUNT {}", "acct").alias("GL_NAME"),
+        (pl.col("acct") + 100000).cast(pl.Utf8).alias("GL_NUMBER"),
+        pl.lit(source).alias("SOURCE"),
+        pl.lit("2024-01-31 00:00:00").alias("EXECUTION_DATE_TIME"),
+        pl.Series(list(currencies)).gather(weighted_pick(i, seed + 4, list(currencies.values()))).alias("CURRENCY"),
+        (pl.lit(REPORT_DATE) - pl.duration(days="days")).dt.strftime("%Y-%m-%d").alias("EXECUTION_STATEMENTDATE"),
+        pl.col("amount").abs().alias("DC_AMOUNT"),
+        pl.when(pl.col("amount") < 0).then(pl.lit("Dr")).otherwise(pl.lit("Cr")).alias("Dr/Cr Ind"),
+        pl.when(pl.col("amount") < 0).then(-pl.col("amount")).otherwise(0.0).alias("Total Debit"),
+        pl.when(pl.col("amount") >= 0).then(pl.col("amount")).otherwise(0.0).alias("Total Credit"),
+        pl.Series(["N", "Y"]).gather(weighted_pick(i, seed + 5, [3, 1])).alias("CARRY_FORWARD"),
+        pl.Series(["MATCHED", "UNMATCHED", "Reversal"]).gather(weighted_pick(i, seed + 6, [2, 1, 1])).alias("MATCHING_STATUS"),
+        pl.col("days").alias("AGEING"),
+    )
+
+
+def nostro_frames(rows, accounts, match_ratio=0.7, seed=0, hot_share=0.0, rule_ratios=None,
+                  duplicate_rate=0.0, currencies=None, start=0):
+    # rule_ratios gives the share of rows matched by Rule 1, 2 and 3 (by
+    # default match_ratio split evenly); duplicate_rate is the share of GL
+    # rows reusing the previous row's references.
+    currencies = currencies or dict.fromkeys(CURRENCIES, 1)
+    rule_ratios = list(rule_ratios or [match_ratio / 3] * 3)
+    account_ids = pl.int_range(accounts, eager=True)
+    mapping_df = pl.DataFrame({"acct": account_ids}).select(
+        pl.format("ACCOUNT {}", "acct").alias("Account Name"),
+        pl.Series(list(currencies)).gather(weighted_pick(account_ids, seed, list(currencies.values()))).alias("Account Currency"),
+        (pl.col("acct") + 1_000_000).cast(pl.Utf8).alias("Account_Number"),
+        pl.format("BANK{}XX", pl.col("acct") % 100).alias("Swift Code"),
+        pl.format("S{}", "acct").alias("Sierra Account Numbers"),
+        pl.lit("US").alias("Country"),
+        pl.lit("NOSTRO").alias("ReconName"),
+        pl.lit("1").alias("Reconid"),
+        pl.lit("NOSTRO").alias("ReconProcess"),
+        pl.lit("SIERRA").alias("Source"),
+        pl.lit("0").alias("ClosingBalance"),
+        pl.format("ACCOUNT {}", "acct").alias("Account Name Curr"),
+        (pl.col("acct") + 1_000_000).cast(pl.Utf8).alias("Acc_Num"),
+    )
+
+    i = pl.int_range(start, start + rows, eager=True)
+    acct = (i.hash(seed + 1) % accounts).cast(pl.Int64)
+    # hot_share of all rows land on account 0, like a large USD correspondent.
+    acct = pl.select(
+        pl.when(i.hash(seed + 5) % 10_000 < int(hot_share * 10_000)).then(0).otherwise(acct)
+    ).to_series()
+    cents = (i.hash(seed + 2) % 10_000_000).cast(pl.Int64) + 1
+    sign = pl.Series([-1, 1]).gather(i.hash(seed + 3) % 2)
+    days = (i.hash(seed + 4) % 90).cast(pl.Int64)
+    ref = pl.select(
+        pl.when(i.hash(seed + 7) % 10_000 < int(duplicate_rate * 10_000)).then((i - 1).clip(lower_bound=0)).otherwise(i)
+    ).to_series()
+    # 0, 1, 2: matched by Rule 1, 2, 3; 3: left unmatched.
+    rule = weighted_pick(i, seed + 6, rule_ratios + [max(0.0, 1 - sum(rule_ratios))])
+
+    gl_df = pl.DataFrame({"i": i, "acct": acct, "cents": cents * sign, "days": days, "ref": ref, "rule": rule}).join(
+        mapping_df.with_row_index("acct").with_columns(pl.col("acct").cast(pl.Int64)), on="acct", how="left"
+    ).sort("i").select(
+        pl.col("Sierra Account Numbers").alias("Nostro/Vostro/ Sett Entity ID"),
+        pl.col("Account Currency").alias("Nostro/Vostro/ Sett Entity Cur"),
+        (pl.date(2024, 1, 1) + pl.duration(days="days")).cast(pl.Utf8).alias("Val/Settle Date"),
+        pl.format("EXT{}", "ref").alias("ExternalTxNum"),
+        pl.lit("Y").alias("MAPS_TRDVERIFY-IMPORT"),
+        pl.lit("").alias("Trade Remarks 1"),
+        (pl.col("cents") / 100).alias("Cash Amt"),
+        pl.format("TRN{}", "ref").alias("Trans Num"),
+        pl.format("GL_{}.csv", (pl.date(2024, 1, 1) + pl.duration(days="days")).cast(pl.Utf8)).alias("FEED_FILE_NAME"),
+        pl.col("Account_Number"),
+        pl.col("i"),
+        pl.col("rule"),
+    )
+
+    matched = pl.col("rule") < 3
+    swift_df = gl_df.select(
+        pl.col("Val/Settle Date").alias("Value Date"),
+        pl.col("Val/Settle Date").alias("Entry Date"),
+        pl.when(matched).then(pl.col("Cash Amt")).otherwise(pl.col("Cash Amt") + 0.01).alias("Amount"),
+        pl.format("TX{}", "i").alias("Transaction Id"),
+        pl.when(pl.col("rule") == 0).then(pl.col("Trans Num"))
+        .when(pl.col("rule") == 2).then(pl.col("ExternalTxNum"))
+        .otherwise(pl.format("SWF{}", "i")).alias("Transation Reference"),
+        pl.when(pl.col("rule") == 1).then(pl.col("ExternalTxNum"))
+        .otherwise(pl.format("INST{}", "i")).alias("Institution Reference"),
+        pl.format("CUST{}", "i").alias("Custumer Reference"),
+        pl.lit("PAYMENT").alias("Description"),
+        *[pl.lit(None, pl.Utf8).alias(c) for c in SWIFT_BALANCE_COLUMNS],
+        pl.col("Account_Number").alias("Nostro Account"),
+        pl.format("BTR{}", "i").alias("Bank Transaction Reference"),
+        pl.lit("").alias("Information"),
+        pl.format("SWIFT_{}.csv", "Val/Settle Date").alias("FEED_FILE_NAME"),
+        pl.when(pl.col("Cash Amt") < 0).then(pl.lit("D")).otherwise(pl.lit("C")).alias("Currency Dr/Cr"),
+    )
+
+    return gl_df.drop("Account_Number", "i", "rule"), swift_df, mapping_df
+
+
+def write_nostro_csvs(directory, rows, accounts, match_ratio=0.7, seed=0, chunk_rows=2_000_000, **options):
+    # Rows are generated and appended chunk by chunk, so 100M-row feeds do
+    # not have to fit in memory at once.
+    paths = {
+        "gl_file": os.path.join(directory, "NOSTRO_GL.csv"),
+        "swift_file": os.path.join(directory, "NOSTRO_SWIFT.csv"),
+        "mapping_file": os.path.join(directory, "Nostro_Mapping.csv"),
+    }
+    with open(paths["gl_file"], "wb") as gl_out, open(paths["swift_file"], "wb") as swift_out:
+        for start in range(0, max(rows, 1), chunk_rows):
+            gl_df, swift_df, mapping_df = nostro_frames(
+                min(chunk_rows, rows - start), accounts, match_ratio, seed, start=start, **options
+            )
+            gl_df.write_csv(gl_out, include_header=start == 0)
+            swift_df.write_csv(swift_out, include_header=start == 0)
+    mapping_df.write_csv(paths["mapping_file"])
+    return paths
+
+
+def write_consolidated_report(directory, rows, accounts, seed=0, report_format="xlsx", **options):
+    # Writes the NOSTRO_GL / NOSTRO_SWIFT sheets the report classes read.
+    # Sheets too large for Excel are written as <prefix>_gl/_swift Parquet
+    # files, which columnar_io.load_sheets accepts in place of the workbook.
+    from columnar_io import SHEETS
+    from excel_writer import EXCEL_MAX_ROWS
+
+    sheets = {
+        "NOSTRO_GL": consolidated_frame(rows // 2, accounts, "NOSTRO_GL", seed=seed + 1, **options),
+        "NOSTRO_SWIFT": consolidated_frame(rows - rows // 2, accounts, "NOSTRO_SWIFT", seed=seed + 2, **options),
+    }
+    if report_format == "xlsx" and max(df.height for df in sheets.values()) >= EXCEL_MAX_ROWS:
+        print(f"ConsolidatedReport sheets exceed {EXCEL_MAX_ROWS:,} rows; writing Parquet sheets instead.")
+        report_format = "parquet"
+
+    if report_format == "xlsx":
+        import xlsxwriter
+
+        path = os.path.join(directory, "ConsolidatedReport.xlsx")
+        with xlsxwriter.Workbook(path) as workbook:
+            for sheet, df in sheets.items():
+                df.write_excel(workbook, worksheet=sheet)
+        return path
+
+    prefix = os.path.join(directory, "ConsolidatedReport")
+    for sheet, df in sheets.items():
+        df.write_parquet(f"{prefix}_{SHEETS[sheet]}.parquet")
+    return prefix
+
+
+def timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def bench_combined_report(row_counts=(10_000, 100_000, 1_000_000), accounts=40_000):
+    report = load_script("excel processor.py", "excel_processor").CombinedReport(None, None)
+    print(f"CombinedReport.process_data ({accounts} accounts)")
+    for rows in row_counts:
+        gl_df = consolidated_frame(rows // 2, accounts, "NOSTRO_GL", seed=1)
+        swift_df = consolidated_frame(rows - rows // 2, accounts, "NOSTRO_SWIFT", seed=2)
+        result, elapsed = timed(report.process_data, gl_df, swift_df)
+        print(f"  rows={rows:>10,}  output={result.height:>7,}  {elapsed:8.3f}s  {elapsed / rows * 1e6:6.2f}us/row")
+
+
+def bench_ageing_report(row_counts=(10_000, 100_000, 1_000_000), accounts=40_000):
+    report = load_script("unmatched-filter-aeging_report.py", "aeging_report").AegingReport(None, None)
+    print(f"AegingReport.process_data ({accounts} accounts)")
+    for rows in row_counts:
+        gl_df = consolidated_frame(rows // 2, accounts, "NOSTRO_GL", seed=1)
+        swift_df = consolidated_frame(rows - rows // 2, accounts, "NOSTRO_SWIFT", seed=2)
+        result, elapsed = timed(report.process_data, gl_df, swift_df)
+        print(f"  rows={rows:>10,}  output={result.height:>7,}  {elapsed:8.3f}s  {elapsed / rows * 1e6:6.2f}us/row")
+
+
+def bench_ageing_trend(rows=200_000, accounts=5_000, days=90):
+    # A daily ageing trend from statement dates in one pass, against one
+    # report per date with AGEING recomputed for that date.
+    module = load_script("unmatched-filter-aeging_report.py", "aeging_report")
+    gl_df = consolidated_frame(rows // 2, accounts, "NOSTRO_GL", seed=1)
+    swift_df = consolidated_frame(rows - rows // 2, accounts, "NOSTRO_SWIFT", seed=2)
+    dates = [REPORT_DATE - timedelta(days=n) for n in range(days)]
+    print(f"AegingReport ageing trend ({rows:,} rows, {days} as-of dates)")
+
+    _, single_seconds = timed(module.AegingReport(None, None).process_data, gl_df, swift_df)
+    current, current_seconds = timed(module.AegingReport(None, None, as_of=REPORT_DATE).process_data, gl_df, swift_df)
+    trend, trend_seconds = timed(module.AegingReport(None, None, as_of=dates).process_data, gl_df, swift_df)
+
+    def aged(df, as_of):
+        opened = pl.col("EXECUTION_STATEMENTDATE").str.to_date()
+        return df.with_columns((pl.lit(as_of) - opened).dt.total_days().alias("AGEING")).filter(pl.col("AGEING") >= 0)
+
+    def per_date():
+        report = module.AegingReport(None, None)
+        return [report.process_data(aged(gl_df, as_of), aged(swift_df, as_of)) for as_of in dates]
+
+    looped, looped_seconds = timed(per_date)
+    # The per-date reports drop rows not yet open, and with them accounts
+    # whose rows are all later; compare on the accounts they do have.
+    keys = ["GL_NUMBER", "CURRENCY", "SOURCE"]
+    identical = all(
+        df.join(trend.filter(pl.col("AS_OF") == as_of).drop("AS_OF"), on=keys, how="left", suffix="_trend")
+        .select([(pl.col(c) == pl.col(f"{c}_trend")).all() for c in df.columns if c not in keys])
+        .row(0) == (True,) * (df.width - len(keys))
+        for as_of, df in zip(dates, looped)
+    )
+    print(f"  AGEING column, 1 date      {single_seconds:8.3f}s")
+    print(f"  statement dates, 1 date    {current_seconds:8.3f}s")
+    print(f"  statement dates, {days} dates {trend_seconds:8.3f}s  output={trend.height:,}")
+    print(f"  {days} reports, one per date  {looped_seconds:8.3f}s  speedup {looped_seconds / trend_seconds:.1f}x")
+    print(f"  as of {REPORT_DATE} equals AGEING report: {current.equals(module.AegingReport(None, None).process_data(gl_df, swift_df))}")
+    print(f"  identical to per-date reports: {identical}")
+
+
+def bench_streaming(rows=200_000, accounts=5_000):
+    import matched_data
+    print(f"matched_data.process_data eager vs streaming ({rows:,} rows)")
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_nostro_csvs(directory, rows, accounts)
+        outputs = {}
+        for streaming in (False, True):
+            output_file = os.path.join(directory, "streaming" if streaming else "eager")
+            _, elapsed = timed(matched_data.process_data, output_file=output_file, streaming=streaming, **paths)
+            print(f"  streaming={streaming!s:<5}  {elapsed:8.3f}s")
+            outputs[streaming] = [
+                pl.read_csv(output_file + suffix, infer_schema=False).sort(pl.all())
+                for suffix in ("_gl.csv", "_swift.csv")
+            ]
+        identical = all(a.equals(b) for a, b in zip(outputs[False], outputs[True]))
+        print(f"  identical output: {identical}")
+
+
+def enriched_frames(matched_data, rows, accounts, match_ratio=0.7, seed=0, hot_share=0.0):
+    from mapping_cache import build_lookups
+
+    gl_df, swift_df, mapping_df = nostro_frames(rows, accounts, match_ratio, seed, hot_share)
+    lookups, _ = build_lookups(mapping_df)
+    return matched_data.enrich_feeds(gl_df, SimpleNamespace(**lookups), swift_df)
+
+
+def synthetic_rules(count):
+    rules = [
+        (["Trans Num", "DC_AMOUNT", "Account Currency"], ["Transation Reference", "DC_AMOUNT", "Account Currency"], "Rule 1"),
+        (["ExternalTxNum", "DC_AMOUNT", "Account Currency"], ["Institution Reference", "DC_AMOUNT", "Account Currency"], "Rule 2"),
+        (["ExternalTxNum", "DC_AMOUNT", "Account Currency"], ["Transation Reference", "DC_AMOUNT", "Account Currency"], "Rule 3"),
+    ]
+    gl_refs = ["Trans Num", "ExternalTxNum"]
+    swift_refs = ["Custumer Reference", "Transaction Id", "Bank Transaction Reference", "Institution Reference", "Transation Reference"]
+    extra = [
+        ([gl_ref, "DC_AMOUNT"] + currency, [swift_ref, "DC_AMOUNT"] + currency)
+        for currency in ([], ["Account Currency"])
+        for gl_ref in gl_refs
+        for swift_ref in swift_refs
+    ]
+    for gl_cols, swift_cols in extra * 3:
+        if len(rules) >= count:
+            break
+        rules.append((gl_cols, swift_cols, f"Rule {len(rules) + 1}"))
+    return rules[:count]
+
+
+def rules_one_at_a_time(gl_df, swift_df, rules):
+    # The rule loop process_rules replaced: one key join per rule, and
+    # every row whose key matches is marked matched (many-to-many).
+    matched_gl, matched_swift = [], []
+    for gl_cols, swift_cols, rule_name in rules:
+        keys = gl_df.select(gl_cols).join(swift_df.select(swift_cols), left_on=gl_cols, right_on=swift_cols).unique()
+        swift_keys = keys.rename(dict(zip(gl_cols, swift_cols)))
+        rule = pl.lit(rule_name, pl.Categorical).alias("Matching_Rule")
+        matched_gl.append(gl_df.join(keys, on=gl_cols).with_columns(rule))
+        matched_swift.append(swift_df.join(swift_keys, on=swift_cols).with_columns(rule))
+        gl_df = gl_df.join(keys, on=gl_cols, how="anti")
+        swift_df = swift_df.join(swift_keys, on=swift_cols, how="anti")
+    unmatched = pl.lit("Unmatched", pl.Categorical).alias("Matching_Rule")
+    return pl.concat(matched_gl), gl_df.with_columns(unmatched), pl.concat(matched_swift), swift_df.with_columns(unmatched)
+
+
+def bench_rule_count(rows=200_000, accounts=5_000, rule_counts=(3, 10, 30)):
+    import matched_data
+    gl_df, swift_df = enriched_frames(matched_data, rows, accounts)
+    print(f"process_rules vs one join per rule ({rows:,} rows per side)")
+    for count in rule_counts:
+        rules = synthetic_rules(count)
+        with contextlib.redirect_stdout(io.StringIO()):
+            single, single_elapsed = timed(matched_data.process_rules, gl_df, swift_df, rules)
+            iterative, iterative_elapsed = timed(rules_one_at_a_time, gl_df, swift_df, rules)
+        # The rule loop has no row ids; the data has no duplicate keys,
+        # so one-to-one and many-to-many matching agree on it.
+        single = [df.drop("Row_Id", "Paired_Row_Id") for df in single]
+        identical = all(a.sort(pl.all()).equals(b.sort(pl.all())) for a, b in zip(single, iterative))
+        print(f"  rules={count:>3}  single-plan {single_elapsed:8.3f}s  iterative {iterative_elapsed:8.3f}s  identical={identical}")
+
+
+def bench_sharding(rows=1_000_000, accounts=20_000, hot_share=0.3, worker_counts=(1, 4, 16, 64)):
+    import matched_data
+    gl_df, swift_df = enriched_frames(matched_data, rows, accounts, hot_share=hot_share)
+    print(f"process_rules_sharded ({rows:,} rows per side, {hot_share:.0%} on one account, {os.cpu_count()} cpus)")
+
+    columns = matched_data.shard_columns(matched_data.RULES)
+    for shards in (16, 64):
+        sizes = gl_df.select(matched_data.shard_ids(gl_df, [c for c, _ in columns], shards))["_shard"].value_counts()["count"]
+        print(f"  shards={shards:>3}  largest/mean GL shard {sizes.max() / sizes.mean():.2f}")
+
+    baseline, elapsed = timed(matched_data.process_rules, gl_df, swift_df, matched_data.RULES)
+    print(f"  unsharded    {elapsed:8.3f}s")
+    for workers in worker_counts:
+        result, elapsed = timed(matched_data.process_rules_sharded, gl_df, swift_df, matched_data.RULES, workers)
+        identical = all(a.equals(b) for a, b in zip(baseline, result))
+        print(f"  workers={workers:>3}  {elapsed:8.3f}s  identical={identical}")
+
+
+def bench_tolerance_rules(row_counts=(100_000, 400_000, 1_600_000), accounts=20_000):
+    import matched_data
+    print("process_rules with tolerance rules (amount +/-0.05, value date +/-1 day)")
+    for rows in row_counts:
+        gl_df, swift_df = enriched_frames(matched_data, rows, accounts)
+        # Shift every other SWIFT amount by 3 cents so only tolerance rules match it.
+        swift_df = swift_df.with_columns(
+            (pl.col("DC_AMOUNT") + pl.when(pl.int_range(pl.len()) % 2 == 0).then(0.03).otherwise(0.0))
+            .cast(swift_df.schema["DC_AMOUNT"]).alias("DC_AMOUNT")
+        )
+        result, elapsed = timed(matched_data.process_rules, gl_df, swift_df, matched_data.RULES + matched_data.TOLERANCE_RULES)
+        tolerance_matches = result[0].filter(pl.col("Matching_Rule").is_in(["Rule 4", "Rule 5", "Rule 6"])).height
+        print(f"  rows={rows:>10,}  tolerance matches={tolerance_matches:>9,}  {elapsed:8.3f}s  {elapsed / rows * 1e6:6.2f}us/row")
+
+
+def with_reversals(gl_df, share, seed=0):
+    # Appends a reversing entry (same account and amount, opposite sign,
+    # 1-3 days later) for share of the GL rows.
+    picked = gl_df.filter(pl.int_range(pl.len()).hash(seed + 9) % 10_000 < int(share * 10_000))
+    reversed_rows = picked.with_columns(
+        -pl.col("Cash Amt"),
+        (pl.col("Val/Settle Date").str.to_date() + pl.duration(days=pl.int_range(pl.len()) % 3 + 1)).cast(pl.Utf8),
+        pl.format("REV{}", "Trans Num").alias("Trans Num"),
+        pl.format("REV{}", "ExternalTxNum").alias("ExternalTxNum"),
+    )
+    return pl.concat([gl_df, reversed_rows]), picked.height
+
+
+def bench_reversals(row_counts=(100_000, 1_000_000), accounts=20_000, share=0.05, hot_share=0.3):
+    from mapping_cache import build_lookups
+
+    import matched_data
+    rules = matched_data.reversal_rules() + matched_data.RULES
+    print(f"reversal pairing before the rules ({share:.0%} of GL rows reversed, {hot_share:.0%} on one account)")
+    for rows in row_counts:
+        gl_df, swift_df, mapping_df = nostro_frames(rows, accounts, hot_share=hot_share)
+        gl_df, injected = with_reversals(gl_df, share)
+        lookups, _ = build_lookups(mapping_df)
+        gl_df, swift_df = matched_data.enrich_feeds(gl_df, SimpleNamespace(**lookups), swift_df)
+        # Rows a self-join of debits to credits on the reversal key would produce.
+        gl_key = matched_data.REVERSAL_KEYS[0]
+        self_join = gl_df.group_by(gl_key).agg(
+            (pl.col("Dr/Cr") == "Dr").sum().cast(pl.Int64).alias("dr"), (pl.col("Dr/Cr") == "Cr").sum().cast(pl.Int64).alias("cr")
+        ).select((pl.col("dr") * pl.col("cr")).sum()).item()
+        with contextlib.redirect_stdout(io.StringIO()):
+            result, elapsed = timed(matched_data.process_rules, gl_df, swift_df, rules)
+            sharded = matched_data.process_rules_sharded(gl_df, swift_df, rules, workers=2)
+        _, baseline = timed(matched_data.process_rules, gl_df, swift_df, matched_data.RULES)
+        gl_pairs = result[0].filter(pl.col("Matching_Rule") == "Reversal").height // 2
+        swift_pairs = result[2].filter(pl.col("Matching_Rule") == "Reversal").height // 2
+        same = all(a.equals(b) for a, b in zip(result, sharded))
+        print(
+            f"  rows={gl_df.height:>10,}  injected={injected:>7,}  GL pairs={gl_pairs:>7,}  SWIFT pairs={swift_pairs:>7,}  "
+            f"self-join rows={self_join:>11,}  {elapsed:7.3f}s (rules only {baseline:7.3f}s)  sharded identical: {same}"
+        )
+
+
+def with_splits(df, share, signed_amount, seed=0, max_parts=4):
+    # Replaces share of the rows by 2..max_parts rows with the same
+    # references whose DC_AMOUNT adds up exactly to the original.
+    df = df.with_row_index("_split_row")
+    picked = pl.int_range(pl.len()).hash(seed + 11) % 10_000 < int(share * 10_000)
+    parts = (pl.col("_split_row").hash(seed + 12) % (max_parts - 1) + 2).cast(pl.Int64)
+    thousandths = (pl.col("DC_AMOUNT") * 1000).cast(pl.Int64)
+    split = df.filter(picked).with_columns(pl.int_ranges(parts).alias("_part"), parts.alias("_parts")).explode("_part")
+    share_of = thousandths // pl.col("_parts")
+    part = pl.when(pl.col("_part") == pl.col("_parts") - 1).then(thousandths - share_of * (pl.col("_parts") - 1)).otherwise(share_of)
+    split = split.with_columns((part.cast(df.schema["DC_AMOUNT"]) / 1000).cast(df.schema["DC_AMOUNT"]).alias("DC_AMOUNT"))
+    split = split.with_columns(
+        (pl.col(signed_amount).sign() * pl.col("DC_AMOUNT").cast(pl.Float64)).alias(signed_amount)
+    ).drop("_part", "_parts")
+    groups = df.filter(picked).height
+    return pl.concat([df.filter(~picked), split]).sort("_split_row").drop("_split_row"), groups
+
+
+def bench_aggregate_rules(row_counts=(100_000, 1_000_000), accounts=20_000, share=0.02):
+    import matched_data
+    aggregate = matched_data.aggregate_rules()
+    rules = matched_data.RULES + aggregate
+    gl_rules = [rule[2] for rule in aggregate if rule[3]["grouped"] == "gl"]
+    swift_rules = [rule[2] for rule in aggregate if rule[3]["grouped"] == "swift"]
+    print(f"aggregate (split payment) rules after the exact rules ({share:.0%} of rows on each side split in 2-4 parts)")
+    for rows in row_counts:
+        gl_df, swift_df = enriched_frames(matched_data, rows, accounts)
+        gl_df, gl_splits = with_splits(gl_df, share, "Cash Amt")
+        swift_df, swift_splits = with_splits(swift_df, share, "Amount", seed=1)
+        with contextlib.redirect_stdout(io.StringIO()):
+            result, elapsed = timed(matched_data.process_rules, gl_df, swift_df, rules)
+            sharded = matched_data.process_rules_sharded(gl_df, swift_df, rules, workers=2)
+            _, baseline = timed(matched_data.process_rules, gl_df, swift_df, matched_data.RULES)
+        gl_groups = result[0].filter(pl.col("Matching_Rule").is_in(gl_rules))["Paired_Row_Id"].n_unique()
+        swift_groups = result[2].filter(pl.col("Matching_Rule").is_in(swift_rules))["Paired_Row_Id"].n_unique()
+        same = all(a.equals(b) for a, b in zip(result, sharded))
+        print(
+            f"  rows={gl_df.height:>10,}  GL splits={gl_splits:>7,} matched={gl_groups:>7,}  SWIFT splits={swift_splits:>7,} matched={swift_groups:>7,}  "
+            f"{elapsed:7.3f}s (exact rules only {baseline:7.3f}s)  sharded identical: {same}"
+        )
+
+
+def bench_duplicate_keys(rows=1_000_000, accounts=20_000, duplicated=20_000, copies=(3, 2)):
+    # Repeats `duplicated` matching rows on both sides (copies[0] times on
+    # GL, copies[1] on SWIFT): one-to-one pairing leaves the surplus GL
+    # copies unmatched, where the old key join marked every copy matched.
+    import matched_data
+    gl_df, swift_df = enriched_frames(matched_data, rows, accounts)
+    gl_df = pl.concat([gl_df] + [gl_df.head(duplicated)] * (copies[0] - 1))
+    swift_df = pl.concat([swift_df] + [swift_df.head(duplicated)] * (copies[1] - 1))
+    print(f"one-to-one pairing with duplicate keys ({rows:,} rows per side, {duplicated:,} rows repeated {copies[0]}x GL / {copies[1]}x SWIFT)")
+    with contextlib.redirect_stdout(io.StringIO()):
+        result, elapsed = timed(matched_data.process_rules, gl_df, swift_df, matched_data.RULES)
+        many, many_elapsed = timed(rules_one_at_a_time, gl_df, swift_df, matched_data.RULES)
+    one_to_one = result[0]["Paired_Row_Id"].is_unique().all() and result[2]["Paired_Row_Id"].is_unique().all()
+    ledger = matched_data.pair_ledger(result[0], result[2], matched_data.RULES)
+    print(f"  one-to-one    GL matched={result[0].height:>9,}  SWIFT matched={result[2].height:>9,}  ledger pairs={ledger.height:>9,}  {elapsed:7.3f}s  each row paired once: {one_to_one}")
+    print(f"  many-to-many  GL matched={many[0].height:>9,}  SWIFT matched={many[2].height:>9,}  {'':>22}{many_elapsed:7.3f}s")
+
+
+def bench_inbox_watcher(rows=400_000, accounts=5_000, burst_days=30, batch_sizes=(1, 8, 32)):
+    # The last burst_days of feed files land in the inbox at once, on top of
+    # a pool built from the earlier days; each run drains the burst and is
+    # checked against a full recompute of all the feeds.
+    import asyncio
+
+    from inbox_watcher import InboxWatcher
+    from open_item_pool import rebuild_pool, verify_pool
+
+    print(f"inbox_watcher draining a burst of {burst_days} days of GL and SWIFT files ({rows:,} rows per side in all)")
+    with tempfile.TemporaryDirectory() as directory:
+        paths = write_nostro_csvs(directory, rows, accounts)
+        base = {}
+        for key, prefix in (("gl_file", "GL_"), ("swift_file", "SWIFT_")):
+            df = pl.read_csv(paths[key], infer_schema=False)
+            burst = sorted(df["FEED_FILE_NAME"].unique())[-burst_days:]
+            base[key] = os.path.join(directory, f"base_{prefix}feed.csv")
+            df.filter(~pl.col("FEED_FILE_NAME").is_in(burst)).write_csv(base[key])
+            for (name,), part in df.filter(pl.col("FEED_FILE_NAME").is_in(burst)).partition_by("FEED_FILE_NAME", as_dict=True).items():
+                os.makedirs(os.path.join(directory, "inbox"), exist_ok=True)
+                part.write_csv(os.path.join(directory, "inbox", name))
+        files = len(os.listdir(os.path.join(directory, "inbox")))
+
+        for batch_files in batch_sizes:
+            store = os.path.join(directory, f"store_{batch_files}")
+            outbox = os.path.join(directory, f"outbox_{batch_files}")
+            with contextlib.redirect_stdout(io.StringIO()):
+                rebuild_pool(store, base["gl_file"], paths["mapping_file"], base["swift_file"])
+                watcher = InboxWatcher(
+                    os.path.join(directory, "inbox"), outbox, store, paths["mapping_file"], queue_size=batch_files, batch_files=batch_files
+                )
+                watcher.load()
+                _, elapsed = timed(asyncio.run, watcher.run(once=True))
+                consistent = verify_pool(store, paths["gl_file"], paths["mapping_file"], paths["swift_file"])
+            batches = len([name for name in os.listdir(outbox) if name.endswith("_pairs.parquet")])
+            print(f"  batch_files={batch_files:>3}  {files} files in {batches:>3} batches  {elapsed:7.3f}s  {elapsed / files * 1000:7.1f}ms/file  pool matches full recompute: {consistent}")
+
+
+def legacy_types(df):
+    # The schema before compact_schema: Float64 amounts and plain strings.
+    return df.with_columns(
+        pl.col(pl.Decimal).cast(pl.Float64),
+        pl.col(pl.Categorical, pl.Enum).cast(pl.Utf8),
+    )
+
+
+def bench_compact_schema(rows=1_000_000, accounts=20_000):
+    from compact_schema import compact_report
+
+    import matched_data
+    gl_df, swift_df = enriched_frames(matched_data, rows, accounts)
+    consolidated = consolidated_frame(rows, accounts, "NOSTRO_GL", seed=1)
+    print(f"Compact schema vs Float64/Utf8 ({rows:,} rows per side)")
+    for name, compact, legacy in [
+        ("enriched GL", gl_df, legacy_types(gl_df)),
+        ("enriched SWIFT", swift_df, legacy_types(swift_df)),
+        ("ConsolidatedReport sheet", compact_report(consolidated), consolidated),
+    ]:
+        print(f"  {name:<25} {legacy.estimated_size('mb'):8.1f} MB -> {compact.estimated_size('mb'):8.1f} MB")
+
+    timings = {}
+    for name, gl, swift in [("legacy", legacy_types(gl_df), legacy_types(swift_df)), ("compact", gl_df, swift_df)]:
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = [timed(matched_data.process_rules, gl, swift, matched_data.RULES) for _ in range(3)]
+        timings[name] = min(elapsed for _, elapsed in results)
+        print(f"  process_rules {name:<11} {timings[name]:8.3f}s  matched {results[0][0][0].height:,}")
+    print(f"  speedup {timings['legacy'] / timings['compact']:.2f}x")
+
+
+def bench_workbook_snapshot(rows=200_000, accounts=5_000):
+    # Both reports loading ConsolidatedReport.xlsx: parsed per report and
+    # per sheet, against one snapshot build followed by Parquet reads.
+    from columnar_io import load_sheets
+    from workbook_snapshot import snapshot_dir
+
+    reports = [
+        load_script("excel processor.py", "excel_processor").CombinedReport,
+        load_script("unmatched-filter-aeging_report.py", "aeging_report").AegingReport,
+    ]
+    print(f"ConsolidatedReport.xlsx loads for {len(reports)} reports ({rows:,} rows)")
+    with tempfile.TemporaryDirectory() as directory:
+        workbook = write_consolidated_report(directory, rows, accounts, seed=1)
+        direct, direct_seconds = timed(lambda: [load_sheets(workbook, report.columns, snapshot=False) for report in reports])
+        built, build_seconds = timed(lambda: [load_sheets(workbook, report.columns) for report in reports])
+        cached, cached_seconds = timed(lambda: [load_sheets(workbook, report.columns) for report in reports])
+        snapshot_mb = sum(entry.stat().st_size for entry in os.scandir(snapshot_dir(workbook))) / 2**20
+        identical = all(
+            a.equals(b) and a.equals(c)
+            for frames in zip(direct, built, cached)
+            for a, b, c in zip(*frames)
+        )
+    print(f"  read_excel per report  {direct_seconds:8.3f}s")
+    print(f"  snapshot build         {build_seconds:8.3f}s  ({snapshot_mb:.1f} MB)")
+    print(f"  snapshot hit           {cached_seconds:8.3f}s  speedup {direct_seconds / cached_seconds:.1f}x")
+    print(f"  identical frames: {identical}")
+
+
+def unmatched_frame(rows, accounts, seed=0):
+    amounts = ((pl.int_range(rows, eager=True).hash(seed) % 10_000_000).cast(pl.Int64) - 5_000_000) / 100
+    df = pl.DataFrame({
+        "Side": pl.Series(["NOSTRO_GL", "NOSTRO_SWIFT"]).gather(pick(rows, seed + 1, [0, 1])),
+        "Value_Date": "2024-01-" + (pick(rows, seed + 2, range(28)) + 1).cast(pl.Utf8).str.zfill(2),
+        "GL_NUMBER": (pick(rows, seed + 3, range(accounts)) + 1_000_000).cast(pl.Utf8),
+        "Currency": pl.Series(CURRENCIES).gather(pick(rows, seed + 4, CURRENCIES)),
+        "Amount": amounts,
+    }).with_columns(
+        pl.when(pl.col("Amount") < 0).then(pl.lit("Dr")).otherwise(pl.lit("Cr")).alias("Dr/Cr"),
+        pl.col("Amount").abs(),
+    ).select("Side", "Value_Date", "GL_NUMBER", "Currency", "Dr/Cr", "Amount").with_columns(
+        pl.when(pl.col("Dr/Cr") == "Dr").then(pl.col("Amount")).otherwise(0).alias("Debit_Amount"),
+        pl.when(pl.col("Dr/Cr") == "Cr").then(pl.col("Amount")).otherwise(0).alias("Credit_Amount"),
+    )
+    return df
+
+
+def unmatched_blocks(rows, accounts, seed=0):
+    df = unmatched_frame(rows, accounts, seed)
+    blocks = df.sort("GL_NUMBER", maintain_order=True).partition_by("GL_NUMBER", maintain_order=True)
+    return [f"Account_Number: {b['GL_NUMBER'][0]}" for b in blocks], blocks
+
+
+def write_per_cell(output_file, titles, headers, blocks):
+    import xlsxwriter
+
+    workbook = xlsxwriter.Workbook(output_file)
+    worksheet = workbook.add_worksheet("Unmatched Data")
+    header_format = workbook.add_format({"bold": True, "bg_color": "yellow", "align": "center", "valign": "vcenter"})
+    column_header_format = workbook.add_format({"bold": True, "align": "center", "valign": "vcenter"})
+    data_format = workbook.add_format({"border": 1})
+    row_counter = 0
+    for title, block in zip(titles, blocks):
+        worksheet.merge_range(row_counter, 0, row_counter, len(headers) - 1, title, header_format)
+        row_counter += 2
+        for col_num, header_name in enumerate(headers):
+            worksheet.write(row_counter, col_num, header_name, column_header_format)
+        row_counter += 1
+        for row in block.iter_rows():
+            for col_num, cell_value in enumerate(row):
+                worksheet.write(row_counter, col_num, cell_value, data_format)
+            row_counter += 1
+        row_counter += 2
+    workbook.close()
+
+
+def bench_unmatched_writer(row_counts=(100_000, 1_000_000), accounts=20_000):
+    from excel_writer import BlockWorkbook
+
+    print("unmatched report writer: per-cell xlsxwriter vs BlockWorkbook")
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in row_counts:
+            titles, blocks = unmatched_blocks(rows, accounts)
+            headers = list(blocks[0].columns)
+            reference = os.path.join(directory, "per_cell.xlsx")
+            bulk = os.path.join(directory, "bulk.xlsx")
+            _, reference_elapsed = timed(write_per_cell, reference, titles, headers, blocks)
+
+            def write_bulk():
+                with BlockWorkbook(bulk, "Unmatched Data", {"bold": True, "bg_color": "yellow", "align": "center", "valign": "vcenter"},
+                                   {"bold": True, "align": "center", "valign": "vcenter"}, {"border": 1}) as workbook:
+                    workbook.write_blocks(titles, headers, blocks)
+
+            _, bulk_elapsed = timed(write_bulk)
+            # xlsxwriter silently drops rows past the sheet limit, so the
+            # outputs are only comparable when the report fits on one sheet.
+            sheets = pl.read_excel(bulk, sheet_id=0, has_header=False)
+            if len(sheets) == 1:
+                check = f"identical: {pl.read_excel(reference, has_header=False).equals(next(iter(sheets.values())))}"
+            else:
+                check = f"spilled to {len(sheets)} sheets"
+            print(
+                f"  rows={rows:>10,}  per-cell {reference_elapsed:8.3f}s  bulk {bulk_elapsed:8.3f}s  "
+                f"speedup {reference_elapsed / bulk_elapsed:5.1f}x  {check}"
+            )
+
+
+def per_account_scan(df):
+    sections = []
+    for account in df["GL_NUMBER"].unique().drop_nulls().to_list():
+        transactions = df.filter(pl.col("GL_NUMBER") == account)
+        credits = transactions.filter(pl.col("Dr/Cr") == "Cr")
+        debits = transactions.filter(pl.col("Dr/Cr") == "Dr")
+        sections.append((account, transactions, credits.height, credits["Credit_Amount"].sum(), debits.height, debits["Debit_Amount"].sum()))
+    return sections
+
+
+def indexed_sections(df):
+    from account_index import AccountIndex
+
+    index = AccountIndex(df, "GL_NUMBER")
+    return [
+        (account, transactions, totals["credit_count"], totals["credit_total"], totals["debit_count"], totals["debit_total"])
+        for account, transactions, totals in index
+    ]
+
+
+def bench_account_index(row_counts=(100_000, 1_000_000), account_counts=(1_000, 20_000)):
+    print("per-account report sections: filter per account vs AccountIndex")
+    for rows in row_counts:
+        for accounts in account_counts:
+            df = unmatched_frame(rows, accounts)
+            scanned, scan_elapsed = timed(per_account_scan, df)
+            indexed, index_elapsed = timed(indexed_sections, df)
+            same = {s[0]: s[2:5:2] for s in scanned} == {s[0]: s[2:5:2] for s in indexed} and all(
+                a[1].equals(b[1]) for a, b in zip(sorted(scanned, key=lambda s: s[0]), sorted(indexed, key=lambda s: s[0]))
+            )
+            print(
+                f"  rows={rows:>10,}  accounts={accounts:>6,}  scan {scan_elapsed:8.3f}s  index {index_elapsed:8.3f}s  "
+                f"speedup {scan_elapsed / index_elapsed:6.1f}x  same sections: {same}"
+            )
+
+
+def bench_currency_reports(rows=400_000, accounts=5_000, workers=(1, 4)):
+    # One filtering_data run per currency, each re-reading the unmatched
+    # CSVs (the old way of covering every currency), against one read
+    # partitioned by currency and written by a pool of workers.
+    import filtering_data
+
+    import matched_data
+    gl_df, swift_df = enriched_frames(matched_data, rows, accounts)
+    with contextlib.redirect_stdout(io.StringIO()):
+        _, unmatched_gl, _, unmatched_swift = matched_data.process_rules(gl_df, swift_df, matched_data.RULES)
+    print(f"per-currency unmatched reports ({unmatched_gl.height + unmatched_swift.height:,} unmatched rows)")
+    with tempfile.TemporaryDirectory() as directory:
+        gl_file, swift_file = os.path.join(directory, "unmatched_gl.csv"), os.path.join(directory, "unmatched_swift.csv")
+        unmatched_gl.write_csv(gl_file)
+        unmatched_swift.write_csv(swift_file)
+        currencies = list(filtering_data.currency_partitions(*filtering_data.load_unmatched(gl_file, swift_file)))
+
+        def per_currency_runs():
+            for currency in currencies:
+                filtering_data.currency_reports(
+                    *filtering_data.load_unmatched(gl_file, swift_file), [currency], os.path.join(directory, "single"), 1
+                )
+
+        os.makedirs(os.path.join(directory, "single"))
+        _, elapsed = timed(per_currency_runs)
+        print(f"  {len(currencies)} runs, one per currency  {elapsed:8.3f}s")
+        for count in workers:
+            output = os.path.join(directory, f"workers{count}")
+            os.makedirs(output)
+            _, elapsed = timed(lambda: filtering_data.currency_reports(
+                *filtering_data.load_unmatched(gl_file, swift_file), directory=output, workers=count
+            ))
+            same = all(
+                pl.read_excel(filtering_data.report_path(c, output), has_header=False).equals(
+                    pl.read_excel(filtering_data.report_path(c, os.path.join(directory, "single")), has_header=False)
+                )
+                for c in currencies
+            )
+            print(f"  one read, workers={count:<3}        {elapsed:8.3f}s  same workbooks: {same}")
+
+
+def rss_mb():
+    # Current resident set size; falls back to the process peak where
+    # /proc is not available.
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except OSError:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+class StageMeter:
+    # Times one stage and samples RSS on a background thread, so the peak
+    # covers memory allocated by Polars outside the Python heap.
+
+    def __init__(self, stage, interval=0.005):
+        self.stage = stage
+        self.interval = interval
+        self.peak = 0.0
+        self.stopped = threading.Event()
+
+    def sample(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, rss_mb())
+
+    def __enter__(self):
+        self.start_rss = self.peak = rss_mb()
+        self.thread = threading.Thread(target=self.sample, daemon=True)
+        self.thread.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.seconds = time.perf_counter() - self.start
+        self.stopped.set()
+        self.thread.join()
+        self.peak = max(self.peak, rss_mb())
+
+    def result(self):
+        return {
+            "stage": self.stage,
+            "seconds": round(self.seconds, 4),
+            "peak_rss_mb": round(self.peak, 1),
+            "start_rss_mb": round(self.start_rss, 1),
+        }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=HERE,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run_suite(rows, accounts, directory=None, results_file=None, seed=0, report_format="xlsx", **options):
+    # End to end: generate the feeds, then time and measure every stage on
+    # them. options go to the generators (rule_ratios, duplicate_rate,
+    # currencies, ageing).
+    import matched_data
+    import unmatched_record
+    combined_report = load_script("excel processor.py", "excel_processor")
+    ageing_report = load_script("unmatched-filter-aeging_report.py", "aeging_report")
+    ageing = options.pop("ageing", None)
+    stages = []
+
+    def measure(stage, func, *args, **kwargs):
+        with StageMeter(stage) as meter:
+            result = func(*args, **kwargs)
+        stages.append(meter.result())
+        print(f"  {stage:<18} {meter.seconds:9.3f}s  peak RSS {meter.peak:9.1f} MB")
+        return result
+
+    print(f"benchmark suite: {rows:,} rows, {accounts:,} accounts")
+    with contextlib.ExitStack() as stack:
+        if directory is None:
+            directory = stack.enter_context(tempfile.TemporaryDirectory())
+        os.makedirs(directory, exist_ok=True)
+
+        paths = measure("generate", write_nostro_csvs, directory, rows, accounts, seed=seed, **options)
+        report_input = write_consolidated_report(
+            directory, rows, accounts, seed=seed, report_format=report_format,
+            currencies=options.get("currencies"), ageing=ageing,
+        )
+
+        raw = measure("ingest", matched_data.read_inputs, paths["gl_file"], paths["mapping_file"], paths["swift_file"])
+        gl_df, swift_df = measure("enrich", matched_data.enrich_inputs, *raw)
+        del raw
+        matched_gl, unmatched_gl, matched_swift, unmatched_swift = measure(
+            "process_rules", matched_data.process_rules, gl_df, swift_df, matched_data.RULES
+        )
+
+        measure("combined_report", combined_report.CombinedReport(report_input, os.path.join(directory, "finalreport.xlsx")).generate_report)
+        measure("ageing_report", ageing_report.AegingReport(report_input, os.path.join(directory, "AegingReport.xlsx")).generate_report)
+
+        gl_export, swift_export = unmatched_record.unmatched_exports(unmatched_gl, unmatched_swift)
+        gl_export.write_parquet(os.path.join(directory, "NOSTRO_GL_UnMatched.parquet"))
+        swift_export.write_parquet(os.path.join(directory, "NOSTRO_SWIFT_UnMatched.parquet"))
+        measure("unmatched_record", lambda: unmatched_record.unmatchedtransactionsreport(
+            os.path.join(directory, "NOSTRO_GL_UnMatched.parquet"),
+            os.path.join(directory, "NOSTRO_SWIFT_UnMatched.parquet"),
+            os.path.join(directory, "unmatchedtransactionsreport.xlsx"),
+            paths["mapping_file"],
+        ).create_report())
+
+        # filtering_data.py is a script reading unmatched_gl.csv and
+        # unmatched_swift.csv from the working directory; it is run with
+        # its own command line, not this one.
+        unmatched_gl.write_csv(os.path.join(directory, "unmatched_gl.csv"))
+        unmatched_swift.write_csv(os.path.join(directory, "unmatched_swift.csv"))
+        script = os.path.join(HERE, "filtering_data.py")
+        cwd, argv = os.getcwd(), sys.argv
+        os.chdir(directory)
+        sys.argv = [script]
+        try:
+            measure("filtering_data", runpy.run_path, script, run_name="__main__")
+        finally:
+            os.chdir(cwd)
+            sys.argv = argv
+
+        # The same reports again from one load, concurrently (run_reports).
+        from run_reports import NightlyRun
+
+        def run_reports():
+            with contextlib.redirect_stdout(io.StringIO()):
+                return NightlyRun(directory, consolidated_report=os.path.basename(report_input)).run()
+
+        measure("run_reports", run_reports)
+
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "polars": pl.__version__,
+        "cpus": os.cpu_count(),
+        "parameters": {
+            "rows": rows, "accounts": accounts, "seed": seed, "report_format": report_format,
+            "ageing": None if ageing is None else {f"{low}-{high}": w for (low, high), w in ageing.items()},
+            **options,
+        },
+        "stages": stages,
+    }
+    if results_file:
+        os.makedirs(os.path.dirname(os.path.abspath(results_file)), exist_ok=True)
+        with open(results_file, "w") as out:
+            json.dump(results, out, indent=2)
+        print(f"  results written to {results_file}")
+    return results
+
+
+def compare_results(baseline_file, candidate_file):
+    with open(baseline_file) as f:
+        baseline = {stage["stage"]: stage for stage in json.load(f)["stages"]}
+    with open(candidate_file) as f:
+        candidate = json.load(f)["stages"]
+    print(f"{'stage':<18} {'baseline':>10} {'candidate':>10} {'time':>7} {'base MB':>10} {'new MB':>10}")
+    for stage in candidate:
+        before = baseline.get(stage["stage"])
+        if before is None:
+            continue
+        print(
+            f"{stage['stage']:<18} {before['seconds']:9.3f}s {stage['seconds']:9.3f}s "
+            f"{stage['seconds'] / max(before['seconds'], 1e-9):6.2f}x "
+            f"{before['peak_rss_mb']:10.1f} {stage['peak_rss_mb']:10.1f}"
+        )
+
+
+def parse_weights(values):
+    return {key: float(weight) for key, weight in (value.split("=") for value in values)} if values else None
+
+
+def parse_ageing(values):
+    weights = parse_weights(values)
+    if weights is None:
+        return None
+    return {tuple(int(day) for day in bucket.split("-")): weight for bucket, weight in weights.items()}
+
+
+def generator_options(args):
+    return {
+        "rule_ratios": args.rule_ratios,
+        "duplicate_rate": args.duplicate_rate,
+        "currencies": parse_weights(args.currencies),
+    }
+
+
+def run_micro_benchmarks():
+    bench_combined_report()
+    bench_ageing_report()
+    bench_ageing_trend()
+    bench_streaming()
+    bench_rule_count()
+    bench_sharding()
+    bench_tolerance_rules()
+    bench_reversals()
+    bench_duplicate_keys()
+    bench_aggregate_rules()
+    bench_inbox_watcher()
+    bench_unmatched_writer()
+    bench_account_index()
+    bench_currency_reports()
+    bench_compact_schema()
+    bench_workbook_snapshot()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest="command")
+
+    data_options = argparse.ArgumentParser(add_help=False)
+    data_options.add_argument("--rows", type=int, default=100_000)
+    data_options.add_argument("--accounts", type=int, default=5_000)
+    data_options.add_argument("--seed", type=int, default=0)
+    data_options.add_argument("--rule-ratios", type=float, nargs=3, metavar=("RULE1", "RULE2", "RULE3"),
+                              help="share of rows matched by each rule; the rest stay unmatched")
+    data_options.add_argument("--duplicate-rate", type=float, default=0.0, help="share of GL rows reusing a reference")
+    data_options.add_argument("--currencies", nargs="+", metavar="CUR=WEIGHT", help="currency mix, e.g. USD=6 EUR=3 GBP=1")
+    data_options.add_argument("--ageing", nargs="+", metavar="LOW-HIGH=WEIGHT", help="ageing buckets in days, e.g. 0-5=3 6-59=2 60-365=1")
+    data_options.add_argument("--report-format", choices=["xlsx", "parquet"], default="xlsx")
+
+    generate = commands.add_parser("generate", parents=[data_options], help="write synthetic feeds and ConsolidatedReport sheets")
+    generate.add_argument("directory")
+
+    suite = commands.add_parser("suite", parents=[data_options], help="time and measure every pipeline stage")
+    suite.add_argument("--directory", help="keep the generated data here instead of a temporary directory")
+    suite.add_argument("--json", help="write the results to this file")
+
+    compare = commands.add_parser("compare", help="compare two suite result files")
+    compare.add_argument("baseline")
+    compare.add_argument("candidate")
+
+    commands.add_parser("micro", help="run the component benchmarks (default)")
+    args = parser.parse_args()
+
+    if args.command == "generate":
+        os.makedirs(args.directory, exist_ok=True)
+        paths = write_nostro_csvs(args.directory, args.rows, args.accounts, seed=args.seed, **generator_options(args))
+        report = write_consolidated_report(
+            args.directory, args.rows, args.accounts, seed=args.seed, report_format=args.report_format,
+            currencies=parse_weights(args.currencies), ageing=parse_ageing(args.ageing),
+        )
+        print("\n".join(list(paths.values()) + [report]))
+    elif args.command == "suite":
+        run_suite(
+            args.rows, args.accounts, directory=args.directory, results_file=args.json, seed=args.seed,
+            report_format=args.report_format, ageing=parse_ageing(args.ageing), **generator_options(args),
+        )
+    elif args.command == "compare":
+        compare_results(args.baseline, args.candidate)
+    else:
+        run_micro_benchmarks()
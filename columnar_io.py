@@ -0,0 +1,124 @@
+import os
+
+import polars as pl
+
+from workbook_snapshot import workbook_snapshot
+
+SHEETS = {"NOSTRO_GL": "gl", "NOSTRO_SWIFT": "swift"}
+# Columns of the matched_data datasets that stand in for a
+# ConsolidatedReport column, per sheet.
+MATCHED_LAYOUT = {
+    "NOSTRO_GL": {"GL_NUMBER": "Account_Number", "EXECUTION_DATE_TIME": "Val/Settle Date", "EXECUTION_STATEMENTDATE": "Val/Settle Date"},
+    "NOSTRO_SWIFT": {"GL_NUMBER": "Nostro Account", "EXECUTION_DATE_TIME": "Entry Date", "EXECUTION_STATEMENTDATE": "Value Date"},
+}
+EXTENSIONS = {"csv": ".csv", "parquet": ".parquet", "ipc": ".arrow"}
+
+def table_format(path):
+    extension = os.path.splitext(path)[1].lower()
+    if extension == ".parquet":
+        return "parquet"
+    if extension in (".arrow", ".ipc", ".feather"):
+        return "ipc"
+    return "csv"
+
+def scan_table(path, schema_overrides=None):
+    # schema_overrides types CSV columns, which are otherwise inferred; a cell
+    # that does not parse raises rather than being read as null.
+    file_format = table_format(path)
+    if file_format == "parquet":
+        return pl.scan_parquet(path)
+    if file_format == "ipc":
+        # Uncompressed Arrow IPC files are memory-mapped by the scan.
+        return pl.scan_ipc(path)
+    return pl.scan_csv(path, schema_overrides=schema_overrides)
+
+def select_columns(table, columns, path):
+    if columns is None:
+        return table
+    available = table.collect_schema().names()
+    missing = [c for c in columns if c not in available]
+    if missing:
+        raise ValueError(f"{path} has no column(s) {', '.join(missing)}")
+    return table.select(columns)
+
+def read_table(path, columns=None, schema_overrides=None):
+    # Parquet and Arrow IPC reads only touch the projected columns; CSV is
+    # still parsed in full, so the columnar formats are preferred.
+    return select_columns(scan_table(path, schema_overrides), columns, path).collect()
+
+def write_table(df, path):
+    file_format = table_format(path)
+    if isinstance(df, pl.LazyFrame):
+        if file_format == "parquet":
+            return df.sink_parquet(path, lazy=True)
+        if file_format == "ipc":
+            return df.sink_ipc(path, lazy=True)
+        return df.sink_csv(path, lazy=True)
+    if file_format == "parquet":
+        df.write_parquet(path)
+    elif file_format == "ipc":
+        df.write_ipc(path)
+    else:
+        df.write_csv(path)
+
+def sheet_path(prefix, sheet):
+    for file_format in ("parquet", "ipc"):
+        path = f"{prefix}_{SHEETS[sheet]}{EXTENSIONS[file_format]}"
+        if os.path.exists(path):
+            return path
+    return None
+
+def load_sheets(input_file, columns=None, snapshot=True):
+    # An .xlsx workbook is parsed once into a Parquet snapshot (see
+    # workbook_snapshot) and read from there; anything else is treated as
+    # the prefix of <prefix>_gl / <prefix>_swift Parquet or Arrow IPC files,
+    # which may be matched_data output (see report_layout).
+    if input_file.lower().endswith((".xlsx", ".xls")):
+        if not snapshot:
+            return tuple(pl.read_excel(input_file, sheet_name=sheet, columns=columns) for sheet in SHEETS)
+        paths = workbook_snapshot(input_file, SHEETS)
+        return tuple(read_table(paths[sheet], columns) for sheet in SHEETS)
+
+    paths = []
+    for sheet in SHEETS:
+        path = sheet_path(input_file, sheet)
+        if path is None:
+            raise FileNotFoundError(f"No Parquet or Arrow IPC file for sheet {sheet} with prefix '{input_file}'")
+        paths.append(path)
+    tables = [scan_table(path) for path in paths]
+    if all(matcher_output(table) for table in tables):
+        as_of = pl.concat([table.select(statement_date(sheet)) for table, sheet in zip(tables, SHEETS)]).max().collect().item()
+        tables = [report_layout(table, sheet, as_of) for table, sheet in zip(tables, SHEETS)]
+    return tuple(select_columns(table, columns, path).collect() for table, path in zip(tables, paths))
+
+def matcher_output(table):
+    names = table.collect_schema().names()
+    return "Matching_Rule" in names and "MATCHING_STATUS" not in names
+
+def statement_date(sheet):
+    column = MATCHED_LAYOUT[sheet]["EXECUTION_STATEMENTDATE"]
+    return pl.col(column).cast(pl.Utf8).str.slice(0, 10).str.to_date(strict=False).alias("_date")
+
+def report_layout(table, sheet, as_of):
+    # matched_data rows in the ConsolidatedReport layout. A row is MATCHED
+    # or Reversal once a rule closed it and UNMATCHED otherwise; nothing is
+    # carried forward within one run, and AGEING counts the days from the
+    # statement date to the latest statement date of either sheet.
+    columns = MATCHED_LAYOUT[sheet]
+    debit = (pl.col("Dr/Cr") == "Dr").fill_null(False)
+    rule = pl.col("Matching_Rule").cast(pl.Utf8)
+    return table.select(
+        pl.col("Account Name").alias("GL_NAME"),
+        pl.col(columns["GL_NUMBER"]).alias("GL_NUMBER"),
+        pl.lit(sheet).alias("SOURCE"),
+        pl.col(columns["EXECUTION_DATE_TIME"]).alias("EXECUTION_DATE_TIME"),
+        pl.col("Account Currency").alias("CURRENCY"),
+        pl.col(columns["EXECUTION_STATEMENTDATE"]).alias("EXECUTION_STATEMENTDATE"),
+        pl.col("DC_AMOUNT"),
+        pl.col("Dr/Cr").alias("Dr/Cr Ind"),
+        pl.when(debit).then(pl.col("DC_AMOUNT")).otherwise(0).alias("Total Debit"),
+        pl.when(debit).then(0).otherwise(pl.col("DC_AMOUNT")).alias("Total Credit"),
+        pl.lit("N").alias("CARRY_FORWARD"),
+        pl.when(rule == "Unmatched").then(pl.lit("UNMATCHED")).when(rule == "Reversal").then(pl.lit("Reversal")).otherwise(pl.lit("MATCHED")).alias("MATCHING_STATUS"),
+        (pl.lit(as_of) - statement_date(sheet)).dt.total_days().alias("AGEING"),
+    )
@@ -0,0 +1,58 @@
+import polars as pl
+
+# Amounts are fixed-point with three decimals, enough for the minor unit of
+# every ISO 4217 currency. Equal amounts are then equal join keys exactly
+# (0.1 + 0.2 == 0.3), which a Float64 key does not guarantee. Matching keeps
+# DC_AMOUNT as a Decimal; the reports, which only sum amounts, hold them as
+# Int64 thousandths (half the width of a Decimal) and convert back on output.
+AMOUNT_SCALE = 3
+AMOUNT = pl.Decimal(38, AMOUNT_SCALE)
+# Largest amount the reports can hold in Int64 thousandths, about 9.2e15.
+MINOR_UNITS_MAX = (2**63 - 1) / 10**AMOUNT_SCALE
+
+# Values the pipeline produces itself are Enums; low-cardinality text read
+# from the feeds, the mapping or the ConsolidatedReport is Categorical, as
+# it may hold values we have not seen before.
+DR_CR = pl.Enum(["Dr", "Cr"])
+
+GL_CATEGORICAL = [
+    "Nostro/Vostro/ Sett Entity ID", "Nostro/Vostro/ Sett Entity Cur", "MAPS_TRDVERIFY-IMPORT", "FEED_FILE_NAME",
+]
+SWIFT_CATEGORICAL = ["Nostro Account", "Description", "FEED_FILE_NAME", "Currency Dr/Cr"]
+MAPPING_CATEGORICAL = ["Account Name", "Account Currency", "Account_Number", "Swift Code", "Country"]
+REPORT_CATEGORICAL = ["GL_NAME", "GL_NUMBER", "SOURCE", "CURRENCY", "Dr/Cr Ind", "CARRY_FORWARD", "MATCHING_STATUS"]
+REPORT_AMOUNTS = ["DC_AMOUNT", "Total Debit", "Total Credit"]
+
+def amount(expr):
+    # Text or float amounts to AMOUNT; unparseable values become null.
+    return expr.cast(pl.Float64, strict=False).cast(AMOUNT)
+
+def minor_units(expr):
+    return (expr.cast(pl.Float64, strict=False) * 10**AMOUNT_SCALE).round().cast(pl.Int64)
+
+def major_units(expr):
+    return expr.cast(pl.Float64) / 10**AMOUNT_SCALE
+
+def categorical(df, columns):
+    available = df.collect_schema().names()
+    return df.with_columns([pl.col(c).cast(pl.Utf8).cast(pl.Categorical) for c in columns if c in available])
+
+def check_minor_units(df, columns):
+    # Amounts past MINOR_UNITS_MAX are valid AMOUNT values but would
+    # overflow the Int64 cast of minor_units.
+    largest = df.select([pl.col(c).cast(pl.Float64, strict=False).abs().max() for c in columns]).collect()
+    for column, value in largest.row(0, named=True).items() if columns else ():
+        if value is not None and value >= MINOR_UNITS_MAX:
+            raise ValueError(f"{column} holds {value:,.3f}; the reports take amounts up to {MINOR_UNITS_MAX:,.0f}")
+
+def compact_report(df):
+    # ConsolidatedReport sheets as read by CombinedReport and AegingReport;
+    # amounts are in minor units.
+    available = df.collect_schema().names()
+    amounts = [c for c in REPORT_AMOUNTS if c in available]
+    check_minor_units(df.lazy(), amounts)
+    df = categorical(df, REPORT_CATEGORICAL)
+    return df.with_columns(
+        [minor_units(pl.col(c)) for c in amounts]
+        + ([pl.col("AGEING").cast(pl.Int32, strict=False)] if "AGEING" in available else [])
+    )
@@ -1,147 +1,136 @@
 import polars as pl
 
+from columnar_io import load_sheets
+from compact_schema import compact_report, major_units
+from stage_metrics import metrics
+
 class CombinedReport:
+    columns = [
+        "GL_NAME", "GL_NUMBER", "SOURCE", "EXECUTION_DATE_TIME",
+        "CURRENCY", "EXECUTION_STATEMENTDATE", "DC_AMOUNT",
+        "Dr/Cr Ind", "Total Debit", "Total Credit",
+        "CARRY_FORWARD", "MATCHING_STATUS"
+    ]
+
     def __init__(self, input_file, output_file):
         self.input_file = input_file
         self.output_file = output_file
 
     def load_data(self):
-        gl_df = pl.read_excel(self.input_file, sheet_name="NOSTRO_GL")
-        swift_df = pl.read_excel(self.input_file, sheet_name="NOSTRO_SWIFT")
+        # input_file is either the ConsolidatedReport workbook or the prefix
+        # of <prefix>_gl / <prefix>_swift Parquet or Arrow IPC datasets.
+        gl_df, swift_df = load_sheets(self.input_file, self.columns)
         return gl_df, swift_df
 
     def process_data(self, gl_df, swift_df):
-        columns = [
-            "GL_NAME", "GL_NUMBER", "SOURCE", "EXECUTION_DATE_TIME",
-            "CURRENCY", "EXECUTION_STATEMENTDATE", "DC_AMOUNT",
-            "Dr/Cr Ind", "Total Debit", "Total Credit",
-            "CARRY_FORWARD", "MATCHING_STATUS"
-        ]
-        combined_df = pl.concat([gl_df.select(columns), swift_df.select(columns)], how="vertical")
-
-        numeric_columns = ["DC_AMOUNT", "Total Debit", "Total Credit"]
-        for col in numeric_columns:
-            combined_df = combined_df.with_columns(
-                pl.col(col).cast(pl.Float64)  
-            )
-
-        unique_accounts = combined_df.select("GL_NUMBER").unique().to_series().to_list()
-        results = []
-
-        for account in unique_accounts:
-            for source in ["NOSTRO_GL", "NOSTRO_SWIFT"]:
-                unmatched_df = combined_df.filter(
-                    (pl.col("GL_NUMBER") == account) &
-                    (pl.col("SOURCE") == source) &
-                    (pl.col("CARRY_FORWARD") == "N") &
-                    (pl.col("MATCHING_STATUS") == "UNMATCHED")
-                )
-                
-                unmatched_dc_amount = unmatched_df["DC_AMOUNT"].sum() 
-                unmatched_dc_count = unmatched_df.height
-                
-                debit_unmatched_amount = unmatched_df["Total Debit"].sum() 
-                credit_unmatched_amount = unmatched_df["Total Credit"].sum() 
-                debit_unmatched_count = unmatched_df.filter(pl.col("Total Debit") > 0).height
-                credit_unmatched_count = unmatched_df.filter(pl.col("Total Credit") > 0).height
-                
-                matched_df = combined_df.filter(
-                    (pl.col("GL_NUMBER") == account) &
-                    (pl.col("SOURCE") == source) &
-                    (pl.col("CARRY_FORWARD") == "N") &
-                    (pl.col("MATCHING_STATUS") == "MATCHED")
-                )
-                
-                matched_dc_amount = matched_df["DC_AMOUNT"].sum() 
-                matched_dc_count = matched_df.height
-                
-                debit_matched_amount = matched_df["Total Debit"].sum() 
-                credit_matched_amount = matched_df["Total Credit"].sum()
-                debit_matched_count = matched_df.filter(pl.col("Total Debit") > 0).height
-                credit_matched_count = matched_df.filter(pl.col("Total Credit") > 0).height
-
-                reversal_amount = 0
-                reversal_count = 0
-                debit_reversal_amount = 0
-                debit_reversal_count = 0
-                credit_reversal_amount = 0
-                credit_reversal_count = 0
-
-                if source == "NOSTRO_GL":
-                    reversal_df = combined_df.filter(
-                        (pl.col("GL_NUMBER") == account) &
-                        (pl.col("SOURCE") == "NOSTRO_SWIFT") &
-                        (pl.col("MATCHING_STATUS") == "Reversal")
-                    )
-                else:
-                    reversal_df = combined_df.filter(
-                        (pl.col("GL_NUMBER") == account) &
-                        (pl.col("SOURCE") == "NOSTRO_GL") &
-                        (pl.col("MATCHING_STATUS") == "Reversal")
-                    )
-
-                reversal_amount = reversal_df["DC_AMOUNT"].sum()
-                reversal_count = reversal_df.height
-                debit_reversal_amount = reversal_df["Total Debit"].sum()
-                debit_reversal_count = reversal_df.filter(pl.col("Total Debit") > 0).height
-                credit_reversal_amount = reversal_df["Total Credit"].sum()
-                credit_reversal_count = reversal_df.filter(pl.col("Total Credit") > 0).height
-
-                carry_forward_matched_df = combined_df.filter(
-                    (pl.col("GL_NUMBER") == account) &
-                    (pl.col("SOURCE") == source) &
-                    (pl.col("CARRY_FORWARD") == "Y") &
-                    (pl.col("MATCHING_STATUS") == "MATCHED")
-                )
-                carry_forward_matched_amount = carry_forward_matched_df["DC_AMOUNT"].sum()
-                carry_forward_matched_count = carry_forward_matched_df.height
-
-                carry_forward_unmatched_df = combined_df.filter(
-                    (pl.col("GL_NUMBER") == account) &
-                    (pl.col("SOURCE") == source) &
-                    (pl.col("CARRY_FORWARD") == "Y") &
-                    (pl.col("MATCHING_STATUS") == "UNMATCHED")
-                )
-                carry_forward_unmatched_amount = carry_forward_unmatched_df["DC_AMOUNT"].sum()
-                carry_forward_unmatched_count = carry_forward_unmatched_df.height
-
-                results.append({
-                    "GL_NUMBER": account,
-                    "SOURCE": source,
-                    "Matched_DC_Amount": matched_dc_amount,
-                    "Matched_DC_Count": matched_dc_count,
-                    "Unmatched_DC_Amount": unmatched_dc_amount,
-                    "Unmatched_DC_Count": unmatched_dc_count,
-                    "Debit_Matched_Amount": debit_matched_amount,
-                    "Debit_Matched_Count": debit_matched_count,
-                    "Debit_Unmatched_Amount": debit_unmatched_amount,
-                    "Debit_Unmatched_Count": debit_unmatched_count,
-                    "Credit_Matched_Amount": credit_matched_amount,
-                    "Credit_Matched_Count": credit_matched_count,
-                    "Credit_Unmatched_Amount": credit_unmatched_amount,
-                    "Credit_Unmatched_Count": credit_unmatched_count,
-                    "ReversalAmount": reversal_amount,
-                    "ReversalCount": reversal_count,
-                    "Debit-ReversalAmount": debit_reversal_amount,
-                    "Debit-ReversalCount": debit_reversal_count,
-                    "Credit-ReversalAmount": credit_reversal_amount,
-                    "Credit-ReversalCount": credit_reversal_count,
-                    "Carry-ForwardMatchedAmount": carry_forward_matched_amount,
-                    "Carry-ForwardMatchedCount": carry_forward_matched_count,
-                    "Carry-ForwardUnmatchedAmount": carry_forward_unmatched_amount,
-                    "Carry-ForwardUnmatchedCount": carry_forward_unmatched_count,
-                })
-
-        results_df = pl.DataFrame(results)
-        return results_df
+        columns = self.columns
+        # Amounts become integer minor units and the status, source and
+        # account columns Categorical before the sheets are combined.
+        combined_df = pl.concat([compact_report(gl_df.select(columns)), compact_report(swift_df.select(columns))], how="vertical")
+
+        return self.aggregate(combined_df)
+
+    def aggregate(self, combined_df):
+        sources = ["NOSTRO_GL", "NOSTRO_SWIFT"]
+        status = pl.col("MATCHING_STATUS")
+        carry_forward = pl.col("CARRY_FORWARD")
+        debit = (pl.col("Total Debit") > 0).fill_null(False)
+        credit = (pl.col("Total Credit") > 0).fill_null(False)
+
+        masks = {
+            "matched": ((carry_forward == "N") & (status == "MATCHED")).fill_null(False),
+            "unmatched": ((carry_forward == "N") & (status == "UNMATCHED")).fill_null(False),
+            "reversal": (status == "Reversal").fill_null(False),
+            "cf_matched": ((carry_forward == "Y") & (status == "MATCHED")).fill_null(False),
+            "cf_unmatched": ((carry_forward == "Y") & (status == "UNMATCHED")).fill_null(False),
+        }
+
+        aggs = []
+        for name, mask in masks.items():
+            aggs += [
+                pl.col("DC_AMOUNT").filter(mask).sum().alias(f"{name}_amount"),
+                mask.sum().cast(pl.Int64).alias(f"{name}_count"),
+            ]
+            if name in ("matched", "unmatched", "reversal"):
+                aggs += [
+                    pl.col("Total Debit").filter(mask).sum().alias(f"{name}_debit_amount"),
+                    (mask & debit).sum().cast(pl.Int64).alias(f"{name}_debit_count"),
+                    pl.col("Total Credit").filter(mask).sum().alias(f"{name}_credit_amount"),
+                    (mask & credit).sum().cast(pl.Int64).alias(f"{name}_credit_count"),
+                ]
+
+        grouped = (
+            combined_df.filter(pl.col("SOURCE").is_in(sources))
+            .group_by(["GL_NUMBER", "SOURCE"])
+            .agg(aggs)
+        )
+
+        # Reversals are reported against the opposite side, so the reversal
+        # aggregates of one source are joined onto the other source's row.
+        reversal_columns = [c for c in grouped.columns if c.startswith("reversal_")]
+        reversals = grouped.select(
+            "GL_NUMBER",
+            pl.col("SOURCE").replace({sources[0]: sources[1], sources[1]: sources[0]}),
+            *reversal_columns,
+        )
+
+        accounts = combined_df.select("GL_NUMBER").unique(maintain_order=True)
+        skeleton = accounts.join(pl.DataFrame({"SOURCE": sources}, schema={"SOURCE": pl.Categorical}), how="cross")
+        result = (
+            skeleton
+            .join(grouped.drop(reversal_columns), on=["GL_NUMBER", "SOURCE"], how="left")
+            .join(reversals, on=["GL_NUMBER", "SOURCE"], how="left")
+        )
+        metric_columns = [c for c in result.columns if c not in ("GL_NUMBER", "SOURCE")]
+        result = result.with_columns(
+            [pl.col(c).fill_null(0) for c in metric_columns]
+        ).with_columns(
+            [major_units(pl.col(c)) for c in metric_columns if c.endswith("_amount")]
+        )
+
+        return result.select(
+            "GL_NUMBER",
+            "SOURCE",
+            pl.col("matched_amount").alias("Matched_DC_Amount"),
+            pl.col("matched_count").alias("Matched_DC_Count"),
+            pl.col("unmatched_amount").alias("Unmatched_DC_Amount"),
+            pl.col("unmatched_count").alias("Unmatched_DC_Count"),
+            pl.col("matched_debit_amount").alias("Debit_Matched_Amount"),
+            pl.col("matched_debit_count").alias("Debit_Matched_Count"),
+            pl.col("unmatched_debit_amount").alias("Debit_Unmatched_Amount"),
+            pl.col("unmatched_debit_count").alias("Debit_Unmatched_Count"),
+            pl.col("matched_credit_amount").alias("Credit_Matched_Amount"),
+            pl.col("matched_credit_count").alias("Credit_Matched_Count"),
+            pl.col("unmatched_credit_amount").alias("Credit_Unmatched_Amount"),
+            pl.col("unmatched_credit_count").alias("Credit_Unmatched_Count"),
+            pl.col("reversal_amount").alias("ReversalAmount"),
+            pl.col("reversal_count").alias("ReversalCount"),
+            pl.col("reversal_debit_amount").alias("Debit-ReversalAmount"),
+            pl.col("reversal_debit_count").alias("Debit-ReversalCount"),
+            pl.col("reversal_credit_amount").alias("Credit-ReversalAmount"),
+            pl.col("reversal_credit_count").alias("Credit-ReversalCount"),
+            pl.col("cf_matched_amount").alias("Carry-ForwardMatchedAmount"),
+            pl.col("cf_matched_count").alias("Carry-ForwardMatchedCount"),
+            pl.col("cf_unmatched_amount").alias("Carry-ForwardUnmatchedAmount"),
+            pl.col("cf_unmatched_count").alias("Carry-ForwardUnmatchedCount"),
+        )
 
     def save_to_excel(self, combined_df):
         combined_df.write_excel(self.output_file)
 
     def generate_report(self):
-        gl_df, swift_df = self.load_data()
-        processed_data = self.process_data(gl_df, swift_df)
-        self.save_to_excel(processed_data)
+        with metrics.stage("CombinedReport.load") as record:
+            gl_df, swift_df = self.load_data()
+            record["rows_out"] = gl_df.height + swift_df.height
+        self.build_report(gl_df, swift_df)
+
+    def build_report(self, gl_df, swift_df):
+        # Sheets already loaded, possibly with other reports' columns too.
+        with metrics.stage("CombinedReport.process", rows_in=gl_df.height + swift_df.height) as record:
+            processed_data = self.process_data(gl_df, swift_df)
+            record["rows_out"] = processed_data.height
+        with metrics.stage("CombinedReport.save", rows_in=processed_data.height):
+            self.save_to_excel(processed_data)
 
 if __name__ == "__main__":
     report = CombinedReport('ConsolidatedReport.xlsx', 'finalreport.xlsx')
@@ -0,0 +1,282 @@
+import zipfile
+from xml.sax.saxutils import escape
+
+import polars as pl
+
+EXCEL_MAX_ROWS = 1_048_576
+EXCEL_MAX_SHEET_NAME = 31
+
+NAMED_COLORS = {"yellow": "FFFFFF00", "red": "FFFF0000", "green": "FF00FF00", "blue": "FF0000FF", "gray": "FF808080", "white": "FFFFFFFF"}
+HORIZONTAL = {"left": "left", "center": "center", "right": "right"}
+VERTICAL = {"top": "top", "vcenter": "center", "bottom": "bottom"}
+
+MAIN_NS = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PKG_REL_NS = "http://schemas.openxmlformats.org/package/2006/relationships"
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+def column_letter(index):
+    letters = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+def color(value):
+    if value.startswith("#"):
+        return "FF" + value[1:].upper()
+    return NAMED_COLORS[value]
+
+class BlockWorkbook:
+    # Streams report blocks (a merged title row, a column-header row and the
+    # data rows) straight into the .xlsx package. Rows are rendered to XML
+    # with vectorised polars string expressions a chunk at a time, so beyond
+    # the frames passed in only one chunk's rows and XML are held at once,
+    # and no per-cell Python call is made. Formats use the same
+    # dict keys as xlsxwriter: bold, bg_color, align, valign and border.
+
+    def __init__(self, output_file, sheet_name, header_format, column_header_format, data_format,
+                 max_rows=EXCEL_MAX_ROWS, chunk_rows=100_000):
+        self.sheet_name = sheet_name
+        self.max_rows = max_rows
+        self.chunk_rows = chunk_rows
+        self.styles = []
+        self.header_style = self.add_format(header_format)
+        self.column_header_style = self.add_format(column_header_format)
+        self.data_style = self.add_format(data_format)
+
+        self.package = zipfile.ZipFile(output_file, "w", zipfile.ZIP_DEFLATED, compresslevel=1)
+        self.sheets = []
+        self.stream = None
+        self.merges = []
+        self.row_counter = 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def add_format(self, properties):
+        self.styles.append(properties or {})
+        return len(self.styles)
+
+    def new_sheet(self):
+        self.close_sheet()
+        number = len(self.sheets) + 1
+        name = self.sheet_name if number == 1 else f"{self.sheet_name} ({number})"
+        if len(name) > EXCEL_MAX_SHEET_NAME:
+            suffix = f" ({number})" if number > 1 else ""
+            name = self.sheet_name[:EXCEL_MAX_SHEET_NAME - len(suffix)] + suffix
+        self.sheets.append(name)
+        self.stream = self.package.open(f"xl/worksheets/sheet{number}.xml", "w", force_zip64=True)
+        self.stream.write(f'{XML_HEADER}<worksheet xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"><sheetData>'.encode())
+        self.merges = []
+        self.row_counter = 0
+
+    def close_sheet(self):
+        if self.stream is None:
+            return
+        tail = "</sheetData>"
+        if self.merges:
+            tail += f'<mergeCells count="{len(self.merges)}">'
+            tail += "".join(f'<mergeCell ref="{ref}"/>' for ref in self.merges)
+            tail += "</mergeCells>"
+        self.stream.write((tail + "</worksheet>").encode())
+        self.stream.close()
+        self.stream = None
+
+    def title_row(self, row, title, width):
+        cells = [f'<c r="A{row + 1}" s="{self.header_style}" t="inlineStr"><is><t xml:space="preserve">{escape(title)}</t></is></c>']
+        cells += [f'<c r="{column_letter(i)}{row + 1}" s="{self.header_style}"/>' for i in range(1, width)]
+        self.merges.append(f"A{row + 1}:{column_letter(width - 1)}{row + 1}")
+        return f'<row r="{row + 1}">{"".join(cells)}</row>'
+
+    def column_header_row(self, row, headers):
+        cells = "".join(
+            f'<c r="{column_letter(i)}{row + 1}" s="{self.column_header_style}" t="inlineStr"><is><t xml:space="preserve">{escape(str(h))}</t></is></c>'
+            for i, h in enumerate(headers)
+        )
+        return f'<row r="{row + 1}">{cells}</row>'
+
+    def cell_expression(self, index, name, dtype, row_number):
+        ref = f'<c r="{column_letter(index)}{{}}" s="{self.data_style}"'
+        blank = pl.format(ref + "/>", row_number)
+        value = pl.col(name)
+        if dtype.is_numeric():
+            valid = value.is_not_null() & value.cast(pl.Float64).is_finite()
+            return pl.when(valid).then(pl.format(ref + "><v>{}</v></c>", row_number, value)).otherwise(blank)
+        if dtype == pl.Boolean:
+            return pl.when(value.is_not_null()).then(
+                pl.format(ref + ' t="b"><v>{}</v></c>', row_number, value.cast(pl.UInt8))
+            ).otherwise(blank)
+        text = (
+            value.cast(pl.Utf8)
+            .str.replace_all("&", "&amp;", literal=True)
+            .str.replace_all("<", "&lt;", literal=True)
+            .str.replace_all(">", "&gt;", literal=True)
+            .str.replace_all(r"[\x00-\x08\x0b\x0c\x0e-\x1f]", "")
+        )
+        return pl.when(value.is_not_null()).then(
+            pl.format(ref + ' t="inlineStr"><is><t xml:space="preserve">{}</t></is></c>', row_number, text)
+        ).otherwise(blank)
+
+    def layout(self, titles, sizes):
+        # Block layout: title, blank row, column headers, data, two blank rows.
+        # A block that does not fit on the current sheet starts a new one, and
+        # a block larger than a whole sheet is split with a continued title.
+        pieces = []
+        sheet = len(self.sheets) - 1 if self.stream is not None else None
+        row = self.row_counter
+        start = 0
+        for title, size in zip(titles, sizes):
+            offset = 0
+            while offset == 0 or offset < size:
+                remaining = size - offset
+                if sheet is None or row + 3 + min(remaining, self.max_rows - 3) > self.max_rows:
+                    sheet = len(self.sheets) if sheet is None else sheet + 1
+                    row = 0
+                length = min(remaining, self.max_rows - row - 3)
+                pieces.append((sheet, row, start + offset, length, title if offset == 0 else f"{title} (continued)"))
+                row += 3 + length + 2
+                offset += length
+                if size == 0:
+                    break
+            start += size
+        return pieces
+
+    def write_blocks(self, titles, headers, frames):
+        # All blocks are laid out first, then the data rows are rendered in
+        # vectorised chunks of up to chunk_rows rows that may span several
+        # small blocks, instead of one polars pass per block. Only the
+        # current chunk is copied out of the frames, so memory grows with
+        # chunk_rows, not with the report. Title and column-header rows are
+        # merged in by their (1-based) row number.
+        pieces = self.layout(titles, [df.height for df in frames])
+        starts = [0]
+        for df in frames:
+            starts.append(starts[-1] + df.height)
+        data_pieces = [piece for piece in pieces if piece[3]]
+        piece_starts = pl.Series([start for _, _, start, _, _ in data_pieces], dtype=pl.Int64)
+        bases = pl.Series([row + 4 - start for _, row, start, _, _ in data_pieces], dtype=pl.Int64)
+
+        schema = frames[0].schema if frames else {}
+        cells = [self.cell_expression(i, name, dtype, pl.col("_row")) for i, (name, dtype) in enumerate(schema.items())]
+        row_xml = pl.concat_str([pl.format('<row r="{}">', pl.col("_row")), *cells, pl.lit("</row>")]).alias("_xml")
+
+        def chunk(begin, end):
+            # Data rows begin..end of the blocks taken together, numbered
+            # with their sheet row.
+            parts = [
+                df.slice(max(begin - start, 0), min(end, start + df.height) - max(begin, start))
+                for df, start in zip(frames, starts) if start < end and start + df.height > begin
+            ]
+            index = pl.int_range(begin, end, dtype=pl.Int64, eager=True)
+            row = bases.gather(piece_starts.search_sorted(index, side="right") - 1) + index
+            return pl.concat(parts).with_columns(_row=row).select("_row", row_xml)
+
+        for sheet in sorted({piece[0] for piece in pieces}):
+            sheet_pieces = [piece for piece in pieces if piece[0] == sheet]
+            if sheet >= len(self.sheets):
+                self.new_sheet()
+            fixed = []
+            for _, row, _, _, title in sheet_pieces:
+                fixed.append((row + 1, self.title_row(row, title, len(headers))))
+                fixed.append((row + 3, self.column_header_row(row + 2, headers)))
+            fixed = pl.DataFrame(fixed, schema={"_row": pl.Int64, "_xml": pl.Utf8}, orient="row")
+
+            first = sheet_pieces[0][2]
+            last = sheet_pieces[-1][2] + sheet_pieces[-1][3]
+            chunk_start = first
+            while True:
+                chunk_end = min(chunk_start + self.chunk_rows, last)
+                rows = chunk(chunk_start, chunk_end) if chunk_end > chunk_start else fixed.clear()
+                if chunk_end < last:
+                    head, fixed = fixed.filter(pl.col("_row") < rows["_row"].max()), fixed.filter(pl.col("_row") > rows["_row"].max())
+                else:
+                    head, fixed = fixed, fixed.clear()
+                xml = pl.concat([head, rows]).sort("_row").select(pl.col("_xml").str.join("")).item()
+                self.stream.write(xml.encode())
+                if chunk_end >= last:
+                    break
+                chunk_start = chunk_end
+
+            self.row_counter = sheet_pieces[-1][1] + 3 + sheet_pieces[-1][3] + 2
+
+    def write_block(self, title, headers, df):
+        self.write_blocks([title], headers, [df])
+
+    def styles_xml(self):
+        fills = ['<fill><patternFill patternType="none"/></fill>', '<fill><patternFill patternType="gray125"/></fill>']
+        xfs = ['<xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>']
+        for properties in self.styles:
+            font_id = 1 if properties.get("bold") else 0
+            fill_id = 0
+            if "bg_color" in properties:
+                fills.append(f'<fill><patternFill patternType="solid"><fgColor rgb="{color(properties["bg_color"])}"/><bgColor indexed="64"/></patternFill></fill>')
+                fill_id = len(fills) - 1
+            border_id = 1 if properties.get("border") else 0
+            alignment = ""
+            if "align" in properties or "valign" in properties:
+                attributes = []
+                if "align" in properties:
+                    attributes.append(f'horizontal="{HORIZONTAL[properties["align"]]}"')
+                if "valign" in properties:
+                    attributes.append(f'vertical="{VERTICAL[properties["valign"]]}"')
+                alignment = f'<alignment {" ".join(attributes)}/>'
+            xfs.append(
+                f'<xf numFmtId="0" fontId="{font_id}" fillId="{fill_id}" borderId="{border_id}" xfId="0"'
+                f' applyFont="1" applyFill="1" applyBorder="1" applyAlignment="1">{alignment}</xf>'
+            )
+        thin = '<{0} style="thin"><color auto="1"/></{0}>'
+        return (
+            f'{XML_HEADER}<styleSheet xmlns="{MAIN_NS}">'
+            '<fonts count="2"><font><sz val="11"/><name val="Calibri"/></font><font><b/><sz val="11"/><name val="Calibri"/></font></fonts>'
+            f'<fills count="{len(fills)}">{"".join(fills)}</fills>'
+            '<borders count="2"><border><left/><right/><top/><bottom/><diagonal/></border>'
+            f'<border>{"".join(thin.format(side) for side in ("left", "right", "top", "bottom"))}<diagonal/></border></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            f'<cellXfs count="{len(xfs)}">{"".join(xfs)}</cellXfs>'
+            '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+            '</styleSheet>'
+        )
+
+    def close(self):
+        if self.package is None:
+            return
+        if not self.sheets:
+            self.new_sheet()
+        self.close_sheet()
+
+        sheets = "".join(
+            f'<sheet name="{escape(name, {chr(34): "&quot;"})}" sheetId="{i}" r:id="rId{i}"/>'
+            for i, name in enumerate(self.sheets, start=1)
+        )
+        relationships = "".join(
+            f'<Relationship Id="rId{i}" Type="{REL_NS}/worksheet" Target="worksheets/sheet{i}.xml"/>'
+            for i in range(1, len(self.sheets) + 1)
+        )
+        relationships += f'<Relationship Id="rId{len(self.sheets) + 1}" Type="{REL_NS}/styles" Target="styles.xml"/>'
+        overrides = "".join(
+            f'<Override PartName="/xl/worksheets/sheet{i}.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+            for i in range(1, len(self.sheets) + 1)
+        )
+
+        self.package.writestr("xl/workbook.xml", f'{XML_HEADER}<workbook xmlns="{MAIN_NS}" xmlns:r="{REL_NS}"><sheets>{sheets}</sheets></workbook>')
+        self.package.writestr("xl/_rels/workbook.xml.rels", f'{XML_HEADER}<Relationships xmlns="{PKG_REL_NS}">{relationships}</Relationships>')
+        self.package.writestr("xl/styles.xml", self.styles_xml())
+        self.package.writestr("_rels/.rels", (
+            f'{XML_HEADER}<Relationships xmlns="{PKG_REL_NS}">'
+            f'<Relationship Id="rId1" Type="{REL_NS}/officeDocument" Target="xl/workbook.xml"/></Relationships>'
+        ))
+        self.package.writestr("[Content_Types].xml", (
+            f'{XML_HEADER}<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            f'{overrides}</Types>'
+        ))
+        self.package.close()
+        self.package = None
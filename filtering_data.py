@@ -1,83 +1,148 @@
+import argparse
+import os
+import re
+from pathlib import Path
+
 import polars as pl
-import xlsxwriter
 
-unmatched_gl = pl.read_csv('unmatched_gl.csv', ignore_errors=True).with_columns( pl.col('Account_Number').cast(pl.Utf8))
-  
-unmatched_swift = pl.read_csv('unmatched_swift.csv', ignore_errors=True).with_columns(pl.col('Nostro Account').cast(pl.Utf8))
+from account_index import AccountIndex, name_lookup
+from columnar_io import read_table
+from excel_writer import BlockWorkbook
+from stage_metrics import metrics
+from worker_pool import worker_pool
 
-gl_unmatched = unmatched_gl.filter(pl.col('Nostro/Vostro/ Sett Entity Cur') == 'USD')
-swift_unmatched = unmatched_swift.filter(pl.col('Account Currency') == 'USD')
+gl_schema = {
+    'Account_Number': pl.Utf8, 'Account Name': pl.Utf8, 'Nostro/Vostro/ Sett Entity Cur': pl.Utf8,
+    'Cash Amt': pl.Float64, 'Val/Settle Date': pl.Utf8,
+}
+swift_schema = {
+    'Nostro Account': pl.Utf8, 'Account Name': pl.Utf8, 'Account Currency': pl.Utf8,
+    'Amount': pl.Float64, 'Value Date': pl.Utf8,
+}
+gl_columns = list(gl_schema)
+swift_columns = list(swift_schema)
+gl_currency = 'Nostro/Vostro/ Sett Entity Cur'
+swift_currency = 'Account Currency'
 
-usd_account_numbers = pl.concat([
-    swift_unmatched.select(pl.col('Nostro Account').alias('Account_Number')),gl_unmatched.select('Account_Number')
-]).unique().drop_nulls()
+header_format = {'bold': True, 'bg_color': 'yellow', 'align': 'center', 'valign': 'vcenter'}
+column_header_format = {'bold': True, 'align': 'center', 'valign': 'vcenter', 'border': 1}
+data_format = {'border': 1}
+detailed_columns = ['Side', 'Value_Date', 'Account_Number', 'Currency', 'Dr/Cr', 'Amount', 'Debit_Amount', 'Credit_Amount']
 
-output_file = '(USD)unmatched_transactions_report.xlsx'
-workbook = xlsxwriter.Workbook(output_file)
-worksheet = workbook.add_worksheet('Unmatched Data (USD)')
+def load_unmatched(gl_file, swift_file):
+    with metrics.stage('filtering_data.load') as record:
+        unmatched_gl = read_table(gl_file, gl_columns, gl_schema)
+        unmatched_swift = read_table(swift_file, swift_columns, swift_schema)
+        record['rows_out'] = unmatched_gl.height + unmatched_swift.height
+    return unmatched_gl, unmatched_swift
 
-header_format = workbook.add_format({'bold': True, 'bg_color': 'yellow', 'align': 'center', 'valign': 'vcenter'})
-column_header_format = workbook.add_format({'bold': True, 'align': 'center', 'valign': 'vcenter', 'border': 1})
-data_format = workbook.add_format({'border': 1})
+def safe_name(currency):
+    # Currency values come from the feeds as given ('N/A', 'US$'); characters
+    # other than letters, digits and '-' would break a file name or an Excel
+    # sheet title, so they become '_'.
+    return re.sub(r'[^\w-]', '_', currency)
 
-row_counter = 0
-detailed_columns = ['Side', 'Value_Date', 'Account_Number', 'Currency', 'Dr/Cr', 'Amount', 'Debit_Amount', 'Credit_Amount']
+def report_path(currency, directory='.'):
+    return os.path.join(directory, f'({safe_name(currency)})unmatched_transactions_report.xlsx')
+
+def currency_partitions(unmatched_gl, unmatched_swift, currencies=None):
+    # {currency: (GL rows, SWIFT rows)} from one pass over each pool. With
+    # currencies given only those are kept, and each gets an entry (possibly
+    # empty) so its workbook is still written.
+    unmatched_gl = unmatched_gl.select(gl_columns).with_columns(pl.col('Account_Number', gl_currency).cast(pl.Utf8))
+    unmatched_swift = unmatched_swift.select(swift_columns).with_columns(pl.col('Nostro Account', swift_currency).cast(pl.Utf8))
+    if currencies is not None:
+        unmatched_gl = unmatched_gl.filter(pl.col(gl_currency).is_in(currencies))
+        unmatched_swift = unmatched_swift.filter(pl.col(swift_currency).is_in(currencies))
+
+    gl_parts = unmatched_gl.partition_by(gl_currency, as_dict=True)
+    swift_parts = unmatched_swift.partition_by(swift_currency, as_dict=True)
+    if currencies is None:
+        currencies = sorted(key[0] for key in set(gl_parts) | set(swift_parts) if key[0] is not None)
+    return {
+        currency: (gl_parts.get((currency,), unmatched_gl.clear()), swift_parts.get((currency,), unmatched_swift.clear()))
+        for currency in currencies
+    }
 
-for account in usd_account_numbers['Account_Number'].to_list():
-    account_gl = gl_unmatched.filter(pl.col('Account_Number') == account).with_columns(
+def currency_report(gl_unmatched, swift_unmatched, output_file, currency):
+    # gl_unmatched / swift_unmatched hold the unmatched rows of one currency.
+    gl_rows = gl_unmatched.with_columns(
         pl.lit('NOSTRO_GL').alias('Side'),
         pl.when(pl.col('Cash Amt') < 0).then(pl.lit('Dr')).otherwise(pl.lit('Cr')).alias('Dr/Cr'),
         pl.col('Cash Amt').abs().alias('Amount'),
         pl.col('Nostro/Vostro/ Sett Entity Cur').alias('Currency'),
         pl.col('Val/Settle Date').alias('Value_Date')
     )
-    
-    account_swift = swift_unmatched.filter(pl.col('Nostro Account') == account).with_columns(
+
+    swift_rows = swift_unmatched.with_columns(
         pl.lit('NOSTRO_SWIFT').alias('Side'),
         pl.when(pl.col('Amount') < 0).then(pl.lit('Dr')).otherwise(pl.lit('Cr')).alias('Dr/Cr'),
         pl.col('Amount').abs().alias('Amount'),
         pl.col('Account Currency').alias('Currency'),
         pl.col('Value Date').alias('Value_Date')
     )
-    
-   
+
     combined_transactions = pl.concat([
-        account_gl.select(['Side', 'Value_Date', 'Account_Number', 'Currency', 'Dr/Cr', 'Amount']),
-        account_swift.select(['Side', 'Value_Date', pl.col('Nostro Account').alias('Account_Number'), 'Currency', 'Dr/Cr', 'Amount'])
+        gl_rows.select(['Side', 'Value_Date', 'Account_Number', 'Currency', 'Dr/Cr', 'Amount']),
+        swift_rows.select(['Side', 'Value_Date', pl.col('Nostro Account').alias('Account_Number'), 'Currency', 'Dr/Cr', 'Amount'])
     ]).with_columns(
         pl.when(pl.col('Dr/Cr') == 'Dr').then(pl.col('Amount')).otherwise(0).alias('Debit_Amount'),
         pl.when(pl.col('Dr/Cr') == 'Cr').then(pl.col('Amount')).otherwise(0).alias('Credit_Amount')
     )
 
-    credit_total = combined_transactions.filter(pl.col('Dr/Cr') == 'Cr')['Credit_Amount'].sum()
-    debit_total = combined_transactions.filter(pl.col('Dr/Cr') == 'Dr')['Debit_Amount'].sum()
-    credit_count = combined_transactions.filter(pl.col('Dr/Cr') == 'Cr').height
-    debit_count = combined_transactions.filter(pl.col('Dr/Cr') == 'Dr').height
-
-    account_name = (gl_unmatched.filter(pl.col('Account_Number') == account)['Account Name'].head(1).to_list() or
-                    swift_unmatched.filter(pl.col('Nostro Account') == account)['Account Name'].head(1).to_list() or
-                    ['N/A'])[0]
-
-    header_string = (
-        f'Account_Number: {account}  '
-        f'Account_Name: {account_name}  '
-        f'Total_Credit_Count: {credit_count}  '
-        f'Total_Credit_Amount: {credit_total}  '
-        f'Total_Debit_Count: {debit_count}  '
-        f'Total_Debit_Amount: {debit_total}'
+    account_names = name_lookup(
+        'Account_Number',
+        gl_unmatched.select('Account_Number', pl.col('Account Name').alias('Account_Name')),
+        swift_unmatched.select(pl.col('Nostro Account').alias('Account_Number'), pl.col('Account Name').alias('Account_Name')),
     )
-    worksheet.merge_range(row_counter, 0, row_counter, len(detailed_columns) - 1, header_string, header_format)
-    row_counter += 2
+    accounts = AccountIndex(combined_transactions, 'Account_Number', account_names)
+
+    titles = []
+    blocks = []
+    for account, account_transactions, totals in accounts:
+        header_string = (
+            f'Account_Number: {account}  '
+            f'Account_Name: {accounts.account_name(account)}  '
+            f'Total_Credit_Count: {totals["credit_count"]}  '
+            f'Total_Credit_Amount: {totals["credit_total"]}  '
+            f'Total_Debit_Count: {totals["debit_count"]}  '
+            f'Total_Debit_Amount: {totals["debit_total"]}'
+        )
+        titles.append(header_string)
+        blocks.append(account_transactions)
+
+    with metrics.stage('filtering_data.save', rows_in=combined_transactions.height, accounts=len(blocks), currency=currency):
+        with BlockWorkbook(output_file, f'Unmatched Data ({safe_name(currency)})', header_format, column_header_format, data_format) as workbook:
+            workbook.write_blocks(titles, detailed_columns, blocks)
 
-    for col_num, header_name in enumerate(detailed_columns):
-        worksheet.write(row_counter, col_num, header_name, column_header_format)
-    row_counter += 1
+def currency_reports(unmatched_gl, unmatched_swift, currencies=None, directory='.', workers=None):
+    # One workbook per currency (every currency found, or the ones given),
+    # written by a pool of worker processes. Each worker is sent only its
+    # currency's rows, and the largest currencies are started first so the
+    # run ends close to the time of the slowest one.
+    with metrics.stage('filtering_data.partition', rows_in=unmatched_gl.height + unmatched_swift.height) as record:
+        partitions = currency_partitions(unmatched_gl, unmatched_swift, currencies)
+        record['currencies'] = len(partitions)
+    order = sorted(partitions, key=lambda currency: -sum(df.height for df in partitions[currency]))
+    Path(directory).mkdir(parents=True, exist_ok=True)
+    paths = {currency: report_path(currency, directory) for currency in order}
 
-    for row in combined_transactions.iter_rows():
-        for col_num, cell_value in enumerate(row):
-            worksheet.write(row_counter, col_num, cell_value, data_format)
-        row_counter += 1
+    workers = min(workers or os.cpu_count() or 1, len(order))
+    if workers <= 1:
+        for currency in order:
+            currency_report(*partitions[currency], paths[currency], currency)
+        return paths
+    with worker_pool(workers) as pool:
+        futures = [pool.submit(currency_report, *partitions[currency], paths[currency], currency) for currency in order]
+        for future in futures:
+            future.result()
+    return paths
 
-    row_counter += 2 
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--currencies', nargs='+', help='write only these currencies (default: every currency with unmatched rows)')
+    parser.add_argument('--workers', type=int, help='worker processes writing workbooks (default: one per core)')
+    parser.add_argument('--directory', default='.', help='folder the (<currency>)unmatched_transactions_report.xlsx files are written to')
+    args = parser.parse_args()
 
-workbook.close()
+    currency_reports(*load_unmatched('unmatched_gl.csv', 'unmatched_swift.csv'), args.currencies, args.directory, args.workers)
@@ -0,0 +1,265 @@
+import argparse
+import asyncio
+import fnmatch
+import logging
+import os
+import time
+
+import polars as pl
+
+import matched_data
+from columnar_io import EXTENSIONS, write_table
+from mapping_cache import MappingLookups
+from open_item_pool import (
+    discard_unfinished, feed_names, load_pool, match_into_pool, new_run_id, next_row_id, rebuild_pool, save_pool, with_status,
+)
+from stage_metrics import metrics
+
+SIDES = {"gl": "NOSTRO_GL", "swift": "NOSTRO_SWIFT"}
+
+logger = logging.getLogger(__name__)
+
+def align(df, schema):
+    # A feed file's rows in the pool's column order and types; columns the
+    # file lacks are null.
+    columns = df.columns
+    return df.select([
+        pl.col(c).cast(t, strict=False) if c in columns else pl.lit(None, t).alias(c)
+        for c, t in schema.items() if c != "Row_Id"
+    ])
+
+class InboxWatcher:
+    # Intraday matching: GL and SWIFT feed files dropped into the inbox are
+    # parsed and enriched as they land, matched against the open-item pool
+    # held in memory, and the matched and still-open rows of each batch are
+    # published to the outbox.
+    #
+    # Three asyncio stages joined by bounded queues: a scanner finds files
+    # whose size has settled, parsers read and enrich them in threads, and
+    # the matcher takes every parsed file waiting (up to batch_files) as one
+    # batch. When matching falls behind, the queues fill up and the scanner
+    # stops picking up files, so a burst waits in the inbox rather than in
+    # memory, and is then matched in a few large batches.
+    #
+    # Every batch is published and then checkpointed to the open_item_pool
+    # store (open pool, ledger part and the files it consumed). A restart
+    # reloads the pool and skips files already consumed; a batch cut short
+    # before its checkpoint is matched again.
+    #
+    # A file that cannot be parsed or enriched is moved to the quarantine
+    # directory and logged, and the watcher carries on with the next one.
+    # Dropping a corrected file with the same name into the inbox again
+    # picks it up.
+
+    def __init__(self, inbox, outbox, store, mapping_file, rules=matched_data.RULES, output_format="parquet",
+                 gl_pattern="GL_*.csv", swift_pattern="SWIFT_*.csv", poll_interval=1.0, queue_size=16,
+                 batch_files=16, parse_workers=2, quarantine=None):
+        self.inbox = inbox
+        self.outbox = outbox
+        self.quarantine = quarantine or os.path.join(inbox, "quarantine")
+        self.store = store
+        self.mapping_file = mapping_file
+        self.rules = rules
+        self.extension = EXTENSIONS[output_format]
+        self.patterns = {"gl": gl_pattern, "swift": swift_pattern}
+        self.poll_interval = poll_interval
+        self.queue_size = queue_size
+        self.batch_files = batch_files
+        self.parse_workers = parse_workers
+
+    def load(self, gl_file=None, swift_file=None):
+        # The pool from the store, or, when there is none yet, built from a
+        # full batch run over gl_file and swift_file.
+        pool = load_pool(self.store)
+        if pool is None:
+            if gl_file is None or swift_file is None:
+                raise FileNotFoundError(f"No open-item pool in {self.store}; pass --gl-file and --swift-file to build one")
+            rebuild_pool(self.store, gl_file, self.mapping_file, swift_file, self.rules)
+            pool = load_pool(self.store)
+        self.open = {"gl": pool[0], "swift": pool[1]}
+        self.feeds = pool[2]
+        discard_unfinished(self.store, self.feeds)
+        self.next_ids = {side: next_row_id(self.store, side, self.open[side]) for side in SIDES}
+        self.consumed = set(self.feeds["FEED_FILE_NAME"].to_list())
+        self.mapping = MappingLookups(self.mapping_file)
+        self.lookups = {"gl": self.mapping.gl, "swift": self.mapping.swift}
+        print(f"Open pool: {self.open['gl'].height} GL / {self.open['swift'].height} SWIFT items; {len(self.consumed)} feed files consumed.")
+
+    def side(self, name):
+        for side, pattern in self.patterns.items():
+            if fnmatch.fnmatch(name, pattern):
+                return side
+        return None
+
+    async def scan(self, files, once):
+        # A file is picked up once its size and mtime are unchanged between
+        # two polls, so one still being copied in is not read half-written.
+        last_seen = {}
+        while True:
+            with os.scandir(self.inbox) as entries:
+                current = {
+                    entry.name: (entry.stat().st_size, entry.stat().st_mtime_ns)
+                    for entry in entries if entry.is_file() and self.side(entry.name) and entry.name not in self.consumed
+                }
+            for name in sorted(current):
+                if once or last_seen.get(name) == current[name]:
+                    self.consumed.add(name)
+                    await files.put((name, time.perf_counter()))
+            last_seen = current
+            if once:
+                break
+            await asyncio.sleep(self.poll_interval)
+        for _ in range(self.parse_workers):
+            await files.put(None)
+
+    def parse(self, name):
+        side = self.side(name)
+        with metrics.stage("inbox_watcher.parse", side=side, file=name) as record:
+            read = matched_data.read_gl_feed if side == "gl" else matched_data.read_swift_feed
+            enrich = matched_data.enrich_gl if side == "gl" else matched_data.enrich_swift
+            df = read(os.path.join(self.inbox, name))
+            if "FEED_FILE_NAME" not in df.columns:
+                df = df.with_columns(pl.lit(name).alias("FEED_FILE_NAME"))
+            df = align(enrich(df, self.lookups[side]), self.open[side].schema)
+            record["rows_out"] = df.height
+        return side, df
+
+    async def parser(self, files, parsed):
+        while (item := await files.get()) is not None:
+            name, landed = item
+            try:
+                side, df = await asyncio.to_thread(self.parse, name)
+            except Exception as error:
+                await asyncio.to_thread(self.quarantine_file, name, error)
+                continue
+            await parsed.put((name, side, df, landed))
+        await parsed.put(None)
+
+    def quarantine_file(self, name, error):
+        os.makedirs(self.quarantine, exist_ok=True)
+        os.replace(os.path.join(self.inbox, name), os.path.join(self.quarantine, name))
+        self.consumed.discard(name)
+        logger.error("Quarantined %s to %s: %s: %s", name, self.quarantine, type(error).__name__, error)
+        metrics.event("feed_quarantined", file=name, error=f"{type(error).__name__}: {error}")
+
+    async def matcher(self, parsed):
+        running = self.parse_workers
+        while running:
+            batch = []
+            item = await parsed.get()
+            while True:
+                if item is None:
+                    running -= 1
+                else:
+                    batch.append(item)
+                if len(batch) >= self.batch_files or parsed.empty() or not running:
+                    break
+                item = parsed.get_nowait()
+            if batch:
+                await asyncio.to_thread(self.match_batch, batch)
+
+    def match_batch(self, batch):
+        run_id = new_run_id()
+        new = {
+            side: pl.concat([self.open[side].drop("Row_Id").clear()] + [df for _, s, df, _ in batch if s == side])
+            for side in SIDES
+        }
+        with metrics.stage("inbox_watcher.batch", files=len(batch), rows_in=new["gl"].height, swift_rows_in=new["swift"].height) as record:
+            first_ids = (self.next_ids["gl"], self.next_ids["swift"])
+            matched_gl, open_gl, matched_swift, open_swift = match_into_pool(
+                self.open["gl"], self.open["swift"], new["gl"], new["swift"], self.rules, first_ids
+            )
+            opened_gl = open_gl.filter(pl.col("Row_Id") >= first_ids[0])
+            opened_swift = open_swift.filter(pl.col("Row_Id") >= first_ids[1])
+            self.publish(run_id, {
+                "matched_gl": matched_gl,
+                "matched_swift": matched_swift,
+                "unmatched_gl": with_status(opened_gl),
+                "unmatched_swift": with_status(opened_swift),
+                "pairs": matched_data.pair_ledger(matched_gl, matched_swift, self.rules).with_columns(pl.lit(run_id).alias("Run_Id")),
+            })
+
+            files = pl.DataFrame({
+                "SOURCE": [SIDES[side] for _, side, _, _ in batch],
+                "FEED_FILE_NAME": [name for name, _, _, _ in batch],
+                "Run_Id": run_id,
+            })
+            self.feeds = pl.concat([
+                self.feeds, files, feed_names(new["gl"], SIDES["gl"], run_id), feed_names(new["swift"], SIDES["swift"], run_id)
+            ]).unique(["SOURCE", "FEED_FILE_NAME"], keep="first", maintain_order=True)
+            save_pool(self.store, run_id, open_gl, open_swift, self.feeds, matched_gl, matched_swift)
+
+            self.open = {"gl": open_gl, "swift": open_swift}
+            self.next_ids = {"gl": first_ids[0] + new["gl"].height, "swift": first_ids[1] + new["swift"].height}
+            record["rows_out"] = matched_gl.height
+            record["swift_rows_out"] = matched_swift.height
+        waited = time.perf_counter() - min(landed for _, _, _, landed in batch)
+        print(
+            f"{run_id}: {len(batch)} files, {new['gl'].height} GL / {new['swift'].height} SWIFT rows; "
+            f"matched {matched_gl.height} GL / {matched_swift.height} SWIFT, {open_gl.height} / {open_swift.height} open; "
+            f"published {waited:.2f}s after the first file was picked up"
+        )
+
+    def publish(self, run_id, deltas):
+        # Each delta is written under a hidden name and renamed into place,
+        # so readers of the outbox never see a partial file.
+        os.makedirs(self.outbox, exist_ok=True)
+        for name, df in deltas.items():
+            path = os.path.join(self.outbox, f"{run_id}_{name}{self.extension}")
+            temporary = os.path.join(self.outbox, f".{run_id}_{name}{self.extension}")
+            write_table(df, temporary)
+            os.replace(temporary, path)
+
+    async def run(self, once=False):
+        files = asyncio.Queue(self.queue_size)
+        parsed = asyncio.Queue(self.queue_size)
+        await asyncio.gather(
+            self.scan(files, once),
+            *[self.parser(files, parsed) for _ in range(self.parse_workers)],
+            self.matcher(parsed),
+        )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--inbox", default="inbox", help="directory GL_*.csv and SWIFT_*.csv feed files are dropped into")
+    parser.add_argument("--outbox", default="outbox", help="directory the matched and unmatched deltas of each batch are published to")
+    parser.add_argument("--store", default="open_item_pool", help="open-item pool and ledger (see open_item_pool.py), checkpointed after every batch")
+    parser.add_argument("--mapping-file", default="Nostro_Mapping.csv")
+    parser.add_argument("--gl-file", help="with no pool in --store yet, build it from this full GL feed")
+    parser.add_argument("--swift-file", help="with no pool in --store yet, build it from this full SWIFT feed")
+    parser.add_argument("--gl-pattern", default="GL_*.csv", help="file names treated as GL feeds")
+    parser.add_argument("--swift-pattern", default="SWIFT_*.csv", help="file names treated as SWIFT feeds")
+    parser.add_argument("--poll-interval", type=float, default=1.0, help="seconds between inbox scans")
+    parser.add_argument("--queue-size", type=int, default=16, help="files waiting to be parsed, and parsed files waiting to be matched, before the inbox scan pauses")
+    parser.add_argument("--batch-files", type=int, default=16, help="most parsed files matched together as one batch (at most --queue-size plus --parse-workers)")
+    parser.add_argument("--parse-workers", type=int, default=2, help="files parsed and enriched at the same time")
+    parser.add_argument("--quarantine", help="directory feed files that fail to parse are moved to (default: <inbox>/quarantine)")
+    parser.add_argument("--once", action="store_true", help="match the files in the inbox now and exit instead of watching")
+    matched_data.add_rule_arguments(parser)
+    parser.add_argument("--format", choices=sorted(EXTENSIONS), default="parquet", help="format of the published deltas")
+    parser.add_argument("--metrics", help="append per-stage metrics to this JSON-lines file and print a run summary")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.configure(args.metrics)
+
+    watcher = InboxWatcher(
+        args.inbox,
+        args.outbox,
+        args.store,
+        args.mapping_file,
+        rules=matched_data.selected_rules(args),
+        output_format=args.format,
+        gl_pattern=args.gl_pattern,
+        swift_pattern=args.swift_pattern,
+        poll_interval=args.poll_interval,
+        queue_size=args.queue_size,
+        batch_files=args.batch_files,
+        parse_workers=args.parse_workers,
+        quarantine=args.quarantine,
+    )
+    watcher.load(args.gl_file, args.swift_file)
+    try:
+        asyncio.run(watcher.run(args.once))
+    except KeyboardInterrupt:
+        print("Stopped; the pool is checkpointed up to the last published batch.")
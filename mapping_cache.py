@@ -0,0 +1,133 @@
+import hashlib
+import logging
+import os
+
+import polars as pl
+
+from compact_schema import MAPPING_CATEGORICAL, categorical
+from stage_metrics import metrics
+from workbook_snapshot import evict
+
+logger = logging.getLogger(__name__)
+
+# The two joins the feeds make against Nostro_Mapping.csv: GL rows on the
+# Sierra account number, SWIFT rows on the nostro account number. Each
+# lookup holds only the columns its join brings in.
+LOOKUPS = {
+    "gl": ("Sierra Account Numbers", ["Account Name", "Account Currency", "Account_Number", "Swift Code", "Country"]),
+    "swift": ("Account_Number", ["Account Name", "Account Currency", "Swift Code", "Country"]),
+}
+
+# Cached lookups of mapping versions no longer in use are evicted, least
+# recently read first, once the cache grows past this. LOOKUP_FORMAT is part
+# of every cache file name and changes with the cached tables' schema.
+MAPPING_CACHE_MAX_BYTES = 256 * 1024**2
+LOOKUP_FORMAT = 2
+
+MAPPING_SCHEMA = {
+    "Account_Number": pl.Utf8,
+    "Sierra Account Numbers": pl.Utf8,
+    "Acc_Num": pl.Utf8,
+}
+
+class DuplicateMappingKeys(ValueError):
+    pass
+
+def file_digest(path, chunk_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def read_mapping(mapping_file):
+    return pl.read_csv(mapping_file, schema_overrides=MAPPING_SCHEMA)
+
+def duplicate_keys(mapping_df, key):
+    # Mapping rows sharing a key with another row, in file order.
+    return (
+        mapping_df.with_row_index("Mapping_Row")
+        .filter(pl.col(key).is_not_null() & pl.col(key).is_duplicated())
+        .select(pl.lit(key).alias("Key_Column"), pl.col(key).alias("Key"), "Mapping_Row", "Account Name", "Account Currency")
+    )
+
+def build_lookups(mapping_df):
+    # One row per key, the first in file order, so a duplicated account can
+    # no longer multiply the GL or SWIFT rows it is joined to. Keys and the
+    # mapped columns are Categorical, like the feed columns they join to.
+    lookups = {}
+    for name, (key, columns) in LOOKUPS.items():
+        lookups[name] = categorical(
+            mapping_df.filter(pl.col(key).is_not_null())
+            .unique(subset=key, keep="first", maintain_order=True)
+            .select(key, *columns)
+            .sort(key),
+            list(dict.fromkeys([key, *MAPPING_CATEGORICAL])),
+        )
+    duplicates = pl.concat([duplicate_keys(mapping_df, key) for key, _ in LOOKUPS.values()])
+    return lookups, duplicates
+
+class MappingLookups:
+    # Ready-to-join lookup tables for one version of the mapping file, cached
+    # as Parquet under the SHA-256 of its content. A changed file gets a new
+    # digest, so stale entries are never read; unchanged files skip CSV
+    # parsing entirely.
+
+    def __init__(self, mapping_file, cache_dir=None, strict=False, max_bytes=MAPPING_CACHE_MAX_BYTES):
+        self.mapping_file = mapping_file
+        self.cache_dir = cache_dir or os.path.join(os.path.dirname(os.path.abspath(mapping_file)), ".mapping_cache")
+        self.digest = file_digest(mapping_file)
+        with metrics.stage("mapping_cache", digest=self.digest[:12]) as record:
+            record["cached"] = self.load()
+            if not record["cached"]:
+                self.build()
+            record["rows_out"] = self.gl.height
+            record["duplicate_keys"] = self.duplicates.height
+            paths = self.paths()
+            for path in paths:
+                os.utime(path)
+            evict(self.cache_dir, max_bytes, set(paths))
+        self.report_duplicates(strict)
+
+    def path(self, name):
+        return os.path.join(self.cache_dir, f"{self.digest}_v{LOOKUP_FORMAT}_{name}.parquet")
+
+    def paths(self):
+        return [self.path(name) for name in [*LOOKUPS, "duplicates"]]
+
+    def load(self):
+        paths = {name: self.path(name) for name in [*LOOKUPS, "duplicates"]}
+        if not all(os.path.exists(path) for path in paths.values()):
+            return False
+        frames = {name: pl.read_parquet(path) for name, path in paths.items()}
+        self.gl, self.swift, self.duplicates = frames["gl"], frames["swift"], frames["duplicates"]
+        return True
+
+    def build(self):
+        lookups, self.duplicates = build_lookups(read_mapping(self.mapping_file))
+        self.gl, self.swift = lookups["gl"], lookups["swift"]
+        os.makedirs(self.cache_dir, exist_ok=True)
+        for name, df in [*lookups.items(), ("duplicates", self.duplicates)]:
+            df.write_parquet(self.path(name) + ".tmp")
+            os.replace(self.path(name) + ".tmp", self.path(name))
+
+    def report_duplicates(self, strict):
+        if self.duplicates.is_empty():
+            return
+        summary = self.duplicates.group_by("Key_Column", "Key", maintain_order=True).agg(pl.col("Mapping_Row"))
+        message = (
+            f"{self.mapping_file}: {summary.height} mapping keys occur more than once; "
+            f"the first row of each is used. Offenders: "
+            + ", ".join(f"{row['Key_Column']}={row['Key']} (rows {row['Mapping_Row']})" for row in summary.head(20).to_dicts())
+        )
+        if strict:
+            raise DuplicateMappingKeys(message)
+        logger.warning(message)
+        metrics.event("duplicate_mapping_keys", file=self.mapping_file, keys=summary.height)
+
+    def account_names(self):
+        # Account name per Sierra or nostro account number, for the reports.
+        return pl.concat([
+            self.gl.select(pl.col(LOOKUPS["gl"][0]).alias("Account"), pl.col("Account Name").alias("Account_Name")),
+            self.swift.select(pl.col(LOOKUPS["swift"][0]).alias("Account"), pl.col("Account Name").alias("Account_Name")),
+        ])
@@ -1,6 +1,187 @@
+import argparse
+import logging
+import os
+from decimal import Decimal
+
 import polars as pl
 
+from columnar_io import EXTENSIONS, write_table
+from compact_schema import AMOUNT, DR_CR, GL_CATEGORICAL, MAPPING_CATEGORICAL, SWIFT_CATEGORICAL, amount, categorical
+from mapping_cache import MappingLookups
+from stage_metrics import metrics, row_count
+from worker_pool import worker_pool
+
+# Rule skips are also recorded as rule_skipped metric events.
+logger = logging.getLogger(__name__)
+
+# Output schema for the Parquet/Arrow IPC datasets. References and dates
+# stay text exactly as fed, low-cardinality columns are Categorical, the
+# fed amounts and balances Float64 and DC_AMOUNT fixed-point (see
+# compact_schema).
+GL_SCHEMA = {
+    "Nostro/Vostro/ Sett Entity ID": pl.Categorical,
+    "Nostro/Vostro/ Sett Entity Cur": pl.Categorical,
+    "Val/Settle Date": pl.Utf8,
+    "ExternalTxNum": pl.Utf8,
+    "MAPS_TRDVERIFY-IMPORT": pl.Categorical,
+    "Trade Remarks 1": pl.Utf8,
+    "Cash Amt": pl.Float64,
+    "Trans Num": pl.Utf8,
+    "FEED_FILE_NAME": pl.Categorical,
+    "Account Name": pl.Categorical,
+    "Account Currency": pl.Categorical,
+    "Account_Number": pl.Categorical,
+    "Swift Code": pl.Categorical,
+    "Country": pl.Categorical,
+    "Dr/Cr": DR_CR,
+    "DC_AMOUNT": AMOUNT,
+    "Matching_Rule": pl.Categorical,
+    "Row_Id": pl.UInt32,
+    "Paired_Row_Id": pl.UInt32,
+}
+
+SWIFT_SCHEMA = {
+    "Value Date": pl.Utf8,
+    "Entry Date": pl.Utf8,
+    "Amount": pl.Float64,
+    "Transaction Id": pl.Utf8,
+    "Transation Reference": pl.Utf8,
+    "Institution Reference": pl.Utf8,
+    "Custumer Reference": pl.Utf8,
+    "Description": pl.Categorical,
+    "Opening Balance": pl.Float64,
+    "Opening Balance Date": pl.Utf8,
+    "Opening Balance Currency": pl.Utf8,
+    "Intermidiate start Balance": pl.Float64,
+    "intermidiate Balance Date": pl.Utf8,
+    "intermidiate Balance Currency": pl.Utf8,
+    "intermidiate End Balance": pl.Float64,
+    "intermidiate End Date": pl.Utf8,
+    "intermidiate End Currency": pl.Utf8,
+    "Closing Balance": pl.Float64,
+    "Closing Balance Date": pl.Utf8,
+    "Closing Balance Currency": pl.Utf8,
+    "Nostro Account": pl.Categorical,
+    "Bank Transaction Reference": pl.Utf8,
+    "Information": pl.Utf8,
+    "FEED_FILE_NAME": pl.Categorical,
+    "Currency Dr/Cr": pl.Categorical,
+    "Account Name": pl.Categorical,
+    "Account Currency": pl.Categorical,
+    "Swift Code": pl.Categorical,
+    "Country": pl.Categorical,
+    "Dr/Cr": DR_CR,
+    "DC_AMOUNT": AMOUNT,
+    "Matching_Rule": pl.Categorical,
+    "Row_Id": pl.UInt32,
+    "Paired_Row_Id": pl.UInt32,
+}
+
+RULES = [
+    (["Trans Num", "DC_AMOUNT", "Account Currency"], ["Transation Reference", "DC_AMOUNT", "Account Currency"], "Rule 1"),
+    (["ExternalTxNum", "DC_AMOUNT", "Account Currency"], ["Institution Reference", "DC_AMOUNT", "Account Currency"], "Rule 2"),
+    (["ExternalTxNum", "DC_AMOUNT", "Account Currency"], ["Transation Reference", "DC_AMOUNT", "Account Currency"], "Rule 3"),
+]
+
+def tolerance_rule(gl_cols, swift_cols, rule_name, amount=0.0, bps=0.0, days=None,
+                   gl_amount="DC_AMOUNT", swift_amount="DC_AMOUNT",
+                   gl_date="Val/Settle Date", swift_date="Value Date"):
+    # gl_cols/swift_cols stay exact keys; the amount may differ by up to
+    # max(amount, bps of the GL amount) and the dates by up to `days`.
+    return (gl_cols, swift_cols, rule_name, {
+        "kind": "tolerance", "amount": amount, "bps": bps, "days": days,
+        "gl_amount": gl_amount, "swift_amount": swift_amount,
+        "gl_date": gl_date, "swift_date": swift_date,
+    })
+
+TOLERANCE_RULES = [
+    tolerance_rule(["Trans Num", "Account Currency", "Account_Number"], ["Transation Reference", "Account Currency", "Nostro Account"], "Rule 4", amount=0.05, days=1),
+    tolerance_rule(["ExternalTxNum", "Account Currency", "Account_Number"], ["Institution Reference", "Account Currency", "Nostro Account"], "Rule 5", amount=0.05, days=1),
+    tolerance_rule(["ExternalTxNum", "Account Currency", "Account_Number"], ["Transation Reference", "Account Currency", "Nostro Account"], "Rule 6", amount=0.05, days=1),
+]
+
+def reversal_rule(gl_cols, swift_cols, rule_name="Reversal", days=None,
+                  gl_direction="Dr/Cr", swift_direction="Dr/Cr",
+                  gl_date="Val/Settle Date", swift_date="Value Date"):
+    # Pairs entries on the same side that cancel out: equal gl_cols (or
+    # swift_cols) keys, opposite direction and dates at most `days` apart.
+    # Listed before the matching rules, it takes the pairs out of the pool
+    # they match from.
+    return (gl_cols, swift_cols, rule_name, {
+        "kind": "reversal", "days": days,
+        "gl_direction": gl_direction, "swift_direction": swift_direction,
+        "gl_date": gl_date, "swift_date": swift_date,
+    })
+
+REVERSAL_DAYS = 5
+REVERSAL_KEYS = (["Nostro/Vostro/ Sett Entity ID", "Account Currency", "DC_AMOUNT"], ["Nostro Account", "Account Currency", "DC_AMOUNT"])
+REVERSAL_REFERENCES = (["Trans Num"], ["Transaction Id"])
+
+def reversal_rules(days=REVERSAL_DAYS, by_reference=False):
+    gl_cols, swift_cols = REVERSAL_KEYS
+    if by_reference:
+        gl_cols, swift_cols = gl_cols + REVERSAL_REFERENCES[0], swift_cols + REVERSAL_REFERENCES[1]
+    return [reversal_rule(gl_cols, swift_cols, days=days)]
+
+def aggregate_rule(gl_cols, swift_cols, rule_name, grouped="gl", max_group=10, amount=0.0, bps=0.0, days=None,
+                   gl_amount="DC_AMOUNT", swift_amount="DC_AMOUNT",
+                   gl_direction="Dr/Cr", swift_direction="Dr/Cr",
+                   gl_date="Val/Settle Date", swift_date="Value Date"):
+    # Split payments: rows of the `grouped` side ("gl" or "swift") sharing a
+    # key and direction are summed, and the total matches a single row of
+    # the other side with that key within max(amount, bps of the total).
+    # Groups of more than max_group rows are not matched.
+    return (gl_cols, swift_cols, rule_name, {
+        "kind": "aggregate", "grouped": grouped, "max_group": max_group,
+        "amount": amount, "bps": bps, "days": days,
+        "gl_amount": gl_amount, "swift_amount": swift_amount,
+        "gl_direction": gl_direction, "swift_direction": swift_direction,
+        "gl_date": gl_date, "swift_date": swift_date,
+    })
+
+AGGREGATE_MAX_GROUP = 10
+AGGREGATE_KEYS = [
+    (["Trans Num", "Account Currency", "Account_Number"], ["Transation Reference", "Account Currency", "Nostro Account"]),
+    (["ExternalTxNum", "Account Currency", "Account_Number"], ["Institution Reference", "Account Currency", "Nostro Account"]),
+    (["ExternalTxNum", "Account Currency", "Account_Number"], ["Transation Reference", "Account Currency", "Nostro Account"]),
+]
+
+def aggregate_rules(max_group=AGGREGATE_MAX_GROUP, amount=0.0, first_rule=7):
+    # Several GL postings against one SWIFT entry, then the reverse, for
+    # each reference pair.
+    rules = []
+    for grouped in ("gl", "swift"):
+        for gl_cols, swift_cols in AGGREGATE_KEYS:
+            rules.append(aggregate_rule(gl_cols, swift_cols, f"Rule {first_rule + len(rules)}", grouped, max_group, amount))
+    return rules
+
+def column_names(df):
+    return df.collect_schema().names()
+
+def rule_columns(rule):
+    gl_cols, swift_cols = list(rule[0]), list(rule[1])
+    if len(rule) > 3:
+        options = rule[3]
+        side_columns = {"tolerance": ["amount"], "reversal": ["direction"], "aggregate": ["amount", "direction"]}[options["kind"]]
+        for column in side_columns:
+            gl_cols.append(options[f"gl_{column}"])
+            swift_cols.append(options[f"swift_{column}"])
+        if options["days"] is not None:
+            gl_cols.append(options["gl_date"])
+            swift_cols.append(options["swift_date"])
+    return gl_cols, swift_cols
+
+def as_date(df, column):
+    dtype = df.schema[column]
+    if dtype == pl.Date:
+        return pl.col(column)
+    if dtype.is_temporal():
+        return pl.col(column).cast(pl.Date)
+    return pl.col(column).cast(pl.Utf8).str.to_date(strict=False)
+
 def merged(df, mapping_df, left_on, right_on, selected_columns):
+    # The mapping lookups are keyed on Categorical account numbers.
+    df = df.with_columns(pl.col(left_on).cast(pl.Utf8).cast(pl.Categorical))
     return df.join(
         mapping_df.select(selected_columns),
         left_on=left_on,
@@ -12,133 +193,535 @@ def apply_filters(df, amount_col, currency_col):
     return (
         df.with_columns([
             pl.col(amount_col).cast(pl.Float64, strict=False),
-            pl.when(pl.col(amount_col) < 0).then(pl.lit("Dr")).otherwise(pl.lit("Cr")).alias("Dr/Cr"),
-            pl.col(amount_col).abs().alias("DC_AMOUNT")
+            pl.when(pl.col(amount_col) < 0).then(pl.lit("Dr")).otherwise(pl.lit("Cr")).cast(DR_CR).alias("Dr/Cr"),
+            amount(pl.col(amount_col)).abs().alias("DC_AMOUNT")
         ])
         
     )
 
-def process_rules(gl_df, swift_df, rules):
-    
-    all_matched_gl = []
-    all_matched_swift = []
-    
-    unmatched_gl = gl_df.clone()
-    unmatched_swift = swift_df.clone()
-
-    for gl_cols, swift_cols, rule_name in rules:
-        if not all(col in unmatched_gl.columns for col in gl_cols):
-            print(f"Skipping rule '{rule_name}': GL columns {gl_cols} not found.")
+def active_rules(gl_df, swift_df, rules):
+    active = []
+    for rule in rules:
+        rule_name = rule[2]
+        gl_cols, swift_cols = rule_columns(rule)
+        if not all(col in column_names(gl_df) for col in gl_cols):
+            logger.warning("Skipping rule '%s': GL columns %s not found.", rule_name, gl_cols)
+            metrics.event("rule_skipped", rule=rule_name, reason="missing GL columns", columns=gl_cols)
             continue
-        if not all(col in unmatched_swift.columns for col in swift_cols):
-            print(f"Skipping rule '{rule_name}': SWIFT columns {swift_cols} not found.")
+        if not all(col in column_names(swift_df) for col in swift_cols):
+            logger.warning("Skipping rule '%s': SWIFT columns %s not found.", rule_name, swift_cols)
+            metrics.event("rule_skipped", rule=rule_name, reason="missing SWIFT columns", columns=swift_cols)
             continue
+        active.append(rule)
+    return active
 
-        matched_keys = unmatched_gl.select(gl_cols).join(
-            unmatched_swift.select(swift_cols),
-            left_on=gl_cols,
-            right_on=swift_cols,
-            how="inner"
-        ).unique()
-        
-        if not matched_keys.is_empty():
-            matched_gl_current = unmatched_gl.join(matched_keys, on=gl_cols, how='inner').with_columns(
-                pl.lit(rule_name).alias("Matching_Rule")
-            )
-
-            rename_mapping = {gl_col: swift_col for gl_col, swift_col in zip(gl_cols, swift_cols)}
-            renamed_matched_keys = matched_keys.rename(rename_mapping)
-            print(f"DEBUG: Columns in renamed_matched_keys for rule '{rule_name}': {renamed_matched_keys.columns}")
-
-            matched_swift_current = unmatched_swift.join(renamed_matched_keys, on=swift_cols, how='inner').with_columns(
-                pl.lit(rule_name).alias("Matching_Rule")
-            )
-
-            all_matched_gl.append(matched_gl_current)
-            all_matched_swift.append(matched_swift_current)
-
-            unmatched_gl = unmatched_gl.join(matched_keys, on=gl_cols, how="anti")
-            unmatched_swift = unmatched_swift.join(renamed_matched_keys, on=swift_cols, how="anti")
-    
-    if all_matched_gl:
-        final_matched_gl = pl.concat(all_matched_gl)
-    else:
-        final_matched_gl = unmatched_gl.clear()
-    
-    if all_matched_swift:
-        final_matched_swift = pl.concat(all_matched_swift)
-    else:
-        final_matched_swift = unmatched_swift.clear()
-    
-    final_unmatched_gl = unmatched_gl.with_columns(pl.lit("Unmatched").alias("Matching_Rule"))
-    final_unmatched_swift = unmatched_swift.with_columns(pl.lit("Unmatched").alias("Matching_Rule"))
+def key_table(df, columns):
+    keys = df.select("_row", *dict.fromkeys(columns))
+    return keys.collect(engine="streaming") if isinstance(keys, pl.LazyFrame) else keys
+
+def within_tolerance(difference, amount, options):
+    # difference <= max(options["amount"], bps of |amount|), compared in
+    # AMOUNT with the bps bound cross-multiplied by integers, so a
+    # difference exactly at the tolerance is never lost to rounding.
+    bps = Decimal(str(options["bps"]))
+    scale = 10 ** max(0, -bps.as_tuple().exponent)
+    return (difference <= pl.lit(Decimal(str(options["amount"]))).cast(AMOUNT)) | (
+        difference * (10_000 * scale) <= amount.abs() * int(bps * scale)
+    )
+
+def match_within_tolerance(gl_open, swift_open, key_names, options):
+    # Sorted as-of join: within each exact key, every GL row is paired with
+    # the SWIFT row nearest in amount, then the amount tolerance and date
+    # window are checked. Each SWIFT row keeps only its closest GL row.
+    gl_side = gl_open.drop_nulls().sort("_amount")
+    swift_side = swift_open.drop_nulls().rename(
+        {"_row": "_swift_row", "_amount": "_swift_amount", "_date": "_swift_date"}, strict=False
+    ).sort("_swift_amount")
+
+    pairs = gl_side.join_asof(
+        swift_side, left_on="_amount", right_on="_swift_amount", by=key_names, strategy="nearest",
+        check_sortedness=False
+    ).drop_nulls("_swift_row")
+
+    difference = (pl.col("_amount") - pl.col("_swift_amount")).abs()
+    pairs = pairs.filter(within_tolerance(difference, pl.col("_amount"), options))
+    if options["days"] is not None:
+        pairs = pairs.filter((pl.col("_date") - pl.col("_swift_date")).dt.total_days().abs() <= options["days"])
+    pairs = pairs.sort(difference, "_row").unique("_swift_row", keep="first", maintain_order=True)
+
+    return pairs.select("_row", pl.col("_swift_row").alias("_pair")), pairs.select(pl.col("_swift_row").alias("_row"), pl.col("_row").alias("_pair"))
+
+def pair_reversals(open_rows, key_names, days):
+    # Within each key, the k-th debit in date order pairs with the k-th
+    # credit. Ranking keeps pairing one-to-one and linear however busy the
+    # account, where a self-join on the key would multiply its rows. A pair
+    # further apart than `days` stays open.
+    open_rows = open_rows.drop_nulls([*key_names, "_direction"])
+    debits = open_rows.filter(pl.col("_direction") == "Dr")
+    credits = open_rows.filter(pl.col("_direction") == "Cr")
+    # Only keys with entries in both directions can pair; most keys have a
+    # single entry, so ranking just these rows is much cheaper.
+    debits, credits = debits.join(credits, on=key_names, how="semi"), credits.join(debits, on=key_names, how="semi")
+
+    order = ["_date", "_row"] if "_date" in open_rows.columns else "_row"
+    rank = pl.int_range(pl.len()).over(key_names).alias("_rank")
+    pairs = debits.sort(order).with_columns(rank).join(
+        credits.sort(order).with_columns(rank), on=[*key_names, "_rank"], suffix="_credit"
+    )
+    if days is not None:
+        pairs = pairs.filter((pl.col("_date") - pl.col("_date_credit")).dt.total_days().abs() <= days)
+    return pl.concat([
+        pairs.select("_row", pl.col("_row_credit").alias("_pair")),
+        pairs.select(pl.col("_row_credit").alias("_row"), pl.col("_row").alias("_pair")),
+    ])
+
+def match_aggregates(grouped_open, single_open, key_names, options):
+    # Rows of one side sharing a key and direction are summed in a single
+    # group_by, and each group total is compared with the rows of the other
+    # side under the same key. Every open row of a key is one group, so no
+    # subsets are searched, and groups above max_group are skipped to keep
+    # the cost linear. A group and a single row pair at most once each,
+    # closest totals first.
+    grouped_open = grouped_open.drop_nulls()
+    single_open = single_open.drop_nulls().rename(
+        {"_row": "_single_row", "_amount": "_single_amount", "_date": "_single_date"}, strict=False
+    )
+    dated = "_date" in grouped_open.columns
+    groups = grouped_open.join(single_open, on=key_names, how="semi").group_by(*key_names, "_direction").agg(
+        pl.col("_row"),
+        pl.col("_amount").sum().alias("_total"),
+        *([pl.col("_date").min().alias("_first"), pl.col("_date").max().alias("_last")] if dated else []),
+    ).filter(pl.col("_row").list.len().is_between(2, options["max_group"]))
+
+    pairs = groups.join(single_open, on=key_names)
+    # Totals are summed as fixed-point, so an exact split is a zero difference.
+    difference = (pl.col("_total") - pl.col("_single_amount")).abs()
+    pairs = pairs.filter(within_tolerance(difference, pl.col("_total"), options))
+    if dated:
+        pairs = pairs.filter(
+            (pl.col("_first") - pl.col("_single_date")).dt.total_days().abs() <= options["days"],
+            (pl.col("_last") - pl.col("_single_date")).dt.total_days().abs() <= options["days"],
+        )
+    pairs = pairs.with_columns(pl.col("_row").list.min().alias("_group")).sort(difference, "_group", "_single_row")
+    # Each round keeps every single row's closest group and each group's
+    # closest of those; groups and rows left over try again against what is
+    # still free. A key has at most two groups (one per direction), so this
+    # ends within two rounds.
+    chosen = []
+    while not pairs.is_empty():
+        chosen.append(pairs.unique("_single_row", keep="first", maintain_order=True).unique("_group", keep="first", maintain_order=True))
+        pairs = pairs.join(chosen[-1], on="_single_row", how="anti").join(chosen[-1], on="_group", how="anti")
+    pairs = pl.concat(chosen) if chosen else pairs
+
+    grouped_rows = pairs.select("_row", pl.col("_single_row").alias("_pair")).explode("_row")
+    single_rows = pairs.select(pl.col("_single_row").alias("_row"), pl.col("_group").alias("_pair"))
+    return grouped_rows, single_rows
+
+def occurrence_rank(df, key_names):
+    # Position of each row among the rows sharing its key, in row order.
+    # Most keys occur once, so only rows with a duplicated key are ranked.
+    duplicated = df.select(key_names).is_duplicated()
+    first = pl.lit(0, pl.UInt32).alias("_rank")
+    if not duplicated.any():
+        return df.with_columns(first)
+    return pl.concat([
+        df.filter(~duplicated).with_columns(first),
+        df.filter(duplicated).sort("_row").with_columns(pl.int_range(pl.len(), dtype=pl.UInt32).over(key_names).alias("_rank")),
+    ])
+
+def pair_by_rank(gl_open, swift_open, key_names):
+    # One-to-one: within each key, the k-th open GL row (in row order) pairs
+    # with the k-th open SWIFT row, so surplus duplicates on either side stay
+    # unmatched and no join is ever larger than its inputs. Rows whose key is
+    # missing on the other side are dropped first, so only candidates are ranked.
+    gl_open = gl_open.drop_nulls(key_names)
+    swift_open = swift_open.drop_nulls(key_names)
+    gl_candidates = gl_open.join(swift_open, on=key_names, how="semi")
+    swift_candidates = swift_open.join(gl_candidates, on=key_names, how="semi")
+    pairs = occurrence_rank(gl_candidates, key_names).join(
+        occurrence_rank(swift_candidates, key_names), on=[*key_names, "_rank"], suffix="_swift"
+    )
+    return pairs.select("_row", pl.col("_row_swift").alias("_pair")), pairs.select(pl.col("_row_swift").alias("_row"), pl.col("_row").alias("_pair"))
+
+def assign_rules(gl_keys, swift_keys, rules):
+    # First rule wins: each rule only sees rows that no earlier rule claimed.
+    # Every claimed row carries the _row of the row it was paired with in
+    # _pair (on the other side, or on its own side for reversals; the
+    # single row of an aggregate match names the first row of its group).
+    assigned_gl = []
+    assigned_swift = []
+    for rule_index, rule in enumerate(rules):
+        with metrics.stage(f"rule:{rule[2]}", rows_in=gl_keys.height, swift_rows_in=swift_keys.height) as record:
+            gl_cols, swift_cols, rule_name = rule[:3]
+            key_names = [f"_key{i}" for i in range(len(gl_cols))]
+            gl_select = ["_row", *[pl.col(c).alias(k) for c, k in zip(gl_cols, key_names)]]
+            swift_select = ["_row", *[pl.col(c).alias(k) for c, k in zip(swift_cols, key_names)]]
+
+            if len(rule) > 3 and rule[3]["kind"] == "reversal":
+                # Same-side pairs, found on the GL and SWIFT rows separately.
+                options = rule[3]
+                gl_select.append(pl.col(options["gl_direction"]).cast(pl.Utf8).alias("_direction"))
+                swift_select.append(pl.col(options["swift_direction"]).cast(pl.Utf8).alias("_direction"))
+                if options["days"] is not None:
+                    gl_select.append(as_date(gl_keys, options["gl_date"]).alias("_date"))
+                    swift_select.append(as_date(swift_keys, options["swift_date"]).alias("_date"))
+                matched_gl = pair_reversals(gl_keys.select(gl_select), key_names, options["days"])
+                matched_swift = pair_reversals(swift_keys.select(swift_select), key_names, options["days"])
+            elif len(rule) > 3 and rule[3]["kind"] == "aggregate":
+                # One side's rows summed per key against single rows of the other.
+                options = rule[3]
+                gl_select.append(amount(pl.col(options["gl_amount"])).alias("_amount"))
+                swift_select.append(amount(pl.col(options["swift_amount"])).alias("_amount"))
+                if options["days"] is not None:
+                    gl_select.append(as_date(gl_keys, options["gl_date"]).alias("_date"))
+                    swift_select.append(as_date(swift_keys, options["swift_date"]).alias("_date"))
+                if options["grouped"] == "gl":
+                    gl_select.append(pl.col(options["gl_direction"]).cast(pl.Utf8).alias("_direction"))
+                    matched_gl, matched_swift = match_aggregates(
+                        gl_keys.select(gl_select), swift_keys.select(swift_select), key_names, options
+                    )
+                else:
+                    swift_select.append(pl.col(options["swift_direction"]).cast(pl.Utf8).alias("_direction"))
+                    matched_swift, matched_gl = match_aggregates(
+                        swift_keys.select(swift_select), gl_keys.select(gl_select), key_names, options
+                    )
+            elif len(rule) > 3:
+                options = rule[3]
+                gl_select.append(amount(pl.col(options["gl_amount"])).alias("_amount"))
+                swift_select.append(amount(pl.col(options["swift_amount"])).alias("_amount"))
+                if options["days"] is not None:
+                    gl_select.append(as_date(gl_keys, options["gl_date"]).alias("_date"))
+                    swift_select.append(as_date(swift_keys, options["swift_date"]).alias("_date"))
+                matched_gl, matched_swift = match_within_tolerance(
+                    gl_keys.select(gl_select), swift_keys.select(swift_select), key_names, options
+                )
+            else:
+                matched_gl, matched_swift = pair_by_rank(gl_keys.select(gl_select), swift_keys.select(swift_select), key_names)
+            record["rows_out"] = matched_gl.height
+            record["swift_rows_out"] = matched_swift.height
+            if matched_gl.is_empty() and matched_swift.is_empty():
+                continue
 
-    return final_matched_gl, final_unmatched_gl, final_matched_swift, final_unmatched_swift
+            label = [pl.lit(rule_index, pl.UInt32).alias("_rule"), pl.lit(rule_name, pl.Categorical).alias("Matching_Rule")]
+            assigned_gl.append(matched_gl.with_columns(label))
+            assigned_swift.append(matched_swift.with_columns(label))
+            gl_keys = gl_keys.join(matched_gl, on="_row", how="anti")
+            swift_keys = swift_keys.join(matched_swift, on="_row", how="anti")
 
-def process_data(gl_file, mapping_file, swift_file, output_file):
-    
-    gl_df = pl.read_csv(gl_file, schema_overrides={
+    empty = pl.DataFrame(schema={"_row": pl.UInt32, "_pair": pl.UInt32, "_rule": pl.UInt32, "Matching_Rule": pl.Categorical})
+    return (
+        pl.concat([empty] + assigned_gl, how="vertical_relaxed"),
+        pl.concat([empty] + assigned_swift, how="vertical_relaxed"),
+    )
+
+def with_row_ids(df):
+    # Row_Id numbers the rows given to process_rules; Paired_Row_Id of a
+    # matched row is the Row_Id it was paired with.
+    return df.drop("Row_Id", strict=False).with_row_index("Row_Id")
+
+def process_rules(gl_df, swift_df, rules, row_ids=True):
+    # row_ids=False keeps the Row_Id already on the frames (sharded runs
+    # number the rows before splitting them).
+    if row_ids:
+        gl_df, swift_df = with_row_ids(gl_df), with_row_ids(swift_df)
+    with metrics.stage("process_rules", rows_in=row_count(gl_df), swift_rows_in=row_count(swift_df)) as record:
+        results = match_rules(gl_df, swift_df, rules, record)
+        record["rows_out"] = row_count(results[0])
+        record["unmatched_gl"] = row_count(results[1])
+        record["unmatched_swift"] = row_count(results[3])
+    return results
+
+def match_rules(gl_df, swift_df, rules, record):
+    gl_df = gl_df.drop("Paired_Row_Id", strict=False).with_columns(pl.col("Row_Id").alias("_row"))
+    swift_df = swift_df.drop("Paired_Row_Id", strict=False).with_columns(pl.col("Row_Id").alias("_row"))
+    rules = active_rules(gl_df, swift_df, rules)
+
+    # The rule loop runs on narrow (row id + key columns) projections; the
+    # full GL and SWIFT frames are only joined against the outcome once.
+    assigned = assign_rules(
+        key_table(gl_df, [c for rule in rules for c in rule_columns(rule)[0]]),
+        key_table(swift_df, [c for rule in rules for c in rule_columns(rule)[1]]),
+        rules,
+    )
+    if metrics.enabled:
+        record["rules"] = {
+            side: dict(zip(*df.group_by("Matching_Rule", maintain_order=True).len().get_columns()))
+            for side, df in zip(["gl", "swift"], assigned)
+        }
+
+    results = []
+    for df, side_assigned in zip([gl_df, swift_df], assigned):
+        if isinstance(df, pl.LazyFrame):
+            side_assigned = side_assigned.lazy()
+        matched = df.join(side_assigned.rename({"_pair": "Paired_Row_Id"}), on="_row", how="inner").sort("_rule", "_row").drop("_row", "_rule")
+        unmatched = df.join(side_assigned, on="_row", how="anti").drop("_row").with_columns(
+            pl.lit(None, pl.UInt32).alias("Paired_Row_Id"),
+            pl.lit("Unmatched", pl.Categorical).alias("Matching_Rule"),
+        )
+        results += [matched, unmatched]
+
+    return tuple(results)
+
+def shard_columns(rules):
+    # Column pairs used as a key by every rule. Rows that differ on any of
+    # them can never match under any rule, so splitting on them is safe.
+    pairs = [set(zip(rule[0], rule[1])) for rule in rules]
+    common = set.intersection(*pairs) if pairs else set()
+    return sorted(common)
+
+def shard_ids(df, columns, shards):
+    key = pl.struct([pl.col(c).alias(f"_shard{i}") for i, c in enumerate(columns)])
+    return (key.hash(seed=0) % shards).alias("_shard")
+
+def process_rules_sharded(gl_df, swift_df, rules, workers=None, shards=None):
+    workers = workers or os.cpu_count() or 1
+    with metrics.stage("process_rules_sharded", rows_in=row_count(gl_df), swift_rows_in=row_count(swift_df), workers=workers) as record:
+        results = match_sharded(gl_df, swift_df, rules, workers, shards or workers)
+        record["rows_out"] = row_count(results[0])
+        record["unmatched_gl"] = row_count(results[1])
+        record["unmatched_swift"] = row_count(results[3])
+    return results
+
+def shard_phases(gl_df, swift_df, rules, shards):
+    # Runs of consecutive rules sharded together on the columns they all key
+    # on. A run ends where the next rule would leave only a key one value of
+    # which holds more than a shard's share of either feed ("Account
+    # Currency" alone once tolerance rules follow the exact ones). Rules
+    # still only see the rows earlier runs left unmatched.
+    phases = []
+    for rule in rules:
+        if phases:
+            columns = shard_columns(phases[-1] + [rule])
+            if columns and balanced(gl_df, swift_df, columns, shards):
+                phases[-1].append(rule)
+                continue
+        phases.append([rule])
+    return phases
+
+def balanced(gl_df, swift_df, columns, shards):
+    for df, side_columns in ((gl_df, [c for c, _ in columns]), (swift_df, [c for _, c in columns])):
+        if df.height and df.group_by(side_columns).len()["len"].max() * shards > df.height:
+            return False
+    return True
+
+def match_sharded(gl_df, swift_df, rules, workers, shards):
+    rules = active_rules(gl_df, swift_df, rules)
+    if shards == 1 or not rules:
+        return process_rules(gl_df, swift_df, rules)
+
+    gl_df, swift_df = with_row_ids(gl_df), with_row_ids(swift_df)
+    matched_gl, matched_swift = [], []
+    with worker_pool(workers) as pool:
+        for phase in shard_phases(gl_df, swift_df, rules, shards):
+            results = match_phase(pool, gl_df, swift_df, phase, shards)
+            matched_gl.append(results[0])
+            matched_swift.append(results[2])
+            gl_df = results[1].drop("Paired_Row_Id", "Matching_Rule")
+            swift_df = results[3].drop("Paired_Row_Id", "Matching_Rule")
+
+    # Merge in the order an unsharded run produces: matched rows by rule
+    # priority then input order, unmatched rows by input order.
+    rule_order = {rule[2]: i for i, rule in enumerate(rules)}
+    unmatched = [results[1], results[3]]
+    return tuple(
+        frames.sort("Row_Id") if position % 2 else
+        frames.sort(pl.col("Matching_Rule").replace_strict(rule_order, return_dtype=pl.UInt32), "Row_Id")
+        for position, frames in enumerate([pl.concat(matched_gl), unmatched[0], pl.concat(matched_swift), unmatched[1]])
+    )
+
+def match_phase(pool, gl_df, swift_df, rules, shards):
+    columns = shard_columns(rules)
+    if not columns or not balanced(gl_df, swift_df, columns, shards):
+        # Every split safe for these rules puts most rows in one shard, e.g.
+        # the tolerance and aggregate rules on a single-currency feed.
+        rule_names = [rule[2] for rule in rules]
+        logger.warning("No key shared by rules %s splits the rows evenly; matching them unsharded.", ", ".join(rule_names))
+        metrics.event("shard_skew", rules=rule_names, columns=[gl_col for gl_col, _ in columns])
+        return process_rules(gl_df, swift_df, rules, False)
+
+    # Sharding on the shared rule keys (DC_AMOUNT and "Account Currency" for
+    # the exact rules) rather than the account alone also spreads the few
+    # very large correspondent accounts evenly across shards.
+    gl_df = gl_df.with_columns(shard_ids(gl_df, [gl_col for gl_col, _ in columns], shards))
+    swift_df = swift_df.with_columns(shard_ids(swift_df, [swift_col for _, swift_col in columns], shards))
+    gl_parts = gl_df.partition_by("_shard", as_dict=True, include_key=False)
+    swift_parts = swift_df.partition_by("_shard", as_dict=True, include_key=False)
+    keys = sorted(set(gl_parts) | set(swift_parts))
+    results = list(pool.map(
+        process_rules,
+        [gl_parts.get(k, gl_df.drop("_shard").clear()) for k in keys],
+        [swift_parts.get(k, swift_df.drop("_shard").clear()) for k in keys],
+        [rules] * len(keys),
+        [False] * len(keys),
+    ))
+    return tuple(pl.concat(frames).sort("Row_Id") if position % 2 else pl.concat(frames) for position, frames in enumerate(zip(*results)))
+
+def apply_schema(df, schema):
+    columns = column_names(df)
+    return df.with_columns([pl.col(c).cast(t, strict=False) for c, t in schema.items() if c in columns])
+
+def read_inputs(gl_file, mapping_file, swift_file, streaming=False):
+    with metrics.stage("ingest", streaming=streaming) as record:
+        frames = read_feeds(gl_file, mapping_file, swift_file, streaming)
+        record["rows_out"] = row_count(frames[0])
+        record["swift_rows_out"] = row_count(frames[2])
+        record["mapping_rows_out"] = frames[1].gl.height
+    return frames
+
+def read_gl_feed(path, read_csv=pl.read_csv):
+    return read_csv(path, schema_overrides={
         "Account_Number": pl.Utf8,
         "Nostro/Vostro/ Sett Entity ID": pl.Utf8,
         "Cash Amt": pl.Float64
     })
 
-    mapping_df = pl.read_csv(mapping_file, schema_overrides={
-        "Account_Number": pl.Utf8,
-        "Sierra Account Numbers": pl.Utf8,
-        "Acc_Num": pl.Utf8
-    })
-
-    swift_df = pl.read_csv(swift_file, schema_overrides={
+def read_swift_feed(path, read_csv=pl.read_csv):
+    # An Amount that does not parse raises rather than being read as null.
+    return read_csv(path, schema_overrides={
         "Account_Number": pl.Utf8,
+        "Nostro Account": pl.Utf8,
         "Amount": pl.Float64,
         "Account Currency": pl.Utf8,
+        "Transaction Id": pl.Utf8,
+        "Transation Reference": pl.Utf8,
         "Institution Reference": pl.Utf8
-    }, ignore_errors=True)
+    })
 
-    swift_df = swift_df.with_columns([
-        pl.col("Nostro Account").cast(pl.Utf8)  
-    ])
+def read_feeds(gl_file, mapping_file, swift_file, streaming):
+    read_csv = pl.scan_csv if streaming else pl.read_csv
+
+    gl_df = read_gl_feed(gl_file, read_csv)
+
+    # The mapping comes from the content-hash cache as two deduplicated
+    # lookups, one per join.
+    mapping = MappingLookups(mapping_file)
+
+    swift_df = read_swift_feed(swift_file, read_csv)
+
+    return gl_df, mapping, swift_df
 
+def enrich_inputs(gl_df, mapping, swift_df):
+    with metrics.stage("enrich", rows_in=row_count(gl_df), swift_rows_in=row_count(swift_df)) as record:
+        gl_df, swift_df = enrich_feeds(gl_df, mapping, swift_df)
+        record["rows_out"] = row_count(gl_df)
+        record["swift_rows_out"] = row_count(swift_df)
+    return gl_df, swift_df
+
+def enrich_gl(gl_df, gl_lookup):
     gl_df = merged(
         gl_df,
-        mapping_df,
+        gl_lookup,
         "Nostro/Vostro/ Sett Entity ID",
         "Sierra Account Numbers",
         ["Sierra Account Numbers", "Account Name", "Account Currency", "Account_Number", "Swift Code", "Country"]
     )
+    return categorical(apply_filters(gl_df, "Cash Amt", "Account Currency"), GL_CATEGORICAL + MAPPING_CATEGORICAL)
 
+def enrich_swift(swift_df, swift_lookup):
     swift_df = merged(
         swift_df,
-        mapping_df,
+        swift_lookup,
         "Nostro Account",
         "Account_Number",
         ["Account_Number", "Account Name", "Account Currency", "Swift Code", "Country"]
     )
+    return categorical(apply_filters(swift_df, "Amount", "Account Currency"), SWIFT_CATEGORICAL + MAPPING_CATEGORICAL)
+
+def enrich_feeds(gl_df, mapping, swift_df):
+    gl_lookup, swift_lookup = mapping.gl, mapping.swift
+    if isinstance(gl_df, pl.LazyFrame):
+        gl_lookup, swift_lookup = gl_lookup.lazy(), swift_lookup.lazy()
+    return enrich_gl(gl_df, gl_lookup), enrich_swift(swift_df, swift_lookup)
 
-    gl_df = apply_filters(gl_df, "Cash Amt", "Account Currency")
-    swift_df = apply_filters(swift_df, "Amount", "Account Currency")
+def load_inputs(gl_file, mapping_file, swift_file, streaming=False):
+    return enrich_inputs(*read_inputs(gl_file, mapping_file, swift_file, streaming))
 
-    rules = [
-        (["Trans Num", "DC_AMOUNT", "Account Currency"], ["Transation Reference", "DC_AMOUNT", "Account Currency"], "Rule 1"),
-        (["ExternalTxNum", "DC_AMOUNT", "Account Currency"], ["Institution Reference", "DC_AMOUNT", "Account Currency"], "Rule 2"),
-        (["ExternalTxNum", "DC_AMOUNT", "Account Currency"], ["Transation Reference", "DC_AMOUNT", "Account Currency"], "Rule 3"),
-    ]
+def pair_ledger(matched_gl, matched_swift, rules):
+    # One row per GL-SWIFT pair (GL Row_Id, SWIFT Row_Id, rule, run id),
+    # taken from both sides and de-duplicated so it holds every pair even
+    # when a row's Paired_Row_Id names only one of several partners.
+    # Reversals pair rows of the same side and are left out; their partner
+    # is in Paired_Row_Id.
+    same_side = [rule[2] for rule in rules if len(rule) > 3 and rule[3]["kind"] == "reversal"]
+    cross_side = ~pl.col("Matching_Rule").cast(pl.Utf8).is_in(same_side)
+    return pl.concat([
+        matched_gl.filter(cross_side).select(pl.col("Row_Id").alias("GL_Row_Id"), pl.col("Paired_Row_Id").alias("SWIFT_Row_Id"), "Matching_Rule"),
+        matched_swift.filter(cross_side).select(pl.col("Paired_Row_Id").alias("GL_Row_Id"), pl.col("Row_Id").alias("SWIFT_Row_Id"), "Matching_Rule"),
+    ]).unique(maintain_order=True).with_columns(pl.lit(metrics.run_id).alias("Run_Id"))
 
-    matched_gl, unmatched_gl, matched_swift, unmatched_swift = process_rules(gl_df, swift_df, rules)
+def process_data(gl_file, mapping_file, swift_file, output_file, streaming=False, workers=None, rules=RULES, output_format="csv"):
+    # In streaming mode every step below builds on lazy scans, and the two
+    # sinks execute the whole plan batch by batch on the streaming engine.
+    gl_df, swift_df = load_inputs(gl_file, mapping_file, swift_file, streaming)
+
+    if workers and streaming:
+        logger.warning("Ignoring workers: sharded matching needs in-memory frames, streaming mode runs unsharded.")
+        metrics.event("workers_ignored", workers=workers, reason="streaming")
+    if workers and not streaming:
+        matched_gl, unmatched_gl, matched_swift, unmatched_swift = process_rules_sharded(gl_df, swift_df, rules, workers)
+    else:
+        matched_gl, unmatched_gl, matched_swift, unmatched_swift = process_rules(gl_df, swift_df, rules)
 
     final_gl_df = pl.concat([matched_gl, unmatched_gl])
     final_swift_df = pl.concat([matched_swift, unmatched_swift])
+    ledger = pair_ledger(matched_gl, matched_swift, rules)
+
+    if output_format != "csv":
+        final_gl_df = apply_schema(final_gl_df, GL_SCHEMA)
+        final_swift_df = apply_schema(final_swift_df, SWIFT_SCHEMA)
 
-    final_gl_df.write_csv(output_file + "_gl.csv")
-    final_swift_df.write_csv(output_file + "_swift.csv")
+    extension = EXTENSIONS[output_format]
+    with metrics.stage("write", rows_in=row_count(final_gl_df), swift_rows_in=row_count(final_swift_df), format=output_format) as record:
+        if metrics.enabled:
+            record["columns"] = {"gl": column_names(final_gl_df), "swift": column_names(final_swift_df)}
+        metrics.plan(record, "gl", final_gl_df)
+        metrics.plan(record, "swift", final_swift_df)
+        sinks = [
+            write_table(final_gl_df, output_file + "_gl" + extension),
+            write_table(final_swift_df, output_file + "_swift" + extension),
+            write_table(ledger, output_file + "_pairs" + extension),
+        ]
+        if streaming:
+            pl.collect_all(sinks, engine="streaming")
+        record["rows_out"] = row_count(final_gl_df)
+        record["pairs_out"] = row_count(ledger)
 
-    print("Final GL DataFrame Columns:", final_gl_df.columns)
-    print("Final SWIFT DataFrame Columns:", final_swift_df.columns)
+    return matched_gl, unmatched_gl, matched_swift, unmatched_swift
 
-process_data(
-    gl_file="NOSTRO_GL.csv",
-    mapping_file="Nostro_Mapping.csv",
-    swift_file="NOSTRO_SWIFT.csv",
-    output_file="matched_data"
-)
+def add_rule_arguments(parser):
+    parser.add_argument("--tolerance", action="store_true", help="after the exact rules, match within amount tolerance and value-date window")
+    parser.add_argument("--reversals", action="store_true", help="before the rules, pair same-side entries that reverse each other (MATCHING_STATUS Reversal)")
+    parser.add_argument("--reversal-days", type=int, default=REVERSAL_DAYS, help="with --reversals, the most days between an entry and its reversal")
+    parser.add_argument("--reversal-by-reference", action="store_true", help="with --reversals, also require the same Trans Num / Transaction Id")
+    parser.add_argument("--aggregate", action="store_true", help="after the other rules, match several rows sharing a reference against a single row of the other side by their total")
+    parser.add_argument("--aggregate-max-group", type=int, default=AGGREGATE_MAX_GROUP, help="with --aggregate, the most rows summed into one group")
+    parser.add_argument("--aggregate-tolerance", type=float, default=0.0, help="with --aggregate, the largest difference allowed between a group total and the single row")
+
+def selected_rules(args):
+    rules = reversal_rules(args.reversal_days, args.reversal_by_reference) if args.reversals else []
+    rules = rules + RULES + (TOLERANCE_RULES if args.tolerance else [])
+    return rules + (aggregate_rules(args.aggregate_max_group, args.aggregate_tolerance) if args.aggregate else [])
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--streaming", action="store_true", help="run the pipeline on lazy scans with the streaming engine")
+    parser.add_argument("--workers", type=int, help="match key-sharded partitions on a pool of this many processes")
+    add_rule_arguments(parser)
+    parser.add_argument("--format", choices=sorted(EXTENSIONS), default="csv", help="output format for the matched_data_gl/_swift datasets")
+    parser.add_argument("--metrics", help="append per-stage metrics to this JSON-lines file and print a run summary")
+    parser.add_argument("--plans", action="store_true", help="with --metrics, also record the optimized query plans of lazy stages")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.configure(args.metrics, args.plans)
+
+    process_data(
+        gl_file="NOSTRO_GL.csv",
+        mapping_file="Nostro_Mapping.csv",
+        swift_file="NOSTRO_SWIFT.csv",
+        output_file="matched_data",
+        streaming=args.streaming,
+        workers=args.workers,
+        rules=selected_rules(args),
+        output_format=args.format
+    )
@@ -0,0 +1,200 @@
+import argparse
+import glob
+import os
+from datetime import datetime
+
+import polars as pl
+
+from matched_data import GL_SCHEMA, RULES, SWIFT_SCHEMA, apply_schema, load_inputs, process_rules, with_row_ids
+
+def new_run_id():
+    return datetime.now().strftime("%Y%m%dT%H%M%S%f")
+
+def pool_path(store_dir, name):
+    return os.path.join(store_dir, name + ".parquet")
+
+def ledger_dir(store_dir, side):
+    return os.path.join(store_dir, f"matched_{side}")
+
+def load_pool(store_dir):
+    if not os.path.exists(pool_path(store_dir, "feeds")):
+        return None
+    # Pools saved before the compact schema or before row ids are upgraded
+    # as they are read.
+    open_gl = apply_schema(pl.read_parquet(pool_path(store_dir, "open_gl")), GL_SCHEMA)
+    open_swift = apply_schema(pl.read_parquet(pool_path(store_dir, "open_swift")), SWIFT_SCHEMA)
+    if "Row_Id" not in open_gl.columns:
+        open_gl, open_swift = with_row_ids(open_gl), with_row_ids(open_swift)
+    feeds = pl.read_parquet(pool_path(store_dir, "feeds"))
+    if "Run_Id" not in feeds.columns:
+        feeds = feeds.with_columns(pl.lit(None, pl.Utf8).alias("Run_Id"))
+    return open_gl, open_swift, feeds
+
+def load_ledger(store_dir, side):
+    parts = sorted(glob.glob(os.path.join(ledger_dir(store_dir, side), "*.parquet")))
+    if not parts:
+        return None
+    return pl.scan_parquet(parts)
+
+def next_row_id(store_dir, side, open_df):
+    # Row ids are kept for the life of the store, so Paired_Row_Id in the
+    # ledger stays valid across runs; new rows are numbered after every id
+    # the store has handed out.
+    ids = [open_df["Row_Id"].max()]
+    ledger = load_ledger(store_dir, side)
+    if ledger is not None:
+        ids.append(ledger.select(pl.col("Row_Id").max()).collect().item())
+    ids = [i for i in ids if i is not None]
+    return max(ids) + 1 if ids else 0
+
+def with_status(open_df):
+    return open_df.with_columns(
+        pl.lit(None, pl.UInt32).alias("Paired_Row_Id"),
+        pl.lit("Unmatched", pl.Categorical).alias("Matching_Rule"),
+    )
+
+def discard_unfinished(store_dir, feeds):
+    # Ledger parts newer than the last run recorded in the feed list were
+    # written by a run that stopped before saving its pool. That run's feeds
+    # are matched again, so its parts would duplicate the ledger.
+    last_run = feeds["Run_Id"].max()
+    if last_run is None:
+        return
+    for side in ("gl", "swift"):
+        for part in glob.glob(os.path.join(ledger_dir(store_dir, side), "*.parquet")):
+            if os.path.basename(part)[:-len(".parquet")] > last_run:
+                os.remove(part)
+
+def feed_names(df, source, run_id):
+    return df.select(
+        pl.lit(source).alias("SOURCE"), pl.col("FEED_FILE_NAME").cast(pl.Utf8), pl.lit(run_id, pl.Utf8).alias("Run_Id")
+    ).unique()
+
+def match_into_pool(open_gl, open_swift, new_gl, new_swift, rules, first_ids):
+    # New rows, numbered from first_ids (GL, SWIFT), matched together with
+    # the open pool; returns the matched rows and the new open pool.
+    new_gl = new_gl.with_row_index("Row_Id", offset=first_ids[0])
+    new_swift = new_swift.with_row_index("Row_Id", offset=first_ids[1])
+    matched_gl, unmatched_gl, matched_swift, unmatched_swift = process_rules(
+        pl.concat([open_gl, new_gl.cast(dict(open_gl.schema), strict=False)], how="vertical_relaxed"),
+        pl.concat([open_swift, new_swift.cast(dict(open_swift.schema), strict=False)], how="vertical_relaxed"),
+        rules,
+        row_ids=False,
+    )
+    return matched_gl, unmatched_gl.drop("Paired_Row_Id", "Matching_Rule"), matched_swift, unmatched_swift.drop("Paired_Row_Id", "Matching_Rule")
+
+def save_pool(store_dir, run_id, open_gl, open_swift, feeds, matched_gl, matched_swift):
+    os.makedirs(store_dir, exist_ok=True)
+    for side, matched in (("gl", matched_gl), ("swift", matched_swift)):
+        os.makedirs(ledger_dir(store_dir, side), exist_ok=True)
+        if not matched.is_empty():
+            matched.write_parquet(os.path.join(ledger_dir(store_dir, side), f"{run_id}.parquet"))
+
+    # The open pool and feed list are replaced atomically; ledger parts are
+    # append-only, one file per run.
+    for name, df in (("open_gl", open_gl), ("open_swift", open_swift), ("feeds", feeds)):
+        df.write_parquet(pool_path(store_dir, name) + ".tmp")
+        os.replace(pool_path(store_dir, name) + ".tmp", pool_path(store_dir, name))
+
+def match_full(gl_file, mapping_file, swift_file, rules, run_id=None):
+    gl_df, swift_df = load_inputs(gl_file, mapping_file, swift_file)
+    matched_gl, unmatched_gl, matched_swift, unmatched_swift = process_rules(gl_df, swift_df, rules)
+    feeds = pl.concat([feed_names(gl_df, "NOSTRO_GL", run_id), feed_names(swift_df, "NOSTRO_SWIFT", run_id)])
+    return matched_gl, unmatched_gl.drop("Paired_Row_Id", "Matching_Rule"), matched_swift, unmatched_swift.drop("Paired_Row_Id", "Matching_Rule"), feeds
+
+def rebuild_pool(store_dir, gl_file, mapping_file, swift_file, rules=RULES):
+    run_id = new_run_id()
+    matched_gl, open_gl, matched_swift, open_swift, feeds = match_full(gl_file, mapping_file, swift_file, rules, run_id)
+    for side in ("gl", "swift"):
+        for part in glob.glob(os.path.join(ledger_dir(store_dir, side), "*.parquet")):
+            os.remove(part)
+    save_pool(store_dir, run_id, open_gl, open_swift, feeds, matched_gl, matched_swift)
+    print(f"Rebuilt pool in {store_dir}: {open_gl.height} open GL, {open_swift.height} open SWIFT items.")
+    return matched_gl, open_gl, matched_swift, open_swift
+
+def run_incremental(store_dir, gl_file, mapping_file, swift_file, rules=RULES):
+    pool = load_pool(store_dir)
+    if pool is None:
+        print(f"No pool in {store_dir}; building it from the full input.")
+        return rebuild_pool(store_dir, gl_file, mapping_file, swift_file, rules)
+    open_gl, open_swift, feeds = pool
+    discard_unfinished(store_dir, feeds)
+    run_id = new_run_id()
+
+    # Only rows from feed files not seen by an earlier run are materialised;
+    # the rest of the history is skipped during the scan.
+    gl_df, swift_df = load_inputs(gl_file, mapping_file, swift_file, streaming=True)
+    seen_gl = feeds.filter(pl.col("SOURCE") == "NOSTRO_GL")["FEED_FILE_NAME"].implode()
+    seen_swift = feeds.filter(pl.col("SOURCE") == "NOSTRO_SWIFT")["FEED_FILE_NAME"].implode()
+    new_gl, new_swift = pl.collect_all([
+        gl_df.filter(~pl.col("FEED_FILE_NAME").is_in(seen_gl)),
+        swift_df.filter(~pl.col("FEED_FILE_NAME").is_in(seen_swift)),
+    ], engine="streaming")
+
+    if new_gl.is_empty() and new_swift.is_empty():
+        print("No new feed files; pool unchanged.")
+        return with_status(open_gl.clear()), open_gl, with_status(open_swift.clear()), open_swift
+
+    first_ids = (next_row_id(store_dir, "gl", open_gl), next_row_id(store_dir, "swift", open_swift))
+    matched_gl, open_gl, matched_swift, open_swift = match_into_pool(open_gl, open_swift, new_gl, new_swift, rules, first_ids)
+    feeds = pl.concat([feeds, feed_names(new_gl, "NOSTRO_GL", run_id), feed_names(new_swift, "NOSTRO_SWIFT", run_id)])
+
+    save_pool(store_dir, run_id, open_gl, open_swift, feeds, matched_gl, matched_swift)
+    print(
+        f"Matched {matched_gl.height} GL / {matched_swift.height} SWIFT items from "
+        f"{new_gl.height} new GL and {new_swift.height} new SWIFT rows; "
+        f"{open_gl.height} GL / {open_swift.height} SWIFT items remain open."
+    )
+    return matched_gl, open_gl, matched_swift, open_swift
+
+def multiset_difference(left, right):
+    columns = [c for c in left.columns if c in right.columns]
+    left_counts = left.group_by(columns).len("_left")
+    right_counts = right.select(columns).cast({c: left.schema[c] for c in columns}, strict=False).group_by(columns).len("_right")
+    return (
+        left_counts.join(right_counts, on=columns, how="full", nulls_equal=True, coalesce=True)
+        .with_columns(pl.col("_left").fill_null(0), pl.col("_right").fill_null(0))
+        .filter(pl.col("_left") != pl.col("_right"))
+    )
+
+def verify_pool(store_dir, gl_file, mapping_file, swift_file, rules=RULES):
+    pool = load_pool(store_dir)
+    if pool is None:
+        print(f"No pool in {store_dir} to verify.")
+        return False
+    open_gl, open_swift, _ = pool
+    _, expected_gl, _, expected_swift, _ = match_full(gl_file, mapping_file, swift_file, rules)
+
+    consistent = True
+    for side, stored, expected in (("GL", open_gl, expected_gl), ("SWIFT", open_swift, expected_swift)):
+        # Row ids depend on the order rows reached the pool, not on content.
+        difference = multiset_difference(stored.drop("Row_Id"), expected.drop("Row_Id"))
+        if difference.is_empty():
+            print(f"{side} open pool matches a full recompute ({stored.height} items).")
+            continue
+        consistent = False
+        only_stored = difference.select((pl.col("_left") - pl.col("_right")).clip(lower_bound=0).sum()).item()
+        only_expected = difference.select((pl.col("_right") - pl.col("_left")).clip(lower_bound=0).sum()).item()
+        print(f"{side} open pool differs from a full recompute: {only_stored} items only in the pool, {only_expected} only in the recompute.")
+    return consistent
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--store", default="open_item_pool", help="directory holding the open-item pool and matched ledger")
+    parser.add_argument("--gl-file", default="NOSTRO_GL.csv")
+    parser.add_argument("--mapping-file", default="Nostro_Mapping.csv")
+    parser.add_argument("--swift-file", default="NOSTRO_SWIFT.csv")
+    parser.add_argument("--output-file", default="matched_data")
+    command = parser.add_mutually_exclusive_group()
+    command.add_argument("--rebuild", action="store_true", help="rebuild the pool from a full recompute of the inputs")
+    command.add_argument("--verify", action="store_true", help="compare the pool against a full recompute of the inputs")
+    args = parser.parse_args()
+
+    if args.verify:
+        raise SystemExit(0 if verify_pool(args.store, args.gl_file, args.mapping_file, args.swift_file) else 1)
+
+    run = rebuild_pool if args.rebuild else run_incremental
+    matched_gl, open_gl, matched_swift, open_swift = run(args.store, args.gl_file, args.mapping_file, args.swift_file)
+
+    pl.concat([matched_gl, with_status(open_gl)]).write_csv(args.output_file + "_gl.csv")
+    pl.concat([matched_swift, with_status(open_swift)]).write_csv(args.output_file + "_swift.csv")
@@ -0,0 +1,96 @@
+import configparser
+import io
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from psycopg2.pool import ThreadedConnectionPool
+
+# Connection settings come from the [postgres] section of an INI file and
+# can be overridden by the standard libpq environment variables.
+SETTINGS_ENV = {
+    "host": "PGHOST",
+    "port": "PGPORT",
+    "database": "PGDATABASE",
+    "user": "PGUSER",
+    "password": "PGPASSWORD",
+}
+
+def connection_settings(config_file="postgres.ini", section="postgres"):
+    settings = {}
+    if config_file and os.path.exists(config_file):
+        parser = configparser.ConfigParser()
+        parser.read(config_file)
+        if parser.has_section(section):
+            settings.update(parser[section])
+    for key, env in SETTINGS_ENV.items():
+        if os.environ.get(env):
+            settings[key] = os.environ[env]
+    return settings
+
+def connection_pool(settings, size=4):
+    return ThreadedConnectionPool(1, size, **settings)
+
+def quoted(column):
+    return '"' + column.replace('"', '""') + '"'
+
+class FrameReader:
+    # File-like view of a Polars frame as CSV, rendered a batch of rows at a
+    # time as COPY reads it, so no temporary file or full CSV copy is made.
+
+    def __init__(self, df, batch_rows=50_000):
+        self.df = df
+        self.batch_rows = batch_rows
+        self.offset = 0
+        self.buffer = b""
+        self.position = 0
+
+    def next_batch(self):
+        if self.offset >= self.df.height:
+            return b""
+        batch = io.BytesIO()
+        self.df.slice(self.offset, self.batch_rows).write_csv(batch, include_header=False, float_scientific=False)
+        self.offset += self.batch_rows
+        return batch.getvalue()
+
+    def read(self, size=-1):
+        if size < 0:
+            data = self.buffer[self.position:] + b"".join(iter(self.next_batch, b""))
+            self.buffer, self.position = b"", 0
+            return data
+        if self.position >= len(self.buffer):
+            self.buffer, self.position = self.next_batch(), 0
+        data = self.buffer[self.position:self.position + size]
+        self.position += len(data)
+        return data
+
+def copy_frame(pool, table, df):
+    conn = pool.getconn()
+    try:
+        with conn.cursor() as cur:
+            columns = ", ".join(quoted(c) for c in df.columns)
+            cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH CSV", FrameReader(df), size=1 << 20)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        pool.putconn(conn)
+    return df.height
+
+def copy_jobs(frames, rows_per_stream):
+    # Large frames are split into contiguous slices, each loaded by its own
+    # COPY on its own connection.
+    jobs = []
+    for table, df in frames.items():
+        streams = max(1, -(-df.height // rows_per_stream))
+        step = max(1, -(-df.height // streams))
+        jobs += [(table, df.slice(start, step)) for start in range(0, df.height, step)] or [(table, df)]
+    return jobs
+
+def load_frames(pool, frames, workers=4, rows_per_stream=1_000_000):
+    loaded = dict.fromkeys(frames, 0)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [(table, executor.submit(copy_frame, pool, table, df)) for table, df in copy_jobs(frames, rows_per_stream)]
+        for table, future in futures:
+            loaded[table] += future.result()
+    return loaded
@@ -0,0 +1,170 @@
+import argparse
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import polars as pl
+
+import filtering_data
+import matched_data
+from columnar_io import EXTENSIONS, load_sheets, read_table
+from mapping_cache import MappingLookups
+from script_loader import load_script
+from stage_metrics import metrics
+from unmatched_record import unmatched_exports, unmatchedtransactionsreport
+
+CombinedReport = load_script("excel processor.py", "excel_processor").CombinedReport
+AegingReport = load_script("unmatched-filter-aeging_report.py", "aeging_report").AegingReport
+
+class NightlyRun:
+    # Every nightly output from one load of each input. Stages form a
+    # dependency graph: each one starts as soon as the stages it needs are
+    # done, and independent stages run together on a thread pool over the
+    # same in-memory frames (Polars releases the GIL, and threads share the
+    # frames without pickling them to worker processes).
+    #
+    # ConsolidatedReport.xlsx is produced outside this tree, so the summary
+    # and ageing reports only wait for its load, not for matching.
+
+    def __init__(self, directory=".", output_format="csv", rules=matched_data.RULES, match_workers=None,
+                 consolidated_report="ConsolidatedReport.xlsx", currencies=None, currency_workers=None):
+        self.directory = directory
+        self.consolidated_report = consolidated_report
+        self.currencies = currencies
+        self.currency_workers = currency_workers
+        self.output_format = output_format
+        self.rules = rules
+        self.match_workers = match_workers
+        # name: (dependencies, run, reload); reload, where given, rebuilds
+        # the stage's result from what an earlier run saved, so --only can
+        # rerun a report without redoing the stages it depends on.
+        self.stages = {
+            "match": ([], self.match, self.reload_match),
+            "consolidated": ([], self.load_consolidated, None),
+            "summary": (["consolidated"], self.summary_report, None),
+            "ageing": (["consolidated"], self.ageing_report, None),
+            "unmatched_detail": (["match"], self.unmatched_detail_report, None),
+            "currency": (["match"], self.currency_reports, None),
+        }
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def match(self, results):
+        _, unmatched_gl, _, unmatched_swift = matched_data.process_data(
+            gl_file=self.path("NOSTRO_GL.csv"),
+            mapping_file=self.path("Nostro_Mapping.csv"),
+            swift_file=self.path("NOSTRO_SWIFT.csv"),
+            output_file=self.path("matched_data"),
+            workers=self.match_workers,
+            rules=self.rules,
+            output_format=self.output_format,
+        )
+        return unmatched_gl, unmatched_swift
+
+    def reload_match(self, results):
+        # The unmatched rows of the matched_data datasets written last time.
+        # CSV is read as text so the output schema, not inference, types it.
+        extension = EXTENSIONS[self.output_format]
+        frames = []
+        for side, schema in [("gl", matched_data.GL_SCHEMA), ("swift", matched_data.SWIFT_SCHEMA)]:
+            path = self.path(f"matched_data_{side}{extension}")
+            df = pl.read_csv(path, infer_schema=False) if self.output_format == "csv" else read_table(path)
+            frames.append(matched_data.apply_schema(df, schema).filter(pl.col("Matching_Rule") == "Unmatched"))
+        return tuple(frames)
+
+    def load_consolidated(self, results):
+        # Both reports' columns in one read; each report selects its own.
+        columns = list(dict.fromkeys(CombinedReport.columns + AegingReport.columns))
+        return load_sheets(self.path(self.consolidated_report), columns)
+
+    def summary_report(self, results):
+        CombinedReport(None, self.path("finalreport.xlsx")).build_report(*results["consolidated"])
+
+    def ageing_report(self, results):
+        AegingReport(None, self.path("AegingReport.xlsx")).build_report(*results["consolidated"])
+
+    def unmatched_detail_report(self, results):
+        mapping_file = self.path("Nostro_Mapping.csv")
+        mapping = MappingLookups(mapping_file) if os.path.exists(mapping_file) else None
+        gl_export, swift_export = unmatched_exports(*results["match"])
+        unmatchedtransactionsreport.from_frames(
+            gl_export, swift_export, self.path("unmatchedtransactionsreport.xlsx"), mapping
+        ).create_report()
+
+    def currency_reports(self, results):
+        filtering_data.currency_reports(*results["match"], self.currencies, self.directory, self.currency_workers)
+
+    def plan(self, only=None):
+        # Stage name -> function to call. Stages outside --only that a
+        # selected stage needs are reloaded where possible, otherwise run.
+        only = list(only or self.stages)
+        unknown = [name for name in only if name not in self.stages]
+        if unknown:
+            raise ValueError(f"Unknown stages {unknown}; choose from {list(self.stages)}")
+        selected = {}
+
+        def add(name):
+            if name in selected:
+                return
+            dependencies, run, reload = self.stages[name]
+            selected[name] = run if name in only or reload is None else reload
+            for dependency in dependencies:
+                add(dependency)
+
+        for name in only:
+            add(name)
+        return selected
+
+    def timed(self, name, func, results):
+        label = name if func == self.stages[name][1] else f"{name} (reloaded)"
+        start = time.perf_counter()
+        with metrics.stage(f"run_reports.{name}", reloaded=label != name):
+            result = func(results)
+        elapsed = time.perf_counter() - start
+        print(f"  {label:<28} {elapsed:9.3f}s")
+        return elapsed, result
+
+    def run(self, only=None, workers=None):
+        pending = self.plan(only)
+        results, timings, running = {}, {}, {}
+        start = time.perf_counter()
+        with ThreadPoolExecutor(workers) as pool:
+            while pending or running:
+                for name in [n for n in pending if all(d in results for d in self.stages[n][0])]:
+                    running[pool.submit(self.timed, name, pending.pop(name), results)] = name
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    timings[name], results[name] = future.result()
+        elapsed = time.perf_counter() - start
+        print(f"  {'total':<28} {elapsed:9.3f}s  (stages sum to {sum(timings.values()):.3f}s)")
+        return timings
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--directory", default=".", help="folder holding the feeds and ConsolidatedReport.xlsx; reports are written there")
+    parser.add_argument("--only", nargs="+", metavar="STAGE", help="run only these stages (match, consolidated, summary, ageing, unmatched_detail, currency); "
+                        "the unmatched reports then reuse the matched_data output of the last run")
+    parser.add_argument("--workers", type=int, help="threads running independent stages (default: Python's pool size)")
+    parser.add_argument("--currencies", nargs="+", help="write per-currency unmatched reports only for these (default: every currency)")
+    parser.add_argument("--currency-workers", type=int, help="worker processes writing the per-currency reports (default: one per core)")
+    parser.add_argument("--match-workers", type=int, help="match key-sharded partitions on a pool of this many processes")
+    matched_data.add_rule_arguments(parser)
+    parser.add_argument("--format", choices=sorted(EXTENSIONS), default="csv", help="format of the matched_data_gl/_swift datasets")
+    parser.add_argument("--metrics", help="append per-stage metrics to this JSON-lines file and print a run summary")
+    parser.add_argument("--plans", action="store_true", help="with --metrics, also record the optimized query plans of lazy stages")
+    args = parser.parse_args()
+
+    if args.metrics:
+        metrics.configure(args.metrics, args.plans)
+
+    run = NightlyRun(
+        directory=args.directory,
+        output_format=args.format,
+        rules=matched_data.selected_rules(args),
+        match_workers=args.match_workers,
+        currencies=args.currencies,
+        currency_workers=args.currency_workers,
+    )
+    run.run(args.only, args.workers)
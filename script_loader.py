@@ -0,0 +1,15 @@
+import importlib.util
+import os
+import sys
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+def load_script(filename, name):
+    # Scripts whose file names Python cannot import ("excel processor.py",
+    # "unmatched-filter-aeging_report.py", "sql query.py"), loaded as module
+    # `name`. filename is relative to this directory, not the working one.
+    spec = importlib.util.spec_from_file_location(name, os.path.join(HERE, filename))
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
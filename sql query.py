@@ -1,313 +1,339 @@
-import psycopg2
-
+import argparse
+import time
+
+import polars as pl
+
+from mapping_cache import LOOKUPS, MappingLookups
+from matched_data import RULES
+from pg_bulk_load import connection_pool, connection_settings, load_frames, quoted
+
+# Staging tables are UNLOGGED and typed like matched_data.GL_SCHEMA /
+# SWIFT_SCHEMA: amounts and balances are NUMERIC, references, account
+# numbers and dates stay TEXT exactly as fed.
+GL_STAGE_COLUMNS = {
+    "Nostro/Vostro/ Sett Entity ID": "TEXT",
+    "Nostro/Vostro/ Sett Entity Cur": "TEXT",
+    "Val/Settle Date": "TEXT",
+    "ExternalTxNum": "TEXT",
+    "MAPS_TRDVERIFY-IMPORT": "TEXT",
+    "Trade Remarks 1": "TEXT",
+    "Cash Amt": "NUMERIC",
+    "Trans Num": "TEXT",
+    "FEED_FILE_NAME": "TEXT",
+}
 
-conn = psycopg2.connect(
-    host="you host",
-    database="your db",
-    user="user_name",
-    password="password",
-    port=5432
-)
-cur = conn.cursor()
+SWIFT_STAGE_COLUMNS = {
+    "Value Date": "TEXT",
+    "Entry Date": "TEXT",
+    "Amount": "NUMERIC",
+    "Transaction Id": "TEXT",
+    "Transation Reference": "TEXT",
+    "Institution Reference": "TEXT",
+    "Custumer Reference": "TEXT",
+    "Description": "TEXT",
+    "Opening Balance": "NUMERIC",
+    "Opening Balance Date": "TEXT",
+    "Opening Balance Currency": "TEXT",
+    "Intermidiate start Balance": "NUMERIC",
+    "intermidiate Balance Date": "TEXT",
+    "intermidiate Balance Currency": "TEXT",
+    "intermidiate End Balance": "NUMERIC",
+    "intermidiate End Date": "TEXT",
+    "intermidiate End Currency": "TEXT",
+    "Closing Balance": "NUMERIC",
+    "Closing Balance Date": "TEXT",
+    "Closing Balance Currency": "TEXT",
+    "Nostro Account": "TEXT",
+    "Bank Transaction Reference": "TEXT",
+    "Information": "TEXT",
+    "FEED_FILE_NAME": "TEXT",
+    "Currency Dr/Cr": "TEXT",
+}
 
-create_gl = """
-DROP TABLE IF EXISTS nostro_gl_raw;
-CREATE TABLE nostro_gl_raw (
-    "Nostro/Vostro/ Sett Entity ID" TEXT,
-    "Nostro/Vostro/ Sett Entity Cur" TEXT,
-    "Val/Settle Date" TEXT,
-    "ExternalTxNum" TEXT,
-    "MAPS_TRDVERIFY-IMPORT" TEXT,
-    "Trade Remarks 1" TEXT,
-    "Cash Amt" TEXT,
-    "Trans Num" TEXT,
-    "FEED_FILE_NAME" TEXT
-    
-);
-"""
-cur.execute(create_gl)
+# The mapping is staged as the two cached lookups (see mapping_cache), each
+# already reduced to one row per join key. The feeds also carry "_row", their
+# 0-based file row, through the parallel COPY streams, so row numbers do not
+# depend on the order the streams land in.
+STAGE_TABLES = {
+    "nostro_gl_stage": {"_row": "BIGINT", **GL_STAGE_COLUMNS},
+    "nostro_swift_stage": {"_row": "BIGINT", **SWIFT_STAGE_COLUMNS},
+    **{
+        f"nostro_{side}_mapping_stage": {column: "TEXT" for column in [key, *columns]}
+        for side, (key, columns) in LOOKUPS.items()
+    },
+}
 
-create_swift = """
-DROP TABLE IF EXISTS nostro_swift_raw;
-CREATE TABLE nostro_swift_raw (
-    "Value Date" TEXT,
-    "Entry Date" TEXT,
-    "Amount" TEXT,
-    "Transaction Id" TEXT,
-    "Transation Reference" TEXT,
-    "Institution Reference" TEXT,
-    "Custumer Reference" TEXT,
-    "Description" TEXT,
-    "Opening Balance" TEXT,
-    "Opening Balance Date" TEXT,
-    "Opening Balance Currency" TEXT,
-    "Intermidiate start Balance" TEXT,
-    "intermidiate Balance Date" TEXT,
-    "intermidiate Balance Currency" TEXT,
-    "intermidiate End Balance" TEXT,
-    "intermidiate End Date" TEXT,
-    "intermidiate End Currency" TEXT,
-    "Closing Balance" TEXT,
-    "Closing Balance Date" TEXT,
-    "Closing Balance Currency" TEXT,
-    "Nostro Account" TEXT,
-    "Bank Transaction Reference" TEXT,
-    "Information" TEXT,
-    "FEED_FILE_NAME" TEXT,
-    "Currency Dr/Cr" TEXT
-);
+def create_stage_tables(conn):
+    with conn.cursor() as cur:
+        for table, columns in STAGE_TABLES.items():
+            cur.execute(f"""
+            DROP TABLE IF EXISTS {table};
+            CREATE UNLOGGED TABLE {table} ({", ".join(f"{quoted(c)} {t}" for c, t in columns.items())});
+            """)
+    conn.commit()
+
+def load_stage(pool, gl_file, swift_file, mapping_file, workers):
+    # The feeds are read as text and streamed into staging with COPY from
+    # memory; Postgres parses the NUMERIC columns.
+    files = {
+        "nostro_gl_stage": gl_file,
+        "nostro_swift_stage": swift_file,
+        "nostro_gl_mapping_stage": mapping_file,
+        "nostro_swift_mapping_stage": mapping_file,
+    }
+    mapping = MappingLookups(mapping_file)
+    frames = {
+        "nostro_gl_mapping_stage": mapping.gl,
+        "nostro_swift_mapping_stage": mapping.swift,
+    }
+    for table in ["nostro_gl_stage", "nostro_swift_stage"]:
+        df = pl.read_csv(files[table], infer_schema=False).with_row_index("_row")
+        frames[table] = df.select([c for c in STAGE_TABLES[table] if c in df.columns])
+
+    for table, rows in load_frames(pool, frames, workers=workers).items():
+        print(f"Loaded {rows} rows from {files[table]} into {table}")
+
+# Mapping enrichment, Dr/Cr, DC_AMOUNT and the USD filter happen in a single
+# set-based pass per side, so the ready tables are written once and carry no
+# dead tuples. The mapping lookups hold one row per key, as the old
+# UPDATE ... FROM only ever applied one mapping row per account. GL rows
+# without a mapped currency are kept, as the old DELETE did. A zero amount
+# is a credit, as in matched_data.enrich_feeds; only a missing one has no
+# Dr/Cr. "_row" stays the file row, like Row_Id in matched_data.
+MAPPED_COLUMNS = ["Account Name", "Account Currency", "Account_Number", "Swift Code", "Country"]
+
+def dr_cr(amount):
+    return f"CASE WHEN {amount} < 0 THEN 'Dr' WHEN {amount} >= 0 THEN 'Cr' END AS \"Dr/Cr\""
+
+def currency_filter(currency, keep_unmapped):
+    condition = f"""m."Account Currency" = '{currency}'"""
+    if keep_unmapped:
+        condition += ' OR m."Account Currency" IS NULL'
+    return condition
+
+def ready_table(table, stage, alias, amount, stage_key, mapping_stage, mapping_key, currency="USD", keep_unmapped=False):
+    # keep_unmapped keeps stage rows with no mapping row (LEFT JOIN) or no
+    # mapped currency.
+    amount = f"{alias}.{quoted(amount)}"
+    mapped = ",\n    ".join(f"m.{quoted(c)}" for c in MAPPED_COLUMNS)
+    join = "LEFT JOIN" if keep_unmapped else "JOIN"
+    return f"""
+DROP TABLE IF EXISTS {table};
+CREATE TABLE {table} AS
+SELECT
+    {alias}.*,
+    {mapped},
+    {dr_cr(amount)},
+    ABS({amount}) AS "DC_AMOUNT"
+FROM {stage} {alias}
+{join} {mapping_stage} m ON {alias}.{quoted(stage_key)} = m.{quoted(mapping_key)}
+WHERE {currency_filter(currency, keep_unmapped)};
 """
-cur.execute(create_swift)
 
-create_mapping = """
-DROP TABLE IF EXISTS nostro_mapping_raw;
-CREATE TABLE nostro_mapping_raw (
-    "Account Name" TEXT,
-    "Account Currency" TEXT,
-    "Account_Number" TEXT,
-    "Swift Code" TEXT,
-    "Sierra Account Numbers" TEXT,
-    "Country" TEXT,
-    "ReconName" TEXT,
-    "Reconid" TEXT,
-    "ReconProcess" TEXT,
-    "Source" TEXT,
-    "ClosingBalance" TEXT,
-    "Account Name Curr" TEXT,
-    "Acc_Num" TEXT
-);
+def ready_table_statements(currency="USD"):
+    return [
+        ready_table("nostro_gl_raw", "nostro_gl_stage", "g", "Cash Amt", "Nostro/Vostro/ Sett Entity ID",
+                    "nostro_gl_mapping_stage", LOOKUPS["gl"][0], currency, keep_unmapped=True),
+        ready_table("nostro_swift_raw", "nostro_swift_stage", "s", "Amount", "Nostro Account",
+                    "nostro_swift_mapping_stage", LOOKUPS["swift"][0], currency),
+        """
+ALTER TABLE nostro_gl_raw ADD PRIMARY KEY ("_row");
+ALTER TABLE nostro_swift_raw ADD PRIMARY KEY ("_row");
+DROP TABLE nostro_gl_stage;
+DROP TABLE nostro_swift_stage;
+DROP TABLE nostro_gl_mapping_stage;
+DROP TABLE nostro_swift_mapping_stage;
+""",
+    ]
+
+def build_ready_tables(conn):
+    with conn.cursor() as cur:
+        for statement in ready_table_statements():
+            cur.execute(statement)
+    conn.commit()
+
+def key_condition(gl_cols, swift_cols):
+    return " AND ".join(f"g.{quoted(g)} = s.{quoted(s)}" for g, s in zip(gl_cols, swift_cols))
+
+def open_candidates(table, alias, columns, other_table, other_alias, condition, match_table, other_match_table):
+    # Open rows of one side whose key occurs among the open rows of the
+    # other, numbered by "_row" within their key.
+    keys = ", ".join(f"{alias}.{quoted(c)}" for c in columns)
+    return f"""
+        SELECT {alias}."_row", {keys}, ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY {alias}."_row") AS "_rank"
+        FROM {table} {alias}
+        WHERE NOT EXISTS (SELECT 1 FROM {match_table} m WHERE m."_row" = {alias}."_row")
+          AND EXISTS (
+              SELECT 1 FROM {other_table} {other_alias}
+              WHERE {condition}
+                AND NOT EXISTS (SELECT 1 FROM {other_match_table} m WHERE m."_row" = {other_alias}."_row")
+          )"""
+
+def rule_statements(rank, gl_cols, swift_cols):
+    # Same one-to-one, first-rule-wins semantics as matched_data.assign_rules:
+    # within each key the k-th open GL row pairs with the k-th open SWIFT
+    # row, so surplus duplicates stay open for later rules. The pairs are
+    # kept in match_pairs and both match tables are filled from them.
+    # Each rule is a plain equi-join, so Postgres can plan hash or merge
+    # semi/anti joins instead of a nested loop over an OR condition.
+    condition = key_condition(gl_cols, swift_cols)
+    gl_open = open_candidates("nostro_gl_raw", "g", gl_cols, "nostro_swift_raw", "s", condition, "gl_rule_match", "swift_rule_match")
+    swift_open = open_candidates("nostro_swift_raw", "s", swift_cols, "nostro_gl_raw", "g", condition, "swift_rule_match", "gl_rule_match")
+    pair = f"""
+    INSERT INTO match_pairs ("GL_Row_Id", "SWIFT_Row_Id", "_rule", "Matching_Rule")
+    SELECT g."_row", s."_row", {rank}, %(rule_name)s
+    FROM ({gl_open}) g
+    JOIN ({swift_open}) s ON {condition} AND g."_rank" = s."_rank"
+    """
+    match_gl = f"""
+    INSERT INTO gl_rule_match ("_row", "_pair", "_rule", "Matching_Rule")
+    SELECT "GL_Row_Id", "SWIFT_Row_Id", "_rule", "Matching_Rule" FROM match_pairs WHERE "_rule" = {rank}
+    """
+    match_swift = f"""
+    INSERT INTO swift_rule_match ("_row", "_pair", "_rule", "Matching_Rule")
+    SELECT "SWIFT_Row_Id", "GL_Row_Id", "_rule", "Matching_Rule" FROM match_pairs WHERE "_rule" = {rank}
+    """
+    return pair, match_gl, match_swift
+
+def explain(cur, statement, params):
+    cur.execute("EXPLAIN " + statement, params or None)
+    plan = [row[0] for row in cur.fetchall()]
+    print("\n".join(plan))
+    if any("Nested Loop" in line for line in plan):
+        print("WARNING: nested loop in plan; check the key indexes and table statistics.")
+
+MATCH_TABLES = """
+DROP TABLE IF EXISTS gl_rule_match;
+DROP TABLE IF EXISTS swift_rule_match;
+DROP TABLE IF EXISTS match_pairs;
+CREATE UNLOGGED TABLE gl_rule_match ("_row" BIGINT PRIMARY KEY, "_pair" BIGINT, "_rule" INT, "Matching_Rule" TEXT);
+CREATE UNLOGGED TABLE swift_rule_match ("_row" BIGINT PRIMARY KEY, "_pair" BIGINT, "_rule" INT, "Matching_Rule" TEXT);
+CREATE TABLE match_pairs ("GL_Row_Id" BIGINT PRIMARY KEY, "SWIFT_Row_Id" BIGINT UNIQUE, "_rule" INT, "Matching_Rule" TEXT);
+ANALYZE nostro_gl_raw;
+ANALYZE nostro_swift_raw;
 """
-cur.execute(create_mapping)
-
-conn.commit()
-
-files = {
-    "nostro_gl_raw": "/Users/mac/CascadeProjects/pl_nostro/NOSTRO_GL.csv",
-    "nostro_swift_raw": "/Users/mac/CascadeProjects/pl_nostro/NOSTRO_SWIFT.csv",
-    "nostro_mapping_raw": "/Users/mac/CascadeProjects/pl_nostro/Nostro_Mapping.csv"
-}
-
-for table, file_path in files.items():
-    try:
-        with open(file_path, "r") as f:
-            sql = f"""COPY {table} FROM STDIN WITH CSV HEADER DELIMITER ',' QUOTE '"'"""
-            cur.copy_expert(sql, f)
-        print(f"Loaded {file_path} into {table}")
-    except Exception as e:
-        print(f"Error loading {file_path} into {table}: {e}")
-
-conn.commit()
-  
-cur.execute("""
-ALTER TABLE nostro_gl_raw
-ADD COLUMN "Account Name" TEXT,
-ADD COLUMN "Account Currency" TEXT,
-ADD COLUMN "Account_Number" TEXT,
-ADD COLUMN "Swift Code" TEXT,
-ADD COLUMN "Country" TEXT;
-""")
-conn.commit()
-
-# cur.execute("""
-# UPDATE nostro_gl_raw n
-# SET 
-#     "Account Name" = m."Account Name",
-#     "Account Currency" = m."Account Currency",
-#     "Account_Number" = m."Account_Number",
-#     "Swift Code" = m."Swift Code",
-#     "Country" = m."Country"
-# FROM nostro_mapping_raw m
-# WHERE n."Nostro/Vostro/ Sett Entity ID" = m."Sierra Account Numbers"
-# """)
-# conn.commit()
-
-
-cur.execute("""
-WITH joined AS (
-    SELECT 
-        n."Nostro/Vostro/ Sett Entity ID" AS id,
-        m."Account Name",
-        m."Account Currency",
-        m."Account_Number",
-        m."Swift Code",
-        m."Country"
-    FROM nostro_gl_raw n
-    LEFT JOIN nostro_mapping_raw m
-        ON n."Nostro/Vostro/ Sett Entity ID" = m."Sierra Account Numbers"
-    )
-UPDATE nostro_gl_raw n
-SET 
-    "Account Name"     = j."Account Name",
-    "Account Currency" = j."Account Currency",
-    "Account_Number"   = j."Account_Number",
-    "Swift Code"       = j."Swift Code",
-    "Country"          = j."Country"
-FROM joined j
-WHERE n."Nostro/Vostro/ Sett Entity ID" = j.id;
-""")
-conn.commit()
-
-
-
-cur.execute("""
-ALTER TABLE nostro_gl_raw 
-    ADD COLUMN IF NOT EXISTS "Dr/Cr" TEXT,
-    ADD COLUMN IF NOT EXISTS "DC_Amount" NUMERIC;
-    """)
-conn.commit()
-
-cur.execute("""
-UPDATE nostro_gl_raw 
-SET "Dr/Cr" = CASE 
-                  WHEN CAST("Cash Amt" AS NUMERIC) < 0 THEN 'Dr'
-                  WHEN CAST("Cash Amt" AS NUMERIC) > 0 THEN 'Cr'
-                  
-              END,
-    "DC_Amount" = ABS(CAST("Cash Amt" AS NUMERIC))
-
-
-""")
-conn.commit()
 
-
-cur.execute("""
-ALTER TABLE nostro_swift_raw
-ADD COLUMN "Account Name" TEXT,
-ADD COLUMN "Account Currency" TEXT,
-ADD COLUMN "Account_Number" TEXT,
-ADD COLUMN "Swift Code" TEXT,
-ADD COLUMN "Country" TEXT;
-""")
-# conn.commit()
-# cur.execute("""
-# UPDATE nostro_swift_raw s
-# SET 
-#     "Account Name" = m."Account Name",
-#     "Account Currency" = m."Account Currency",
-#     "Account_Number" = m."Account_Number",
-#     "Swift Code" = m."Swift Code",
-#     "Country" = m."Country"
-# FROM nostro_mapping_raw m
-# WHERE s."Nostro Account" = m."Account_Number"
-# """)
-# conn.commit()
-
-cur.execute("""
-WITH joined AS (
-    SELECT 
-        s."Nostro Account" AS id,
-        m."Account Name",
-        m."Account Currency",
-        m."Account_Number",
-        m."Swift Code",
-        m."Country"
-    FROM nostro_swift_raw s
-    LEFT JOIN nostro_mapping_raw m
-        ON s."Nostro Account" = m."Account_Number"
-)
-UPDATE nostro_swift_raw s
-SET 
-    "Account Name"     = j."Account Name",
-    "Account Currency" = j."Account Currency",
-    "Account_Number"   = j."Account_Number",
-    "Swift Code"       = j."Swift Code",
-    "Country"          = j."Country"
-FROM joined j
-WHERE s."Nostro Account" = j.id;
-""")
-conn.commit()
-
-# colnames = [desc[0] for desc in cur.description]
-# print(colnames)
-# exit()
-
-cur.execute("""
-ALTER TABLE nostro_swift_raw 
-    ADD COLUMN IF NOT EXISTS "Dr/Cr" TEXT,
-    ADD COLUMN IF NOT EXISTS "DC_Amount" NUMERIC;
+def exact_rules(rules):
+    return [rule for rule in rules if len(rule) == 3]
+
+def match_rules(conn, rules, explain_plans=False):
+    # Returns the seconds each rule took.
+    timings = {}
+    with conn.cursor() as cur:
+        for table, side in (("nostro_gl_raw", 0), ("nostro_swift_raw", 1)):
+            for columns in dict.fromkeys(tuple(rule[side]) for rule in rules):
+                cur.execute(f'CREATE INDEX ON {table} ({", ".join(quoted(c) for c in columns)});')
+        cur.execute(MATCH_TABLES)
+        conn.commit()
+
+        for rank, (gl_cols, swift_cols, rule_name) in enumerate(rules):
+            params = {"rule_name": rule_name}
+            start = time.perf_counter()
+            for statement, match_table in zip(rule_statements(rank, gl_cols, swift_cols), ("match_pairs", "gl_rule_match", "swift_rule_match")):
+                if explain_plans:
+                    explain(cur, statement, params)
+                cur.execute(statement, params)
+                cur.execute(f"ANALYZE {match_table};")
+            conn.commit()
+            timings[rule_name] = time.perf_counter() - start
+            print(f"{rule_name}: {timings[rule_name]:.2f}s")
+    return timings
+
+def status_statement(table, match_table, status_table):
+    # One output row per source row: the match tables are keyed by "_row".
+    return f"""
+    DROP TABLE IF EXISTS {status_table};
+    CREATE TABLE {status_table} AS
+    SELECT t.*,
+           m."_pair" AS "Paired_Row_Id",
+           COALESCE(m."Matching_Rule", 'Unmatched') AS "Matching_Rule",
+           CASE WHEN m."_row" IS NOT NULL THEN 'Matched' ELSE 'Unmatched' END AS "Match_Status"
+    FROM {table} t
+    LEFT JOIN {match_table} m ON m."_row" = t."_row";
     """
-)
-conn.commit()
-
-cur.execute("""
-UPDATE nostro_swift_raw 
-SET "Dr/Cr" = CASE 
-                  WHEN CAST("Amount" AS NUMERIC) < 0 THEN 'Dr'
-                  WHEN CAST("Amount" AS NUMERIC) > 0 THEN 'Cr'
-                  
-              END,
-    "DC_Amount" = ABS(CAST("Amount" AS NUMERIC))
-
-""")
-conn.commit()
 
-cur.execute("""
-DELETE FROM nostro_gl_raw 
-WHERE "Account Currency" <> 'USD';
-""")
-conn.commit()
-
-cur.execute("""
-DELETE FROM nostro_swift_raw 
-WHERE "Account Currency" IS NULL OR "Account Currency" <> 'USD';
-""")
-conn.commit()
-
-
-cur.execute("""
-DROP TABLE IF EXISTS gl_with_status;
-CREATE TABLE gl_with_status AS
-SELECT g.*, 
-       
-       CASE 
-           WHEN s."Nostro Account" IS NOT NULL THEN 'Matched' 
-           ELSE 'Unmatched' 
-       END AS "Match_Status"
-
-FROM nostro_gl_raw g
-LEFT JOIN nostro_swift_raw s ON (
-    (g."Account_Number" = s."Nostro Account" AND 
+def write_status(conn):
+    with conn.cursor() as cur:
+        cur.execute(status_statement("nostro_gl_raw", "gl_rule_match", "gl_with_status"))
+        cur.execute(status_statement("nostro_swift_raw", "swift_rule_match", "swift_with_status"))
+    conn.commit()
+
+# The status tables as the original script built them, for --compare-or-join:
+# one LEFT JOIN per side on the three rule keys OR-ed together, which also
+# compared the account and the raw amounts, and gave a row per matching
+# partner rather than per source row.
+OR_JOIN_CONDITION = """(
+    (g."Account_Number" = s."Nostro Account" AND
      g."Trans Num" = s."Transation Reference" AND
      g."Cash Amt" = s."Amount" AND
      g."Nostro/Vostro/ Sett Entity Cur" = s."Account Currency")
-    OR (g."Account_Number" = s."Nostro Account" AND 
+    OR (g."Account_Number" = s."Nostro Account" AND
         g."ExternalTxNum" = s."Institution Reference" AND
         g."Cash Amt" = s."Amount" AND
         g."Nostro/Vostro/ Sett Entity Cur" = s."Account Currency")
-    OR (g."Account_Number" = s."Nostro Account" AND 
+    OR (g."Account_Number" = s."Nostro Account" AND
         g."ExternalTxNum" = s."Transation Reference" AND
         g."Cash Amt" = s."Amount" AND
         g."Nostro/Vostro/ Sett Entity Cur" = s."Account Currency")
-);
-""")
-
-cur.execute("""
-DROP TABLE IF EXISTS swift_with_status;
-CREATE TABLE swift_with_status AS
-SELECT s.*, 
-       
-       CASE 
-           WHEN g."Account_Number" IS NOT NULL THEN 'Matched' 
-           ELSE 'Unmatched' 
-       END AS "Match_Status"
-FROM nostro_swift_raw s
-LEFT JOIN nostro_gl_raw g ON (
-    (g."Account_Number" = s."Nostro Account" AND 
-     g."Trans Num" = s."Transation Reference" AND
-     g."Cash Amt" = s."Amount" AND
-     g."Nostro/Vostro/ Sett Entity Cur" = s."Account Currency")
-    OR (g."Account_Number" = s."Nostro Account" AND 
-        g."ExternalTxNum" = s."Institution Reference" AND
-        g."Cash Amt" = s."Amount" AND
-        g."Nostro/Vostro/ Sett Entity Cur" = s."Account Currency")
-    OR (g."Account_Number" = s."Nostro Account" AND 
-        g."ExternalTxNum" = s."Transation Reference" AND
-        g."Cash Amt" = s."Amount" AND
-        g."Nostro/Vostro/ Sett Entity Cur" = s."Account Currency")
-);
-""")
-
-conn.commit()
-
-cur.close()
-conn.close()
+)"""
+
+def or_join_statements():
+    return [
+        f"""
+        DROP TABLE IF EXISTS gl_with_status_or;
+        CREATE TABLE gl_with_status_or AS
+        SELECT g.*, CASE WHEN s."Nostro Account" IS NOT NULL THEN 'Matched' ELSE 'Unmatched' END AS "Match_Status"
+        FROM nostro_gl_raw g
+        LEFT JOIN nostro_swift_raw s ON {OR_JOIN_CONDITION};
+        """,
+        f"""
+        DROP TABLE IF EXISTS swift_with_status_or;
+        CREATE TABLE swift_with_status_or AS
+        SELECT s.*, CASE WHEN g."Account_Number" IS NOT NULL THEN 'Matched' ELSE 'Unmatched' END AS "Match_Status"
+        FROM nostro_swift_raw s
+        LEFT JOIN nostro_gl_raw g ON {OR_JOIN_CONDITION};
+        """,
+    ]
+
+def time_or_join(conn, explain_plans=False):
+    start = time.perf_counter()
+    with conn.cursor() as cur:
+        for statement in or_join_statements():
+            if explain_plans:
+                explain(cur, statement.split(";", 1)[1], {})
+            cur.execute(statement)
+    conn.commit()
+    return time.perf_counter() - start
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--explain", action="store_true", help="print the plan of every rule statement before running it")
+    parser.add_argument("--config", default="postgres.ini", help="INI file with a [postgres] section; PG* environment variables override it")
+    parser.add_argument("--gl-file", default="NOSTRO_GL.csv")
+    parser.add_argument("--swift-file", default="NOSTRO_SWIFT.csv")
+    parser.add_argument("--mapping-file", default="Nostro_Mapping.csv")
+    parser.add_argument("--workers", type=int, default=4, help="connections used for the parallel COPY streams")
+    parser.add_argument("--compare-or-join", action="store_true", help="also time the original three-branch OR join on the same ready tables")
+    args = parser.parse_args()
+
+    pool = connection_pool(connection_settings(args.config), size=args.workers + 1)
+    conn = pool.getconn()
+    try:
+        load_start = time.perf_counter()
+        create_stage_tables(conn)
+        load_stage(pool, args.gl_file, args.swift_file, args.mapping_file, args.workers)
+        build_ready_tables(conn)
+        print(f"Load to ready: {time.perf_counter() - load_start:.2f}s")
+
+        match_start = time.perf_counter()
+        match_rules(conn, exact_rules(RULES), args.explain)
+        write_status(conn)
+        print(f"Rule-ranked equi-joins and status tables: {time.perf_counter() - match_start:.2f}s")
+        if args.compare_or_join:
+            print(f"Original OR join status tables: {time_or_join(conn, args.explain):.2f}s")
+    finally:
+        pool.putconn(conn)
+        pool.closeall()
+
+if __name__ == "__main__":
+    main()
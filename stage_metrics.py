@@ -0,0 +1,117 @@
+import atexit
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import polars as pl
+
+def peak_rss_mb():
+    # Process high-water mark; ru_maxrss is in KiB on Linux, bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / 2**20 if sys.platform == "darwin" else peak / 2**10, 1)
+
+def row_count(df):
+    # Lazy frames are not counted: that would execute the plan a second time.
+    return df.height if isinstance(df, pl.DataFrame) else None
+
+class StageMetrics:
+    # One JSON line per stage (wall time, rows in/out, peak RSS and any extra
+    # fields such as matches per rule) and a per-run summary at exit. With no
+    # path every call returns straight away, so the hooks stay in place in
+    # production runs.
+
+    def __init__(self, path=None, plans=False):
+        self.configure(path, plans)
+
+    def configure(self, path, plans=False):
+        self.path = path
+        self.plans = plans
+        self.run_id = os.environ.get("RECON_METRICS_RUN") or datetime.now().strftime("%Y%m%dT%H%M%S%f")
+        self.records = []
+        self.lock = threading.Lock()
+        if path:
+            # Worker processes (sharded matching) inherit the settings and
+            # append their own stages under the same run id.
+            os.environ.update(RECON_METRICS=path, RECON_METRICS_PLANS="1" if plans else "0", RECON_METRICS_RUN=self.run_id)
+            atexit.unregister(self.close)
+            atexit.register(self.close)
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def write(self, record):
+        record = {"run_id": self.run_id, "pid": os.getpid(), **record}
+        # Stages may finish concurrently on the run_reports thread pool.
+        with self.lock, open(self.path, "a") as out:
+            self.records.append(record)
+            out.write(json.dumps(record, default=str) + "\n")
+
+    @contextmanager
+    def stage(self, name, rows_in=None, **fields):
+        # Callers may add fields (rows_out, rules, ...) to the yielded record.
+        record = {"stage": name, "rows_in": rows_in, **fields}
+        if not self.enabled:
+            yield record
+            return
+        started = datetime.now().isoformat(timespec="milliseconds")
+        start = time.perf_counter()
+        try:
+            yield record
+        finally:
+            self.write({
+                "type": "stage",
+                "started": started,
+                "seconds": round(time.perf_counter() - start, 6),
+                "peak_rss_mb": peak_rss_mb(),
+                **record,
+            })
+
+    def event(self, name, **fields):
+        if self.enabled:
+            self.write({"type": "event", "event": name, **fields})
+
+    def plan(self, record, name, df):
+        # Optimized query plan of a lazy frame, only when plans were asked for.
+        if self.enabled and self.plans and isinstance(df, pl.LazyFrame):
+            record.setdefault("plans", {})[name] = df.explain()
+
+    def run_records(self):
+        # Every record of this run, including those appended by workers.
+        with open(self.path) as lines:
+            records = [json.loads(line) for line in lines]
+        return [record for record in records if record["run_id"] == self.run_id]
+
+    def summary(self):
+        stages = {}
+        for record in self.run_records():
+            if record["type"] != "stage":
+                continue
+            totals = stages.setdefault(record["stage"], {"calls": 0, "seconds": 0.0, "rows_out": 0, "peak_rss_mb": 0.0})
+            totals["calls"] += 1
+            totals["seconds"] = round(totals["seconds"] + record["seconds"], 6)
+            totals["rows_out"] += record.get("rows_out") or 0
+            totals["peak_rss_mb"] = max(totals["peak_rss_mb"], record["peak_rss_mb"])
+        return stages
+
+    def close(self):
+        # Only the process that started the run writes its summary.
+        if not self.enabled or not self.records or multiprocessing.parent_process() is not None:
+            return
+        stages = self.summary()
+        self.write({"type": "summary", "stages": stages, "peak_rss_mb": peak_rss_mb()})
+        print(f"{'stage':<36} {'calls':>5} {'seconds':>10} {'rows out':>12} {'peak MB':>9}")
+        for name, totals in sorted(stages.items(), key=lambda item: -item[1]["seconds"]):
+            print(f"{name:<36} {totals['calls']:>5} {totals['seconds']:>10.3f} {totals['rows_out']:>12,} {totals['peak_rss_mb']:>9.1f}")
+        print(f"Stage metrics for run {self.run_id} written to {self.path}")
+        self.records = []
+
+# Enabled for any entry point by setting RECON_METRICS to a .jsonl path
+# (RECON_METRICS_PLANS=1 also records lazy query plans).
+metrics = StageMetrics(os.environ.get("RECON_METRICS"), os.environ.get("RECON_METRICS_PLANS") == "1")
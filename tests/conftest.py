@@ -0,0 +1,107 @@
+import os
+import sys
+
+import polars as pl
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+MAPPING = {
+    "Account Name": ["ACCOUNT 1", "ACCOUNT 2"],
+    "Account Currency": ["USD", "EUR"],
+    "Account_Number": ["1000001", "1000002"],
+    "Swift Code": ["BANK1XX", "BANK2XX"],
+    "Sierra Account Numbers": ["S1", "S2"],
+    "Country": ["US", "DE"],
+}
+
+# (Trans Num, ExternalTxNum, Sierra account, Cash Amt) per day. Day 1 leaves
+# TRN3 and SWIFT's SWF9 open; day 2 brings their counterparts (Rule 1 and
+# Rule 3) and one new open item per side.
+GL_DAYS = [
+    [("TRN1", "EXT1", "S1", 100.00), ("TRN2", "EXT2", "S2", -50.00), ("TRN3", "EXT3", "S1", 75.00)],
+    [("TRN4", "SWF9", "S1", 20.00), ("TRN5", "EXT5", "S2", 33.00)],
+]
+
+# (Transation Reference, Institution Reference, Nostro Account, Amount).
+SWIFT_DAYS = [
+    [("TRN1", "INST1", "1000001", 100.00), ("SWF2", "EXT2", "1000002", -50.00), ("SWF9", "INST9", "1000001", 20.00)],
+    [("TRN3", "INST3", "1000001", 75.00), ("SWF6", "INST6", "1000002", 12.00)],
+]
+
+def gl_rows(day, rows):
+    value_date = f"2024-01-{day + 1:02d}"
+    return [
+        {
+            "Nostro/Vostro/ Sett Entity ID": account,
+            "Nostro/Vostro/ Sett Entity Cur": "USD" if account == "S1" else "EUR",
+            "Val/Settle Date": value_date,
+            "ExternalTxNum": external,
+            "MAPS_TRDVERIFY-IMPORT": "Y",
+            "Trade Remarks 1": "",
+            "Cash Amt": amount,
+            "Trans Num": trans,
+            "FEED_FILE_NAME": f"GL_{value_date}.csv",
+        }
+        for trans, external, account, amount in rows
+    ]
+
+def swift_rows(day, rows):
+    value_date = f"2024-01-{day + 1:02d}"
+    return [
+        {
+            "Value Date": value_date,
+            "Entry Date": value_date,
+            "Amount": amount,
+            "Transaction Id": f"TX{day}{i}",
+            "Transation Reference": reference,
+            "Institution Reference": institution,
+            "Custumer Reference": f"CUST{day}{i}",
+            "Description": "PAYMENT",
+            "Nostro Account": account,
+            "Bank Transaction Reference": f"BTR{day}{i}",
+            "FEED_FILE_NAME": f"SWIFT_{value_date}.csv",
+            "Currency Dr/Cr": "D" if amount < 0 else "C",
+        }
+        for i, (reference, institution, account, amount) in enumerate(rows)
+    ]
+
+@pytest.fixture
+def nostro_feeds(tmp_path):
+    # write(days) writes the mapping and GL / SWIFT feeds holding the first
+    # `days` days and returns their paths by argument name.
+    def write(days=len(GL_DAYS)):
+        paths = {
+            "gl_file": str(tmp_path / "NOSTRO_GL.csv"),
+            "mapping_file": str(tmp_path / "Nostro_Mapping.csv"),
+            "swift_file": str(tmp_path / "NOSTRO_SWIFT.csv"),
+        }
+        pl.DataFrame(MAPPING).write_csv(paths["mapping_file"])
+        pl.DataFrame([row for day in range(days) for row in gl_rows(day, GL_DAYS[day])]).write_csv(paths["gl_file"])
+        pl.DataFrame([row for day in range(days) for row in swift_rows(day, SWIFT_DAYS[day])]).write_csv(paths["swift_file"])
+        return paths
+    return write
+
+@pytest.fixture(scope="session")
+def mixed_feeds(tmp_path_factory):
+    # Generator feeds with duplicate references, reversals, split payments
+    # and amounts a few cents off, so every rule kind has rows to match.
+    from benchmark import nostro_frames, with_reversals, with_splits
+
+    directory = tmp_path_factory.mktemp("mixed_feeds")
+    gl_df, swift_df, mapping_df = nostro_frames(4_000, 60, duplicate_rate=0.05)
+    gl_df, _ = with_reversals(gl_df, 0.05)
+    gl_df, _ = with_splits(gl_df.with_columns(pl.col("Cash Amt").abs().alias("DC_AMOUNT")), 0.03, "Cash Amt")
+    swift_df, _ = with_splits(swift_df.with_columns(pl.col("Amount").abs().alias("DC_AMOUNT")), 0.03, "Amount", seed=1)
+    near_miss = pl.int_range(pl.len()).hash(13) % 20 == 0
+    swift_df = swift_df.with_columns(pl.when(near_miss).then(pl.col("Amount") + pl.col("Amount").sign() * 0.02).otherwise(pl.col("Amount")))
+
+    paths = {
+        "gl_file": str(directory / "NOSTRO_GL.csv"),
+        "mapping_file": str(directory / "Nostro_Mapping.csv"),
+        "swift_file": str(directory / "NOSTRO_SWIFT.csv"),
+    }
+    gl_df.drop("DC_AMOUNT").write_csv(paths["gl_file"])
+    swift_df.drop("DC_AMOUNT").write_csv(paths["swift_file"])
+    mapping_df.write_csv(paths["mapping_file"])
+    return paths
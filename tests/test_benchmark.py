@@ -0,0 +1,14 @@
+import json
+import os
+
+import benchmark
+
+def test_suite_runs_from_another_directory(tmp_path, monkeypatch):
+    # The scripts are found next to benchmark.py, not in the working directory.
+    monkeypatch.chdir(tmp_path)
+    results_file = str(tmp_path / "results.json")
+    benchmark.run_suite(2_000, 20, directory=str(tmp_path / "data"), results_file=results_file)
+
+    stages = [stage["stage"] for stage in json.load(open(results_file))["stages"]]
+    assert "filtering_data" in stages and "process_rules" in stages
+    assert os.path.exists(tmp_path / "data" / "(USD)unmatched_transactions_report.xlsx")
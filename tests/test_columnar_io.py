@@ -0,0 +1,25 @@
+import polars as pl
+import pytest
+
+from columnar_io import read_table
+
+def write(tmp_path, rows):
+    path = str(tmp_path / "table.csv")
+    pl.DataFrame(rows).write_csv(path)
+    return path
+
+def test_schema_overrides_keep_text_columns(tmp_path):
+    path = write(tmp_path, {"Account_Number": ["0010001", "0010002"], "Cash Amt": ["1.5", "-2"]})
+    df = read_table(path, ["Account_Number", "Cash Amt"], {"Account_Number": pl.Utf8, "Cash Amt": pl.Float64})
+    assert df["Account_Number"].to_list() == ["0010001", "0010002"]
+    assert df["Cash Amt"].to_list() == [1.5, -2.0]
+
+def test_bad_cell_raises(tmp_path):
+    path = write(tmp_path, {"Account_Number": ["1", "2"], "Cash Amt": ["1.5", "n/a"]})
+    with pytest.raises(pl.exceptions.ComputeError):
+        read_table(path, ["Cash Amt"], {"Cash Amt": pl.Float64})
+
+def test_missing_column_raises(tmp_path):
+    path = write(tmp_path, {"Account_Number": ["1"]})
+    with pytest.raises(ValueError, match="Cash Amt"):
+        read_table(path, ["Account_Number", "Cash Amt"])
@@ -0,0 +1,16 @@
+import polars as pl
+import pytest
+
+from compact_schema import AMOUNT, compact_report, major_units
+
+def test_amounts_round_trip_through_minor_units():
+    df = pl.DataFrame({"DC_AMOUNT": [0.001, -12.345, 9_000_000_000_000.5, None], "GL_NUMBER": ["1", "2", "3", "4"]})
+    compact = compact_report(df)
+    assert compact.schema["DC_AMOUNT"] == pl.Int64
+    assert compact.select(major_units(pl.col("DC_AMOUNT")))["DC_AMOUNT"].to_list() == df["DC_AMOUNT"].to_list()
+
+def test_amount_too_large_for_minor_units():
+    # A valid AMOUNT, but past what Int64 thousandths hold.
+    df = pl.DataFrame({"DC_AMOUNT": ["12.5", "10000000000000000"]}).with_columns(pl.col("DC_AMOUNT").cast(AMOUNT))
+    with pytest.raises(ValueError, match="DC_AMOUNT holds 10,000,000,000,000,000.000"):
+        compact_report(df)
@@ -0,0 +1,90 @@
+import openpyxl
+import polars as pl
+import xlsxwriter
+
+from excel_writer import BlockWorkbook
+
+HEADER = {"bold": True, "bg_color": "yellow", "align": "center", "valign": "vcenter"}
+COLUMN_HEADER = {"bold": True, "align": "center", "valign": "vcenter", "border": 1}
+DATA = {"border": 1}
+
+def blocks():
+    frames = [
+        pl.DataFrame({"Account": ["A&B <1>", "=SUM(A1)", None], "Amount": [1.5, -20.25, None], "Count": [1, None, 3]}),
+        pl.DataFrame({"Account": ["C"], "Amount": [0.0], "Count": [7]}),
+    ]
+    return ["Account_Number: A&B <1>", "Account_Number: C"], list(frames[0].columns), frames
+
+def write_per_cell(output_file, titles, headers, frames):
+    # The cell-at-a-time xlsxwriter report BlockWorkbook stands in for.
+    workbook = xlsxwriter.Workbook(output_file, {"strings_to_formulas": False, "strings_to_urls": False})
+    worksheet = workbook.add_worksheet("Unmatched Data")
+    formats = [workbook.add_format(f) for f in (HEADER, COLUMN_HEADER, DATA)]
+    row = 0
+    for title, df in zip(titles, frames):
+        worksheet.merge_range(row, 0, row, len(headers) - 1, title, formats[0])
+        worksheet.write_row(row + 2, 0, headers, formats[1])
+        for i, values in enumerate(df.iter_rows()):
+            for col, value in enumerate(values):
+                worksheet.write(row + 3 + i, col, value, formats[2])
+        row += 3 + df.height + 2
+    workbook.close()
+
+def cells(path):
+    # Every written cell of every sheet with its value type and formatting,
+    # as openpyxl reads it back.
+    workbook = openpyxl.load_workbook(path)
+    return {
+        sheet.title: (
+            sorted(str(r) for r in sheet.merged_cells.ranges),
+            {
+                cell.coordinate: (cell.value, cell.data_type, cell.font.b, cell.fill.fgColor.rgb if cell.fill.fill_type else None,
+                                  cell.border.left.style, cell.alignment.horizontal, cell.alignment.vertical)
+                for row in sheet.iter_rows() for cell in row if cell.value is not None or cell.has_style
+            },
+        )
+        for sheet in workbook.worksheets
+    }
+
+def test_matches_per_cell_xlsxwriter(tmp_path):
+    titles, headers, frames = blocks()
+    with BlockWorkbook(str(tmp_path / "bulk.xlsx"), "Unmatched Data", HEADER, COLUMN_HEADER, DATA) as workbook:
+        workbook.write_blocks(titles, headers, frames)
+    write_per_cell(str(tmp_path / "per_cell.xlsx"), titles, headers, frames)
+
+    bulk = cells(str(tmp_path / "bulk.xlsx"))
+    assert bulk == cells(str(tmp_path / "per_cell.xlsx"))
+    merges, values = bulk["Unmatched Data"]
+    assert merges == ["A1:C1", "A9:C9"]
+    assert values["A5"][:2] == ("=SUM(A1)", "s")
+
+def test_blocks_spill_to_new_sheets(tmp_path):
+    df = pl.DataFrame({"Account": [f"R{i}" for i in range(12)], "Amount": [float(i) for i in range(12)]})
+    path = str(tmp_path / "split.xlsx")
+    with BlockWorkbook(path, "Unmatched Data", HEADER, COLUMN_HEADER, DATA, max_rows=8) as workbook:
+        workbook.write_blocks(["Small", "Large"], list(df.columns), [df.head(2), df])
+
+    workbook = openpyxl.load_workbook(path)
+    assert workbook.sheetnames == ["Unmatched Data", "Unmatched Data (2)", "Unmatched Data (3)", "Unmatched Data (4)"]
+    titles = [sheet["A1"].value for sheet in workbook.worksheets]
+    assert titles == ["Small", "Large", "Large (continued)", "Large (continued)"]
+    rows = [row for sheet in workbook.worksheets[1:] for row in sheet.iter_rows(min_row=4, values_only=True) if row[0] is not None]
+    assert rows == list(df.iter_rows())
+
+def test_chunks_spanning_blocks(tmp_path):
+    # Chunks of 2 rows start and end inside blocks, skip the empty one and
+    # cross onto the next sheet.
+    df = pl.DataFrame({"Account": [f"R{i}" for i in range(9)], "Amount": [float(i) for i in range(9)]})
+    titles = ["A", "Empty", "B", "C"]
+    frames = [df.slice(0, 3), df.clear(), df.slice(3, 1), df.slice(4, 5)]
+    paths = []
+    for chunk_rows in (2, 100_000):
+        paths.append(str(tmp_path / f"chunks_{chunk_rows}.xlsx"))
+        with BlockWorkbook(paths[-1], "Unmatched Data", HEADER, COLUMN_HEADER, DATA, max_rows=16, chunk_rows=chunk_rows) as workbook:
+            workbook.write_blocks(titles, list(df.columns), frames)
+
+    assert cells(paths[0]) == cells(paths[1])
+    workbook = openpyxl.load_workbook(paths[0])
+    rows = [row for sheet in workbook.worksheets for row in sheet.iter_rows(values_only=True) if row[0] and row[0].startswith("R")]
+    assert rows == list(df.iter_rows())
+    assert len(workbook.sheetnames) == 2
@@ -0,0 +1,37 @@
+import openpyxl
+import polars as pl
+
+from filtering_data import currency_reports, gl_schema, swift_schema
+
+def test_reports_written_to_new_directory(tmp_path):
+    unmatched_gl = pl.DataFrame(
+        {"Account_Number": ["1000001", "1000002"], "Account Name": ["ACCOUNT 1", "ACCOUNT 2"],
+         "Nostro/Vostro/ Sett Entity Cur": ["USD", "EUR"], "Cash Amt": [-10.0, 5.5], "Val/Settle Date": ["2024-01-02", "2024-01-03"]},
+        schema=gl_schema,
+    )
+    unmatched_swift = pl.DataFrame(
+        {"Nostro Account": ["1000001"], "Account Name": ["ACCOUNT 1"], "Account Currency": ["USD"], "Amount": [7.25], "Value Date": ["2024-01-02"]},
+        schema=swift_schema,
+    )
+    directory = tmp_path / "reports" / "2024-01-03"
+    paths = currency_reports(unmatched_gl, unmatched_swift, directory=str(directory), workers=2)
+
+    assert sorted(paths) == ["EUR", "USD"]
+    sheet = openpyxl.load_workbook(paths["USD"]).worksheets[0]
+    assert sheet.title == "Unmatched Data (USD)"
+    assert sheet["A1"].value.startswith("Account_Number: 1000001")
+
+def test_currency_names_are_made_safe(tmp_path):
+    unmatched_gl = pl.DataFrame(
+        {"Account_Number": ["1000001"], "Account Name": ["ACCOUNT 1"], "Nostro/Vostro/ Sett Entity Cur": ["N/A"],
+         "Cash Amt": [-10.0], "Val/Settle Date": ["2024-01-02"]},
+        schema=gl_schema,
+    )
+    unmatched_swift = pl.DataFrame(
+        {"Nostro Account": ["1000001"], "Account Name": ["ACCOUNT 1"], "Account Currency": ["US:D*"], "Amount": [7.25], "Value Date": ["2024-01-02"]},
+        schema=swift_schema,
+    )
+    paths = currency_reports(unmatched_gl, unmatched_swift, directory=str(tmp_path), workers=1)
+
+    assert paths == {"N/A": str(tmp_path / "(N_A)unmatched_transactions_report.xlsx"), "US:D*": str(tmp_path / "(US_D_)unmatched_transactions_report.xlsx")}
+    assert [openpyxl.load_workbook(paths[currency]).sheetnames for currency in sorted(paths)] == [["Unmatched Data (N_A)"], ["Unmatched Data (US_D_)"]]
@@ -0,0 +1,37 @@
+import asyncio
+import logging
+import os
+
+import polars as pl
+
+from conftest import GL_DAYS, SWIFT_DAYS, gl_rows, swift_rows
+from inbox_watcher import InboxWatcher
+from open_item_pool import verify_pool
+
+def test_bad_file_is_quarantined(nostro_feeds, tmp_path, caplog):
+    base = nostro_feeds(days=1)
+    inbox = tmp_path / "inbox"
+    inbox.mkdir()
+    pl.DataFrame(gl_rows(1, GL_DAYS[1])).write_csv(inbox / "GL_2024-01-02.csv")
+    pl.DataFrame(swift_rows(1, SWIFT_DAYS[1])).write_csv(inbox / "SWIFT_2024-01-02.csv")
+    # Sorts first; its Cash Amt does not parse.
+    bad = pl.DataFrame(gl_rows(1, [("TRN7", "EXT7", "S1", 1.0)])).drop("FEED_FILE_NAME").with_columns(pl.lit("n/a").alias("Cash Amt"))
+    bad.write_csv(inbox / "GL_0_extra.csv")
+
+    watcher = InboxWatcher(str(inbox), str(tmp_path / "outbox"), str(tmp_path / "store"), base["mapping_file"], parse_workers=1)
+    watcher.load(base["gl_file"], base["swift_file"])
+    with caplog.at_level(logging.ERROR, logger="inbox_watcher"):
+        asyncio.run(watcher.run(once=True))
+
+    assert os.listdir(inbox / "quarantine") == ["GL_0_extra.csv"]
+    assert "Quarantined GL_0_extra.csv" in caplog.text
+    # The files after it were still matched.
+    assert "GL_0_extra.csv" not in watcher.feeds["FEED_FILE_NAME"].to_list()
+    assert watcher.open["gl"]["Trans Num"].to_list() == ["TRN5"]
+    assert verify_pool(str(tmp_path / "store"), **nostro_feeds(days=2))
+
+    # The corrected file dropped in again is picked up.
+    bad.with_columns(pl.lit("1.0").alias("Cash Amt")).write_csv(inbox / "GL_0_extra.csv")
+    asyncio.run(watcher.run(once=True))
+    assert "GL_0_extra.csv" in watcher.feeds["FEED_FILE_NAME"].to_list()
+    assert sorted(watcher.open["gl"]["Trans Num"].to_list()) == ["TRN5", "TRN7"]
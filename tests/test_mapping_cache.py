@@ -0,0 +1,44 @@
+import glob
+import logging
+import os
+
+import polars as pl
+import pytest
+
+from conftest import MAPPING
+from mapping_cache import DuplicateMappingKeys, MappingLookups
+
+def test_lookup_keys_are_categorical(tmp_path):
+    mapping_file = str(tmp_path / "Nostro_Mapping.csv")
+    pl.DataFrame(MAPPING).write_csv(mapping_file)
+    built = MappingLookups(mapping_file)
+    cached = MappingLookups(mapping_file)
+    for lookups in (built, cached):
+        assert lookups.gl.schema["Sierra Account Numbers"] == pl.Categorical
+        assert lookups.swift.schema["Account_Number"] == pl.Categorical
+    assert cached.gl.equals(built.gl)
+
+def test_stale_digests_are_evicted(tmp_path):
+    mapping_file = str(tmp_path / "Nostro_Mapping.csv")
+    cache_dir = str(tmp_path / "cache")
+    versions = []
+    for i in range(4):
+        pl.DataFrame(MAPPING).with_columns(pl.lit(f"ACCOUNT {i}").alias("Account Name")).write_csv(mapping_file)
+        versions.append(MappingLookups(mapping_file, cache_dir, max_bytes=0))
+        # Only the version in use is left once the cache is over its size.
+        assert sorted(glob.glob(os.path.join(cache_dir, "*.parquet"))) == sorted(versions[-1].paths())
+
+    # Under the default size both versions stay cached.
+    pl.DataFrame(MAPPING).write_csv(mapping_file)
+    current = MappingLookups(mapping_file, cache_dir)
+    assert sorted(glob.glob(os.path.join(cache_dir, "*.parquet"))) == sorted(versions[-1].paths() + current.paths())
+
+def test_duplicate_keys_are_logged(tmp_path, caplog):
+    mapping_file = str(tmp_path / "Nostro_Mapping.csv")
+    mapping = pl.DataFrame(MAPPING)
+    pl.concat([mapping, mapping.head(1)]).write_csv(mapping_file)
+    with caplog.at_level(logging.WARNING, logger="mapping_cache"):
+        MappingLookups(mapping_file)
+    assert "2 mapping keys occur more than once; the first row of each is used" in caplog.text
+    with pytest.raises(DuplicateMappingKeys):
+        MappingLookups(mapping_file, strict=True)
@@ -0,0 +1,368 @@
+import logging
+from decimal import Decimal
+from types import SimpleNamespace
+
+import polars as pl
+import pytest
+
+import matched_data
+from conftest import SWIFT_DAYS, swift_rows
+from benchmark import nostro_frames
+from columnar_io import EXTENSIONS, read_table
+from compact_schema import AMOUNT, DR_CR
+
+ALL_RULES = matched_data.reversal_rules() + matched_data.RULES + matched_data.TOLERANCE_RULES + matched_data.aggregate_rules()
+
+def outputs(output_file, output_format):
+    # Each dataset read back as text, in a fixed row order; Run_Id differs
+    # between runs.
+    frames = []
+    for name in ("gl", "swift", "pairs"):
+        df = read_table(f"{output_file}_{name}{EXTENSIONS[output_format]}")
+        frames.append(df.drop("Run_Id", strict=False).select(pl.all().cast(pl.Utf8)).sort(pl.all(), nulls_last=True))
+    return frames
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+@pytest.mark.parametrize("rules", [matched_data.RULES, ALL_RULES], ids=["exact", "all"])
+def test_streaming_matches_eager(mixed_feeds, tmp_path, output_format, rules):
+    results = {}
+    for streaming in (False, True):
+        output_file = str(tmp_path / ("streaming" if streaming else "eager"))
+        matched_data.process_data(output_file=output_file, streaming=streaming, rules=rules, output_format=output_format, **mixed_feeds)
+        results[streaming] = outputs(output_file, output_format)
+
+    assert set(results[False][0]["Matching_Rule"]) == {name for _, _, name, *_ in rules} | {"Unmatched"}
+    for eager, streamed in zip(results[False], results[True]):
+        assert eager.height > 0
+        assert eager.equals(streamed)
+
+def test_streaming_ignores_workers(mixed_feeds, tmp_path, caplog):
+    with caplog.at_level(logging.WARNING, logger="matched_data"):
+        matched_data.process_data(output_file=str(tmp_path / "streaming"), streaming=True, workers=2, **mixed_feeds)
+    assert "Ignoring workers: sharded matching needs in-memory frames" in caplog.text
+    assert outputs(str(tmp_path / "streaming"), "csv")[0].height > 0
+
+def enriched(rows, accounts, duplicate_rate):
+    from benchmark import nostro_frames
+    from mapping_cache import build_lookups
+
+    gl_df, swift_df, mapping_df = nostro_frames(rows, accounts, duplicate_rate=duplicate_rate)
+    lookups, _ = build_lookups(mapping_df)
+    return matched_data.enrich_feeds(gl_df, SimpleNamespace(**lookups), swift_df)
+
+def first_rule_wins(gl_rows, swift_rows, rules):
+    # Row-at-a-time reference: under each rule in turn, the k-th open GL row
+    # with a key pairs with the k-th open SWIFT row with that key, and keys
+    # with a null never match. Returns {GL row: (SWIFT row, rule)}.
+    open_gl, open_swift = dict(enumerate(gl_rows)), dict(enumerate(swift_rows))
+    pairs = {}
+    for gl_cols, swift_cols, rule_name in rules:
+        waiting = {}
+        for j, row in open_swift.items():
+            key = tuple(row[c] for c in swift_cols)
+            if None not in key:
+                waiting.setdefault(key, []).append(j)
+        for i, row in list(open_gl.items()):
+            candidates = waiting.get(tuple(row[c] for c in gl_cols))
+            if candidates:
+                j = candidates.pop(0)
+                pairs[i] = (j, rule_name)
+                del open_gl[i], open_swift[j]
+    return pairs
+
+@pytest.mark.parametrize("rule_count", [3, 10])
+def test_process_rules_matches_row_at_a_time_reference(rule_count):
+    from benchmark import synthetic_rules
+
+    gl_df, swift_df = enriched(3_000, 40, duplicate_rate=0.1)
+    # Some null references, which must never match.
+    gl_df = gl_df.with_columns(pl.when(pl.int_range(pl.len()) % 17 == 0).then(None).otherwise(pl.col("Trans Num")).alias("Trans Num"))
+    swift_df = swift_df.with_columns(
+        pl.when(pl.int_range(pl.len()) % 19 == 0).then(None).otherwise(pl.col("Transation Reference")).alias("Transation Reference")
+    )
+    rules = synthetic_rules(rule_count)
+
+    matched_gl, unmatched_gl, matched_swift, unmatched_swift = matched_data.process_rules(gl_df, swift_df, rules)
+    expected = first_rule_wins(gl_df.to_dicts(), swift_df.to_dicts(), rules)
+
+    assert dict(zip(matched_gl["Row_Id"], zip(matched_gl["Paired_Row_Id"], matched_gl["Matching_Rule"]))) == expected
+    assert dict(zip(matched_swift["Paired_Row_Id"], zip(matched_swift["Row_Id"], matched_swift["Matching_Rule"]))) == expected
+    assert matched_gl.height + unmatched_gl.height == gl_df.height
+    assert matched_swift.height + unmatched_swift.height == swift_df.height
+    assert len(expected) > gl_df.height // 2
+
+@pytest.mark.parametrize("shards", [2, 7])
+@pytest.mark.parametrize("rules", [matched_data.RULES, ALL_RULES], ids=["exact", "all"])
+def test_sharded_matches_unsharded(mixed_feeds, rules, shards):
+    # Shards on DC_AMOUNT and Account Currency for the exact rules, on
+    # Account Currency alone once every rule kind is in.
+    gl_df, swift_df = matched_data.load_inputs(**mixed_feeds)
+    unsharded = matched_data.process_rules(gl_df, swift_df, rules)
+    sharded = matched_data.process_rules_sharded(gl_df, swift_df, rules, workers=2, shards=shards)
+    for expected, result in zip(unsharded, sharded):
+        assert result.equals(expected)
+
+def test_single_currency_shards_in_phases(tmp_path, caplog):
+    # With one currency, "Account Currency" alone would put every row in one
+    # shard: the exact rules shard on DC_AMOUNT, the rest on the account, and
+    # a rule keyed on the currency alone runs unsharded.
+    gl_df, swift_df, mapping_df = nostro_frames(2_000, 60, duplicate_rate=0.05, currencies={"USD": 1})
+    paths = {name: str(tmp_path / f"{name}.csv") for name in ("gl_file", "mapping_file", "swift_file")}
+    for df, name in zip((gl_df, swift_df, mapping_df), ("gl_file", "swift_file", "mapping_file")):
+        df.write_csv(paths[name])
+    gl_df, swift_df = matched_data.load_inputs(**paths)
+    loose = matched_data.tolerance_rule(["Account Currency"], ["Account Currency"], "Loose", amount=0.05)
+    rules = ALL_RULES + [loose]
+
+    phases = matched_data.shard_phases(gl_df, swift_df, rules, 4)
+    assert [[rule[2] for rule in phase] for phase in phases] == [
+        ["Reversal", "Rule 1", "Rule 2", "Rule 3"], [f"Rule {i}" for i in range(4, 13)], ["Loose"],
+    ]
+    unsharded = matched_data.process_rules(gl_df, swift_df, rules)
+    with caplog.at_level(logging.WARNING, logger="matched_data"):
+        sharded = matched_data.process_rules_sharded(gl_df, swift_df, rules, workers=2, shards=4)
+    assert "rules Loose splits the rows evenly" in caplog.text
+    for expected, result in zip(unsharded, sharded):
+        assert result.equals(expected)
+
+def amounts(pairs):
+    # One row per reference on each side; pairs holds (GL amount, SWIFT amount).
+    frame = lambda side: pl.DataFrame(
+        {"ref": [f"R{i}" for i in range(len(pairs))], "DC_AMOUNT": [Decimal(pair[side]) for pair in pairs]},
+        schema={"ref": pl.Utf8, "DC_AMOUNT": AMOUNT},
+    )
+    return frame(0), frame(1)
+
+@pytest.mark.parametrize("options, pairs, expected", [
+    # Differences exactly at the amount tolerance match, a cent over does not.
+    ({"amount": 0.05}, [("100.00", "100.05"), ("0.10", "0.15"), ("1000000.05", "1000000.00"), ("20.00", "20.06")], ["R0", "R1", "R2"]),
+    # 5 bps of 1000.00 is 0.50 and of 2000.00 is 1.00.
+    ({"bps": 5}, [("1000.00", "1000.50"), ("1000.00", "1000.51"), ("2000.00", "1999.00"), ("2000.00", "2001.01")], ["R0", "R2"]),
+    # Fractional bps: 2.5 bps of 1000.00 is 0.25.
+    ({"bps": 2.5}, [("1000.00", "1000.25"), ("1000.00", "1000.26")], ["R0"]),
+])
+def test_tolerance_boundary(options, pairs, expected):
+    gl_df, swift_df = amounts(pairs)
+    rule = matched_data.tolerance_rule(["ref"], ["ref"], "Tolerance", **options)
+    matched_gl, _, matched_swift, _ = matched_data.process_rules(gl_df, swift_df, [rule])
+    assert sorted(matched_gl["ref"]) == expected
+    assert sorted(matched_swift["ref"]) == expected
+
+@pytest.mark.parametrize("read_csv", [pl.read_csv, pl.scan_csv], ids=["eager", "streaming"])
+def test_swift_feed_is_typed(tmp_path, read_csv):
+    path = str(tmp_path / "NOSTRO_SWIFT.csv")
+    rows = swift_rows(0, SWIFT_DAYS[0])
+    pl.DataFrame(rows).with_columns(pl.lit("0012345").alias("Nostro Account")).write_csv(path)
+    swift_df = matched_data.read_swift_feed(path, read_csv).lazy().collect()
+    assert swift_df["Nostro Account"].to_list() == ["0012345"] * len(rows)
+    assert swift_df["Amount"].dtype == pl.Float64
+
+    pl.DataFrame(rows).with_columns(pl.lit("n/a").alias("Amount")).write_csv(path)
+    with pytest.raises(pl.exceptions.ComputeError):
+        matched_data.read_swift_feed(path, read_csv).lazy().collect()
+
+def entries(rows, side="gl"):
+    # Same-side entries for the reversal rule: (reference, account, Dr/Cr,
+    # amount, day of January 2024) per row.
+    names = {
+        "gl": ["Trans Num", "Nostro/Vostro/ Sett Entity ID", "Dr/Cr", "DC_AMOUNT", "Val/Settle Date"],
+        "swift": ["Transaction Id", "Nostro Account", "Dr/Cr", "DC_AMOUNT", "Value Date"],
+    }[side]
+    return pl.DataFrame(
+        [(reference, account, direction, Decimal(value), f"2024-01-{day:02d}") for reference, account, direction, value, day in rows],
+        schema={names[0]: pl.Utf8, names[1]: pl.Utf8, "Dr/Cr": DR_CR, "DC_AMOUNT": AMOUNT, names[4]: pl.Utf8},
+        orient="row",
+    ).with_columns(pl.lit("USD").alias("Account Currency"))
+
+def reversal_pairs(gl_rows, swift_rows=(), **options):
+    # {Row_Id: Paired_Row_Id} of the reversals on each side.
+    matched_gl, _, matched_swift, _ = matched_data.process_rules(
+        entries(gl_rows), entries(swift_rows, "swift"), matched_data.reversal_rules(**options)
+    )
+    assert set(matched_gl["Matching_Rule"]) | set(matched_swift["Matching_Rule"]) <= {"Reversal"}
+    return [dict(df.select("Row_Id", "Paired_Row_Id").iter_rows()) for df in (matched_gl, matched_swift)]
+
+def test_reversals_pair_opposite_directions():
+    gl_pairs, swift_pairs = reversal_pairs(
+        [
+            ("T0", "A", "Dr", "100.00", 2), ("T1", "A", "Cr", "100.00", 3),
+            # Same direction, another account, another amount: no reversal.
+            ("T2", "A", "Dr", "50.00", 2), ("T3", "A", "Dr", "50.00", 2),
+            ("T4", "B", "Cr", "100.00", 2), ("T5", "A", "Cr", "100.01", 2),
+        ],
+        [("S0", "9", "Cr", "7.00", 4), ("S1", "9", "Dr", "7.00", 4), ("S2", "9", "Dr", "8.00", 4)],
+    )
+    assert gl_pairs == {0: 1, 1: 0}
+    assert swift_pairs == {0: 1, 1: 0}
+
+def test_reversals_within_the_days_window():
+    rows = [
+        ("T0", "A", "Dr", "100.00", 1), ("T1", "A", "Cr", "100.00", 6),
+        # One day further apart than REVERSAL_DAYS.
+        ("T2", "A", "Dr", "200.00", 1), ("T3", "A", "Cr", "200.00", 7),
+        # Credit before debit counts the same.
+        ("T4", "A", "Cr", "300.00", 10), ("T5", "A", "Dr", "300.00", 15),
+    ]
+    assert reversal_pairs(rows)[0] == {0: 1, 1: 0, 4: 5, 5: 4}
+    assert reversal_pairs(rows, days=6)[0] == {0: 1, 1: 0, 2: 3, 3: 2, 4: 5, 5: 4}
+    assert reversal_pairs(rows, days=0)[0] == {}
+
+def test_reversals_by_reference():
+    rows = [
+        ("T0", "A", "Dr", "100.00", 1), ("T1", "A", "Cr", "100.00", 2),
+        ("T2", "A", "Dr", "200.00", 1), ("T2", "A", "Cr", "200.00", 2),
+    ]
+    assert reversal_pairs(rows)[0] == {0: 1, 1: 0, 2: 3, 3: 2}
+    assert reversal_pairs(rows, by_reference=True)[0] == {2: 3, 3: 2}
+
+def test_busy_key_pairs_debits_and_credits_in_date_order():
+    # Three debits and two credits under one key: the k-th debit by date
+    # pairs with the k-th credit, and the last debit stays open.
+    rows = [
+        ("T0", "A", "Dr", "100.00", 3), ("T1", "A", "Cr", "100.00", 4),
+        ("T2", "A", "Dr", "100.00", 1), ("T3", "A", "Dr", "100.00", 2),
+        ("T4", "A", "Cr", "100.00", 1),
+    ]
+    assert reversal_pairs(rows) == [{2: 4, 4: 2, 3: 1, 1: 3}, {}]
+    # With no window the rows pair in row order instead.
+    assert reversal_pairs(rows, days=None)[0] == {0: 1, 1: 0, 2: 4, 4: 2}
+
+def postings(rows, date_column):
+    # (reference, Dr/Cr, amount, day of January 2024) per row.
+    return pl.DataFrame(
+        [(reference, direction, Decimal(value), f"2024-01-{day:02d}") for reference, direction, value, day in rows],
+        schema={"ref": pl.Utf8, "Dr/Cr": DR_CR, "DC_AMOUNT": AMOUNT, date_column: pl.Utf8},
+        orient="row",
+    )
+
+def split_pairs(gl_rows, swift_rows, **options):
+    # {Row_Id: Paired_Row_Id} of each side under one aggregate rule summing
+    # the GL rows of a reference.
+    rule = matched_data.aggregate_rule(["ref"], ["ref"], "Split", **options)
+    matched_gl, _, matched_swift, _ = matched_data.process_rules(
+        postings(gl_rows, "Val/Settle Date"), postings(swift_rows, "Value Date"), [rule]
+    )
+    return [dict(df.select("Row_Id", "Paired_Row_Id").iter_rows()) for df in (matched_gl, matched_swift)]
+
+def test_aggregate_group_sizes():
+    gl_rows = [
+        ("R0", "Dr", "30.00", 1), ("R0", "Dr", "30.00", 1), ("R0", "Dr", "40.00", 1),
+        # A group of one is a plain one-to-one match, left to the other rules.
+        ("R1", "Dr", "25.00", 1),
+    ]
+    swift_rows = [("R0", "Cr", "100.00", 1), ("R1", "Cr", "25.00", 1)]
+    assert split_pairs(gl_rows, swift_rows, max_group=3) == [{0: 0, 1: 0, 2: 0}, {0: 0}]
+    assert split_pairs(gl_rows, swift_rows, max_group=2) == [{}, {}]
+
+@pytest.mark.parametrize("options, single, matched", [
+    ({}, "100.00", True),
+    ({}, "100.01", False),
+    ({"amount": 0.05}, "100.05", True),
+    ({"amount": 0.05}, "99.95", True),
+    ({"amount": 0.05}, "100.06", False),
+    # 5 bps of the 100.00 total is 0.05.
+    ({"bps": 5}, "100.05", True),
+    ({"bps": 5}, "100.06", False),
+])
+def test_aggregate_tolerance(options, single, matched):
+    pairs = split_pairs([("R0", "Dr", "60.00", 1), ("R0", "Dr", "40.00", 1)], [("R0", "Cr", single, 1)], **options)
+    assert pairs == ([{0: 0, 1: 0}, {0: 0}] if matched else [{}, {}])
+
+def test_aggregate_days_window():
+    # Every row of a group must be within `days` of the single row.
+    gl_rows = [
+        ("R0", "Dr", "60.00", 1), ("R0", "Dr", "40.00", 5),
+        ("R1", "Dr", "60.00", 1), ("R1", "Dr", "40.00", 6),
+    ]
+    swift_rows = [("R0", "Cr", "100.00", 3), ("R1", "Cr", "100.00", 3)]
+    assert split_pairs(gl_rows, swift_rows, days=2) == [{0: 0, 1: 0}, {0: 0}]
+    assert split_pairs(gl_rows, swift_rows, days=3) == [{0: 0, 1: 0, 2: 1, 3: 1}, {0: 0, 1: 2}]
+
+def test_aggregate_pairs_each_group_and_single_once():
+    gl_rows = [
+        # Two groups under R0 (one per direction) and two singles they both fit.
+        ("R0", "Dr", "60.00", 1), ("R0", "Dr", "40.00", 1),
+        ("R0", "Cr", "50.00", 1), ("R0", "Cr", "50.01", 1),
+        # One group and two singles: the closer single wins.
+        ("R1", "Dr", "10.00", 1), ("R1", "Dr", "10.00", 1),
+    ]
+    swift_rows = [
+        ("R0", "Cr", "100.00", 1), ("R0", "Cr", "100.00", 1),
+        ("R1", "Cr", "20.02", 1), ("R1", "Cr", "20.01", 1),
+    ]
+    gl_pairs, swift_pairs = split_pairs(gl_rows, swift_rows, amount=0.05)
+    assert gl_pairs == {0: 0, 1: 0, 2: 1, 3: 1, 4: 3, 5: 3}
+    assert swift_pairs == {0: 0, 1: 2, 3: 4}
+
+def test_aggregate_rule_labels_and_back_pointers():
+    # Each scenario is matched by exactly one of Rules 7-12: a split of two
+    # rows on one side against a single row of the other, keyed on the
+    # reference columns of the rule.
+    scenarios = [
+        ("Rule 7", "gl", "Trans Num", "Transation Reference"),
+        ("Rule 8", "gl", "ExternalTxNum", "Institution Reference"),
+        ("Rule 9", "gl", "ExternalTxNum", "Transation Reference"),
+        ("Rule 10", "swift", "Trans Num", "Transation Reference"),
+        ("Rule 11", "swift", "ExternalTxNum", "Institution Reference"),
+        ("Rule 12", "swift", "ExternalTxNum", "Transation Reference"),
+    ]
+    gl_rows, swift_rows, expected = [], [], {"gl": {}, "swift": {}}
+    for rule_name, grouped, gl_column, swift_column in scenarios:
+        sides = {"gl": (gl_rows, gl_column, ("Trans Num", "ExternalTxNum")), "swift": (swift_rows, swift_column, ("Transation Reference", "Institution Reference"))}
+        single = "swift" if grouped == "gl" else "gl"
+        members = []
+        for side, amounts in ((grouped, ["40.00", "60.00"]), (single, ["100.00"])):
+            rows, column, references = sides[side]
+            for value in amounts:
+                row = {reference: f"{side}{len(rows)}" for reference in references}
+                row[column] = rule_name
+                rows.append({**row, "DC_AMOUNT": Decimal(value), "Dr/Cr": "Dr" if side == "gl" else "Cr"})
+                members.append((side, len(rows) - 1))
+        (_, first), (_, second), (_, single_row) = members
+        expected[grouped].update({first: (rule_name, single_row), second: (rule_name, single_row)})
+        expected[single][single_row] = (rule_name, first)
+
+    shared = {"Account Currency": pl.lit("USD"), "Val/Settle Date": pl.lit("2024-01-02"), "Value Date": pl.lit("2024-01-02")}
+    gl_df = pl.DataFrame(gl_rows, schema_overrides={"DC_AMOUNT": AMOUNT, "Dr/Cr": DR_CR}).with_columns(pl.lit("1").alias("Account_Number"), **shared)
+    swift_df = pl.DataFrame(swift_rows, schema_overrides={"DC_AMOUNT": AMOUNT, "Dr/Cr": DR_CR}).with_columns(pl.lit("1").alias("Nostro Account"), **shared)
+    matched_gl, unmatched_gl, matched_swift, unmatched_swift = matched_data.process_rules(gl_df, swift_df, matched_data.aggregate_rules())
+
+    assert unmatched_gl.is_empty() and unmatched_swift.is_empty()
+    for side, df in (("gl", matched_gl), ("swift", matched_swift)):
+        assert {row_id: (str(rule), pair) for row_id, rule, pair in df.select("Row_Id", "Matching_Rule", "Paired_Row_Id").iter_rows()} == expected[side]
+
+def test_pair_ledger(mixed_feeds):
+    gl_df, swift_df = matched_data.load_inputs(**mixed_feeds)
+    matched_gl, _, matched_swift, _ = matched_data.process_rules(gl_df, swift_df, ALL_RULES)
+    ledger = matched_data.pair_ledger(matched_gl, matched_swift, ALL_RULES)
+
+    assert ledger["Run_Id"].unique().to_list() == [matched_data.metrics.run_id]
+    assert ledger.select("GL_Row_Id", "SWIFT_Row_Id").is_duplicated().sum() == 0
+    # Reversals pair rows of one side and stay out of the ledger.
+    assert (matched_gl["Matching_Rule"] == "Reversal").any()
+    assert "Reversal" not in ledger["Matching_Rule"].cast(pl.Utf8).to_list()
+
+    cross = [df.filter(pl.col("Matching_Rule") != "Reversal") for df in (matched_gl, matched_swift)]
+    for side, df in zip(("GL_Row_Id", "SWIFT_Row_Id"), cross):
+        assert sorted(ledger[side].unique()) == sorted(df["Row_Id"])
+    # One row per pair: a one-to-one rule gives one row per matched GL row,
+    # an aggregate rule one row per member of each group.
+    per_rule = dict(ledger.group_by(pl.col("Matching_Rule").cast(pl.Utf8)).len().iter_rows())
+    for _, _, rule_name, *options in ALL_RULES[1:]:
+        gl_rows, swift_rows = (df.filter(pl.col("Matching_Rule") == rule_name).height for df in cross)
+        if options and options[0]["kind"] == "aggregate":
+            grouped, single = (gl_rows, swift_rows) if options[0]["grouped"] == "gl" else (swift_rows, gl_rows)
+            assert per_rule[rule_name] == grouped > single > 0
+        else:
+            assert per_rule.get(rule_name, 0) == gl_rows == swift_rows
+
+    # Every pair is confirmed by the Paired_Row_Id of at least one of its rows.
+    pointers = pl.concat([
+        cross[0].select(pl.col("Row_Id").alias("GL_Row_Id"), pl.col("Paired_Row_Id").alias("SWIFT_Row_Id")),
+        cross[1].select(pl.col("Paired_Row_Id").alias("GL_Row_Id"), pl.col("Row_Id").alias("SWIFT_Row_Id")),
+    ]).unique()
+    assert ledger.select("GL_Row_Id", "SWIFT_Row_Id").join(pointers, on=["GL_Row_Id", "SWIFT_Row_Id"], how="anti").is_empty()
+
+    sharded_gl, _, sharded_swift, _ = matched_data.process_rules_sharded(gl_df, swift_df, ALL_RULES, workers=2, shards=4)
+    sharded = matched_data.pair_ledger(sharded_gl, sharded_swift, ALL_RULES)
+    assert sharded.sort("GL_Row_Id", "SWIFT_Row_Id").equals(ledger.sort("GL_Row_Id", "SWIFT_Row_Id"))
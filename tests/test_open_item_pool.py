@@ -0,0 +1,38 @@
+import os
+import runpy
+import sys
+
+import polars as pl
+
+import open_item_pool
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "open_item_pool.py")
+
+def test_incremental_runs_match_full_recompute(nostro_feeds, tmp_path):
+    store = str(tmp_path / "store")
+    matched_gl, open_gl, matched_swift, open_swift = open_item_pool.run_incremental(store, **nostro_feeds(days=1))
+    assert (matched_gl.height, open_gl.height, matched_swift.height, open_swift.height) == (2, 1, 2, 1)
+
+    # Day 2 matches day 1's open items and leaves one new item open per side.
+    matched_gl, open_gl, matched_swift, open_swift = open_item_pool.run_incremental(store, **nostro_feeds(days=2))
+    assert (matched_gl.height, matched_swift.height) == (2, 2)
+    assert open_gl["Trans Num"].to_list() == ["TRN5"]
+    assert open_swift["Transation Reference"].to_list() == ["SWF6"]
+    assert open_item_pool.verify_pool(store, **nostro_feeds(days=2))
+
+def test_rerun_without_new_feeds(nostro_feeds, tmp_path, monkeypatch):
+    paths = nostro_feeds(days=2)
+    store = str(tmp_path / "store")
+    output_file = str(tmp_path / "matched_data")
+    monkeypatch.setattr(sys, "argv", [
+        SCRIPT, "--store", store, "--gl-file", paths["gl_file"], "--mapping-file", paths["mapping_file"],
+        "--swift-file", paths["swift_file"], "--output-file", output_file,
+    ])
+
+    runpy.run_path(SCRIPT, run_name="__main__")
+    assert pl.read_csv(output_file + "_gl.csv").height == 5
+    # Nothing new to match: the output holds just the open items.
+    runpy.run_path(SCRIPT, run_name="__main__")
+    assert pl.read_csv(output_file + "_gl.csv")["Matching_Rule"].to_list() == ["Unmatched"]
+    assert pl.read_csv(output_file + "_swift.csv")["Matching_Rule"].to_list() == ["Unmatched"]
+    assert open_item_pool.verify_pool(store, **paths)
@@ -0,0 +1,69 @@
+import csv
+import io
+
+import polars as pl
+import pytest
+
+from pg_bulk_load import FrameReader, connection_settings, copy_jobs
+
+def frame(rows):
+    return pl.DataFrame({"_row": list(range(rows)), "Trans Num": [f"TRN,{i}" for i in range(rows)], "Cash Amt": [i * 0.5 - 1e-7 for i in range(rows)]})
+
+def as_csv(df):
+    buffer = io.BytesIO()
+    df.write_csv(buffer, include_header=False, float_scientific=False)
+    return buffer.getvalue()
+
+@pytest.mark.parametrize("size", [1, 7, 64, 1 << 20])
+def test_frame_reader_reads_across_batches(size):
+    df = frame(25)
+    reader = FrameReader(df, batch_rows=4)
+    chunks = list(iter(lambda: reader.read(size), b""))
+    assert b"".join(chunks) == as_csv(df)
+    assert all(len(chunk) <= size for chunk in chunks)
+    assert list(csv.reader(io.StringIO(b"".join(chunks).decode())))[3] == ["3", "TRN,3", "1.4999999"]
+
+def test_frame_reader_reads_everything_at_once():
+    df = frame(25)
+    reader = FrameReader(df, batch_rows=4)
+    head = reader.read(10)
+    assert head + reader.read() == as_csv(df)
+    assert reader.read() == b"" and reader.read(10) == b""
+
+def test_frame_reader_empty_frame():
+    reader = FrameReader(frame(0))
+    assert reader.read(10) == b""
+    assert reader.read() == b""
+
+@pytest.mark.parametrize("rows, rows_per_stream, expected", [
+    (10, 4, [4, 4, 2]),
+    (10, 3, [3, 3, 3, 1]),
+    (10, 5, [5, 5]),
+    (10, 10, [10]),
+    (10, 100, [10]),
+    (0, 4, [0]),
+])
+def test_copy_jobs_split_at_rows_per_stream(rows, rows_per_stream, expected):
+    df = frame(rows)
+    jobs = copy_jobs({"nostro_gl_stage": df, "nostro_gl_mapping_stage": frame(3)}, rows_per_stream)
+    stage = [part for table, part in jobs if table == "nostro_gl_stage"]
+    assert [part.height for part in stage] == expected
+    assert all(part.height <= rows_per_stream for part in stage)
+    # Contiguous slices, in order, covering every row once.
+    assert pl.concat(stage).equals(df)
+    assert [part.height for table, part in jobs if table == "nostro_gl_mapping_stage"] == [3]
+
+def test_connection_settings_environment_overrides_ini(tmp_path, monkeypatch):
+    config = tmp_path / "postgres.ini"
+    config.write_text("[postgres]\nhost = db.internal\nport = 5433\ndatabase = recon\nuser = recon\n[other]\nhost = elsewhere\n")
+    for env in ("PGHOST", "PGPORT", "PGDATABASE", "PGUSER", "PGPASSWORD"):
+        monkeypatch.delenv(env, raising=False)
+    assert connection_settings(str(config)) == {"host": "db.internal", "port": "5433", "database": "recon", "user": "recon"}
+
+    monkeypatch.setenv("PGHOST", "/tmp/pgdata")
+    monkeypatch.setenv("PGPASSWORD", "secret")
+    monkeypatch.setenv("PGPORT", "")
+    assert connection_settings(str(config)) == {"host": "/tmp/pgdata", "port": "5433", "database": "recon", "user": "recon", "password": "secret"}
+    assert connection_settings(str(config), "other") == {"host": "/tmp/pgdata", "password": "secret"}
+    # Without the INI file only the environment is used.
+    assert connection_settings(str(tmp_path / "missing.ini")) == {"host": "/tmp/pgdata", "password": "secret"}
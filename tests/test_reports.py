@@ -0,0 +1,186 @@
+import os
+from datetime import timedelta
+
+import polars as pl
+import pytest
+
+import matched_data
+from benchmark import REPORT_DATE, consolidated_frame
+from columnar_io import load_sheets
+from run_reports import CombinedReport
+from script_loader import load_script
+
+aeging_report = load_script("unmatched-filter-aeging_report.py", "aeging_report")
+
+SOURCES = ["NOSTRO_GL", "NOSTRO_SWIFT"]
+
+def sheets(rows=2_000, accounts=25):
+    return (
+        consolidated_frame(rows, accounts, "NOSTRO_GL", seed=1),
+        consolidated_frame(rows, accounts, "NOSTRO_SWIFT", seed=2, start=rows),
+    )
+
+def totals(rows, prefix=""):
+    # Amount and count, plus debit / credit splits when prefix is given.
+    result = {"amount": sum(r["DC_AMOUNT"] for r in rows), "count": len(rows)}
+    if prefix:
+        result.update({
+            "debit_amount": sum(r["Total Debit"] for r in rows),
+            "debit_count": sum(r["Total Debit"] > 0 for r in rows),
+            "credit_amount": sum(r["Total Credit"] for r in rows),
+            "credit_count": sum(r["Total Credit"] > 0 for r in rows),
+        })
+    return result
+
+def loop_report(gl_df, swift_df):
+    # The per-account, per-source filter loop CombinedReport replaced.
+    rows = gl_df.to_dicts() + swift_df.to_dicts()
+    report = {}
+    for account in {r["GL_NUMBER"] for r in rows}:
+        for source in SOURCES:
+            other = SOURCES[1 - SOURCES.index(source)]
+            own = [r for r in rows if r["GL_NUMBER"] == account and r["SOURCE"] == source]
+            pick = lambda cf, status: [r for r in own if r["CARRY_FORWARD"] == cf and r["MATCHING_STATUS"] == status]
+            reversals = [r for r in rows if r["GL_NUMBER"] == account and r["SOURCE"] == other and r["MATCHING_STATUS"] == "Reversal"]
+            matched, unmatched, reversal = totals(pick("N", "MATCHED"), 1), totals(pick("N", "UNMATCHED"), 1), totals(reversals, 1)
+            cf_matched, cf_unmatched = totals(pick("Y", "MATCHED")), totals(pick("Y", "UNMATCHED"))
+            report[(account, source)] = {
+                "Matched_DC_Amount": matched["amount"], "Matched_DC_Count": matched["count"],
+                "Unmatched_DC_Amount": unmatched["amount"], "Unmatched_DC_Count": unmatched["count"],
+                "Debit_Matched_Amount": matched["debit_amount"], "Debit_Matched_Count": matched["debit_count"],
+                "Debit_Unmatched_Amount": unmatched["debit_amount"], "Debit_Unmatched_Count": unmatched["debit_count"],
+                "Credit_Matched_Amount": matched["credit_amount"], "Credit_Matched_Count": matched["credit_count"],
+                "Credit_Unmatched_Amount": unmatched["credit_amount"], "Credit_Unmatched_Count": unmatched["credit_count"],
+                "ReversalAmount": reversal["amount"], "ReversalCount": reversal["count"],
+                "Debit-ReversalAmount": reversal["debit_amount"], "Debit-ReversalCount": reversal["debit_count"],
+                "Credit-ReversalAmount": reversal["credit_amount"], "Credit-ReversalCount": reversal["credit_count"],
+                "Carry-ForwardMatchedAmount": cf_matched["amount"], "Carry-ForwardMatchedCount": cf_matched["count"],
+                "Carry-ForwardUnmatchedAmount": cf_unmatched["amount"], "Carry-ForwardUnmatchedCount": cf_unmatched["count"],
+            }
+    return report
+
+def test_combined_report_matches_per_account_loop():
+    gl_df, swift_df = sheets()
+    result = CombinedReport(None, None).process_data(gl_df, swift_df)
+    expected = loop_report(gl_df, swift_df)
+
+    assert result.height == len(expected)
+    for row in result.to_dicts():
+        key = (row.pop("GL_NUMBER"), row.pop("SOURCE"))
+        assert row == pytest.approx(expected[key]), key
+
+def closed_sheets():
+    # Matched items carry the date they were closed, up to 40 days after
+    # their statement date; the others have none.
+    closed = pl.col("EXECUTION_STATEMENTDATE").str.to_date() + pl.duration(days=pl.int_range(pl.len()).hash(3) % 40)
+    return tuple(
+        df.with_columns(pl.when(pl.col("MATCHING_STATUS") == "MATCHED").then(closed.dt.strftime("%Y-%m-%d")).alias("CLOSED_DATE"))
+        for df in sheets()
+    )
+
+def report_as_of(df, as_of):
+    # The sheet as an AGEING report would see it on as_of: ages recomputed,
+    # items not yet opened dropped, matched items not yet closed still open.
+    opened = pl.col("EXECUTION_STATEMENTDATE").str.to_date()
+    still_open = (pl.col("MATCHING_STATUS") == "MATCHED") & (pl.col("CLOSED_DATE").str.to_date() > as_of)
+    return df.with_columns(
+        (pl.lit(as_of) - opened).dt.total_days().alias("AGEING"),
+        pl.when(still_open).then(pl.lit("UNMATCHED")).otherwise(pl.col("MATCHING_STATUS")).alias("MATCHING_STATUS"),
+    ).filter(pl.col("AGEING") >= 0)
+
+def test_ageing_as_of_report_date_matches_ageing_column():
+    gl_df, swift_df = sheets()
+    expected = aeging_report.AegingReport(None, None).process_data(gl_df, swift_df)
+    assert aeging_report.AegingReport(None, None, as_of=REPORT_DATE).process_data(gl_df, swift_df).equals(expected)
+
+@pytest.mark.parametrize("closed_column", [None, "CLOSED_DATE"])
+def test_ageing_trend_matches_report_per_date(closed_column):
+    gl_df, swift_df = closed_sheets()
+    dates = [REPORT_DATE - timedelta(days=n) for n in range(0, 150, 7)]
+    trend = aeging_report.AegingReport(None, None, as_of=dates, closed_column=closed_column).process_data(gl_df, swift_df)
+    keys = ["GL_NUMBER", "CURRENCY", "SOURCE"]
+    for as_of in dates:
+        if closed_column is None:
+            gl_day, swift_day = (report_as_of(df.with_columns(pl.lit(None, pl.Utf8).alias("CLOSED_DATE")), as_of) for df in (gl_df, swift_df))
+        else:
+            gl_day, swift_day = report_as_of(gl_df, as_of), report_as_of(swift_df, as_of)
+        expected = aeging_report.AegingReport(None, None).process_data(gl_day, swift_day)
+        snapshot = trend.filter(pl.col("AS_OF") == as_of).drop("AS_OF")
+        # The per-date report has no rows for accounts whose items all open
+        # later; the trend lists them with nothing open.
+        assert expected.join(snapshot, on=keys, how="anti").is_empty()
+        assert snapshot.join(expected, on=keys, how="anti")["Total No."].sum() == 0
+        result = expected.select(keys).join(snapshot, on=keys, how="left")
+        assert result.equals(expected), as_of
+
+def loop_ageing(gl_df, swift_df, buckets):
+    # The per-account, per-currency, per-source filter loop bucket_report
+    # replaced, with its bucket list made a parameter.
+    rows = [r for r in gl_df.to_dicts() + swift_df.to_dicts() if r["MATCHING_STATUS"] == "UNMATCHED"]
+    accounts = {(r["GL_NUMBER"], r["CURRENCY"]) for r in gl_df.to_dicts() + swift_df.to_dicts()}
+    report = {}
+    for account, currency in accounts:
+        for source in SOURCES:
+            own = [r for r in rows if (r["GL_NUMBER"], r["CURRENCY"], r["SOURCE"]) == (account, currency, source)]
+            result = {}
+            for low, high in buckets:
+                label = f"{low}+ day" if high is None else f"{low}-{high} day"
+                inside = [r for r in own if r["AGEING"] >= low and (high is None or r["AGEING"] <= high)]
+                result[f"{label} No."] = len(inside)
+                result[f"{label} Value."] = sum(r["DC_AMOUNT"] for r in inside)
+            result["Total No."] = sum(v for k, v in result.items() if k.endswith("No."))
+            result["Total Value."] = sum(v for k, v in result.items() if k.endswith("Value."))
+            report[(account, currency, source)] = result
+    return report
+
+@pytest.mark.parametrize("buckets", [aeging_report.DEFAULT_BUCKETS, aeging_report.REGULATORY_BUCKETS, aeging_report.parse_buckets("0-9,10-10,11-45,90+")])
+def test_bucket_report_matches_per_account_loop(buckets):
+    gl_df, swift_df = sheets()
+    result = aeging_report.AegingReport(None, None, buckets=buckets).process_data(gl_df, swift_df)
+    expected = loop_ageing(gl_df, swift_df, buckets)
+
+    assert result.height == len(expected)
+    for row in result.to_dicts():
+        key = (row.pop("GL_NUMBER"), row.pop("CURRENCY"), row.pop("SOURCE"))
+        assert list(row) == list(expected[key])
+        assert row == pytest.approx(expected[key]), key
+
+def test_parse_buckets():
+    assert aeging_report.parse_buckets("regulatory") == [(0, 1), (2, 3), (4, 7), (8, 30), (31, None)]
+    assert aeging_report.parse_buckets("0-1, 2-3,4-7,8-30,31+") == aeging_report.REGULATORY_BUCKETS
+    for text in ("0-5,3-9", "0+,5-6", "7"):
+        with pytest.raises(ValueError):
+            aeging_report.parse_buckets(text)
+
+@pytest.mark.parametrize("output_format", ["parquet", "ipc"])
+def test_reports_read_matcher_output(mixed_feeds, tmp_path, output_format):
+    output_file = str(tmp_path / "matched_data")
+    rules = matched_data.reversal_rules() + matched_data.RULES
+    results = matched_data.process_data(output_file=output_file, rules=rules, output_format=output_format, **mixed_feeds)
+    CombinedReport(output_file, str(tmp_path / "finalreport.xlsx")).generate_report()
+    aeging_report.AegingReport(output_file, str(tmp_path / "AegingReport.xlsx")).generate_report()
+    assert os.path.exists(tmp_path / "finalreport.xlsx") and os.path.exists(tmp_path / "AegingReport.xlsx")
+
+    # Each matcher row in the ConsolidatedReport layout: status from the
+    # rule, account and currency from the mapping, ages up to the last
+    # statement date.
+    gl_df, swift_df = load_sheets(output_file, CombinedReport.columns + ["AGEING"])
+    for df, matched, unmatched, source in zip((gl_df, swift_df), results[0::2], results[1::2], SOURCES):
+        rules_seen = pl.concat([matched, unmatched])["Matching_Rule"].cast(pl.Utf8)
+        statuses = rules_seen.replace_strict({"Unmatched": "UNMATCHED", "Reversal": "Reversal"}, default="MATCHED")
+        assert df["MATCHING_STATUS"].sort().to_list() == statuses.sort().to_list()
+        assert set(df["SOURCE"]) == {source}
+        assert (df["Total Debit"] + df["Total Credit"]).equals(df["DC_AMOUNT"], check_names=False)
+    assert set(gl_df["MATCHING_STATUS"]) == {"MATCHED", "UNMATCHED", "Reversal"}
+    ages = pl.concat([gl_df["AGEING"], swift_df["AGEING"]])
+    assert ages.min() == 0 and ages.max() > 0
+
+    gl_df, swift_df = (df.with_columns(pl.col("DC_AMOUNT", "Total Debit", "Total Credit").cast(pl.Float64)) for df in (gl_df, swift_df))
+    expected = loop_report(gl_df, swift_df)
+    for row in CombinedReport(None, None).process_data(gl_df, swift_df).to_dicts():
+        key = (row.pop("GL_NUMBER"), row.pop("SOURCE"))
+        assert row == pytest.approx(expected[key]), key
+    expected = loop_ageing(gl_df, swift_df, aeging_report.DEFAULT_BUCKETS)
+    for row in aeging_report.AegingReport(None, None).process_data(gl_df, swift_df).to_dicts():
+        key = (row.pop("GL_NUMBER"), row.pop("CURRENCY"), row.pop("SOURCE"))
+        assert row == pytest.approx(expected[key]), key
@@ -0,0 +1,31 @@
+import polars as pl
+
+import matched_data
+
+RULES = [
+    (["ref", "amount"], ["reference", "amount"], "Rule 1"),
+    (["external", "amount"], ["institution", "amount"], "Rule 2"),
+]
+
+def frames(gl_rows, swift_rows):
+    # gl_rows: (ref, external, amount); swift_rows: (reference, institution, amount).
+    gl_df = pl.DataFrame(gl_rows, schema={"ref": pl.Utf8, "external": pl.Utf8, "amount": pl.Float64}, orient="row")
+    swift_df = pl.DataFrame(swift_rows, schema={"reference": pl.Utf8, "institution": pl.Utf8, "amount": pl.Float64}, orient="row")
+    return gl_df.with_row_index("gl_id"), swift_df.with_row_index("swift_id")
+
+def pairs_of(matched, id_column):
+    return {row_id: (pair, str(rule)) for row_id, pair, rule in matched.select(id_column, "Paired_Row_Id", "Matching_Rule").iter_rows()}
+
+def test_first_rule_wins_with_duplicate_and_null_keys():
+    gl_df, swift_df = frames(
+        [("A", "X", 10.0), ("A", "Y", 10.0), (None, "Z", 20.0), ("B", "W", 30.0), ("C", None, 40.0)],
+        [("A", "Q", 10.0), (None, "Z", 20.0), ("D", "W", 30.0), (None, None, 40.0), ("E", "Y", 10.0)],
+    )
+    matched_gl, unmatched_gl, matched_swift, unmatched_swift = matched_data.process_rules(gl_df, swift_df, RULES)
+
+    # The first GL copy of (A, 10) pairs with the one SWIFT row under Rule 1;
+    # the second stays open and pairs under Rule 2. Null keys never match.
+    assert pairs_of(matched_gl, "gl_id") == {0: (0, "Rule 1"), 1: (4, "Rule 2"), 2: (1, "Rule 2"), 3: (2, "Rule 2")}
+    assert pairs_of(matched_swift, "swift_id") == {0: (0, "Rule 1"), 4: (1, "Rule 2"), 1: (2, "Rule 2"), 2: (3, "Rule 2")}
+    assert unmatched_gl["gl_id"].to_list() == [4]
+    assert unmatched_swift["swift_id"].to_list() == [3]
@@ -0,0 +1,64 @@
+import shutil
+import threading
+import time
+
+import pytest
+
+import matched_data
+from run_reports import NightlyRun
+
+def test_plan_reloads_dependencies_outside_only(tmp_path):
+    run = NightlyRun(str(tmp_path))
+    assert run.plan() == {name: stage[1] for name, stage in run.stages.items()}
+    assert run.plan(["summary"]) == {"summary": run.summary_report, "consolidated": run.load_consolidated}
+    # match can be reloaded from the last run's output; consolidated cannot.
+    assert run.plan(["currency", "ageing"]) == {
+        "currency": run.currency_reports, "match": run.reload_match,
+        "ageing": run.ageing_report, "consolidated": run.load_consolidated,
+    }
+    assert run.plan(["currency", "match"])["match"] == run.match
+    with pytest.raises(ValueError, match="Unknown stages"):
+        run.plan(["match", "sumary"])
+
+def test_stages_start_after_their_dependencies(tmp_path):
+    run = NightlyRun(str(tmp_path))
+    events, lock = [], threading.Lock()
+
+    def stage(name):
+        def work(results):
+            with lock:
+                events.append(("start", name, set(results)))
+            time.sleep(0.01)
+            with lock:
+                events.append(("end", name, None))
+            return name
+        return work
+
+    run.stages = {name: (dependencies, stage(name), None) for name, (dependencies, _, _) in run.stages.items()}
+    timings = run.run(workers=4)
+
+    assert set(timings) == set(run.stages)
+    for name, (dependencies, _, _) in run.stages.items():
+        started = events.index(next(event for event in events if event[:2] == ("start", name)))
+        for dependency in dependencies:
+            assert events.index(("end", dependency, None)) < started
+            assert dependency in events[started][2]
+    # Independent stages overlap: both roots start before either ends.
+    assert [event[0] for event in events[:2]] == ["start", "start"]
+
+@pytest.mark.parametrize("output_format", ["csv", "parquet"])
+def test_only_reloads_the_last_match(mixed_feeds, tmp_path, output_format, capsys):
+    for path in mixed_feeds.values():
+        shutil.copy(path, tmp_path)
+    run = NightlyRun(str(tmp_path), output_format=output_format)
+    # The unmatched rows come back typed by the output schema.
+    matched = run.match({})
+    reloaded = run.reload_match({})
+    for expected, result, schema in zip(matched, reloaded, (matched_data.GL_SCHEMA, matched_data.SWIFT_SCHEMA)):
+        assert expected.height > 0
+        assert result.equals(matched_data.apply_schema(expected, schema))
+
+    timings = run.run(["unmatched_detail"])
+    assert set(timings) == {"match", "unmatched_detail"}
+    assert "match (reloaded)" in capsys.readouterr().out
+    assert (tmp_path / "unmatchedtransactionsreport.xlsx").exists()
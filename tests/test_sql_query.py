@@ -0,0 +1,108 @@
+import sqlite3
+
+import polars as pl
+import pytest
+
+import matched_data
+from script_loader import load_script
+
+sql_query = load_script("sql query.py", "sql_query")
+
+RULE = matched_data.RULES[1]
+
+def test_key_condition():
+    assert sql_query.key_condition(*RULE[:2]) == (
+        'g."ExternalTxNum" = s."Institution Reference" AND g."DC_AMOUNT" = s."DC_AMOUNT"'
+        ' AND g."Account Currency" = s."Account Currency"'
+    )
+
+def test_open_candidates():
+    condition = sql_query.key_condition(*RULE[:2])
+    sql = " ".join(sql_query.open_candidates(
+        "nostro_gl_raw", "g", RULE[0], "nostro_swift_raw", "s", condition, "gl_rule_match", "swift_rule_match"
+    ).split())
+    keys = 'g."ExternalTxNum", g."DC_AMOUNT", g."Account Currency"'
+    assert sql.startswith(f'SELECT g."_row", {keys}, ROW_NUMBER() OVER (PARTITION BY {keys} ORDER BY g."_row") AS "_rank" FROM nostro_gl_raw g ')
+    # Open on its own side, with a key among the open rows of the other.
+    assert 'WHERE NOT EXISTS (SELECT 1 FROM gl_rule_match m WHERE m."_row" = g."_row")' in sql
+    assert f'AND EXISTS ( SELECT 1 FROM nostro_swift_raw s WHERE {condition} AND NOT EXISTS (SELECT 1 FROM swift_rule_match m WHERE m."_row" = s."_row") )' in sql
+
+def test_rule_statements():
+    pair, match_gl, match_swift = (" ".join(statement.split()) for statement in sql_query.rule_statements(4, *RULE[:2]))
+    condition = sql_query.key_condition(*RULE[:2])
+    assert pair.startswith('INSERT INTO match_pairs ("GL_Row_Id", "SWIFT_Row_Id", "_rule", "Matching_Rule") SELECT g."_row", s."_row", 4, %(rule_name)s FROM (')
+    swift_open = " ".join(sql_query.open_candidates("nostro_swift_raw", "s", RULE[1], "nostro_gl_raw", "g", condition, "swift_rule_match", "gl_rule_match").split())
+    # Open rows of each side paired by their rank within the key.
+    assert pair.endswith(f'JOIN ( {swift_open}) s ON {condition} AND g."_rank" = s."_rank"')
+    assert match_gl == 'INSERT INTO gl_rule_match ("_row", "_pair", "_rule", "Matching_Rule") SELECT "GL_Row_Id", "SWIFT_Row_Id", "_rule", "Matching_Rule" FROM match_pairs WHERE "_rule" = 4'
+    assert match_swift == 'INSERT INTO swift_rule_match ("_row", "_pair", "_rule", "Matching_Rule") SELECT "SWIFT_Row_Id", "GL_Row_Id", "_rule", "Matching_Rule" FROM match_pairs WHERE "_rule" = 4'
+
+def test_ready_table_sql():
+    gl, swift = (" ".join(statement.split()) for statement in sql_query.ready_table_statements("EUR")[:2])
+    # GL rows are kept without a mapping row or currency; SWIFT rows need both.
+    assert 'FROM nostro_gl_stage g LEFT JOIN nostro_gl_mapping_stage m ON g."Nostro/Vostro/ Sett Entity ID" = m."Sierra Account Numbers"' in gl
+    assert gl.endswith("""WHERE m."Account Currency" = 'EUR' OR m."Account Currency" IS NULL;""")
+    assert 'FROM nostro_swift_stage s JOIN nostro_swift_mapping_stage m ON s."Nostro Account" = m."Account_Number"' in swift
+    assert swift.endswith("""WHERE m."Account Currency" = 'EUR';""")
+    assert """CASE WHEN s."Amount" < 0 THEN 'Dr' WHEN s."Amount" >= 0 THEN 'Cr' END AS "Dr/Cr", ABS(s."Amount") AS "DC_AMOUNT" FROM""" in swift
+
+def test_ready_tables_on_sqlite():
+    # Accounts: A maps to USD, E to EUR, N to no currency, X is unmapped.
+    db = sqlite3.connect(":memory:")
+    db.executescript("""
+    CREATE TABLE nostro_gl_stage ("_row" INTEGER, "Nostro/Vostro/ Sett Entity ID" TEXT, "Cash Amt" NUMERIC);
+    CREATE TABLE nostro_swift_stage ("_row" INTEGER, "Nostro Account" TEXT, "Amount" NUMERIC);
+    CREATE TABLE nostro_gl_mapping_stage ("Sierra Account Numbers" TEXT, "Account Name" TEXT, "Account Currency" TEXT, "Account_Number" TEXT, "Swift Code" TEXT, "Country" TEXT);
+    CREATE TABLE nostro_swift_mapping_stage ("Account_Number" TEXT, "Account Name" TEXT, "Account Currency" TEXT, "Swift Code" TEXT, "Country" TEXT);
+    INSERT INTO nostro_gl_mapping_stage VALUES ('A', 'ACCOUNT A', 'USD', '1', 'BANKA', 'US'), ('E', 'ACCOUNT E', 'EUR', '2', 'BANKE', 'DE'), ('N', 'ACCOUNT N', NULL, '3', 'BANKN', 'US');
+    INSERT INTO nostro_swift_mapping_stage VALUES ('1', 'ACCOUNT A', 'USD', 'BANKA', 'US'), ('2', 'ACCOUNT E', 'EUR', 'BANKE', 'DE'), ('3', 'ACCOUNT N', NULL, 'BANKN', 'US');
+    INSERT INTO nostro_gl_stage VALUES (0, 'A', -5.25), (1, 'A', 0), (2, 'A', 7), (3, 'A', NULL), (4, 'E', 1), (5, 'N', -2), (6, 'X', 3);
+    INSERT INTO nostro_swift_stage VALUES (0, '1', -5.25), (1, '1', 0), (2, '2', 1), (3, '3', 4), (4, '9', 3), (5, '1', 8);
+    """)
+    for statement in sql_query.ready_table_statements()[:2]:
+        db.executescript(statement)
+
+    gl = db.execute('SELECT "_row", "Account_Number", "Account Currency", "Dr/Cr", "DC_AMOUNT" FROM nostro_gl_raw ORDER BY "_row"').fetchall()
+    assert gl == [
+        (0, "1", "USD", "Dr", 5.25), (1, "1", "USD", "Cr", 0), (2, "1", "USD", "Cr", 7), (3, "1", "USD", None, None),
+        (5, "3", None, "Dr", 2), (6, None, None, "Cr", 3),
+    ]
+    swift = db.execute('SELECT "_row", "Account Name", "Dr/Cr", "DC_AMOUNT" FROM nostro_swift_raw ORDER BY "_row"').fetchall()
+    assert swift == [(0, "ACCOUNT A", "Dr", 5.25), (1, "ACCOUNT A", "Cr", 0), (5, "ACCOUNT A", "Cr", 8)]
+
+def sqlite_table(db, table, df):
+    # Key columns as text; DC_AMOUNT keeps its three decimals, so equal
+    # amounts are equal strings.
+    df = df.select("Row_Id", *dict.fromkeys(c for rule in matched_data.RULES for side in rule[:2] for c in side if c in df.columns))
+    columns = ", ".join(sql_query.quoted(c) for c in df.columns[1:])
+    db.execute(f'CREATE TABLE {table} ("_row" INTEGER PRIMARY KEY, {columns})')
+    db.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * df.width)})", df.cast({c: pl.Utf8 for c in df.columns[1:]}).iter_rows())
+    side = 0 if table == "nostro_gl_raw" else 1
+    for rule in matched_data.RULES:
+        db.execute(f'CREATE INDEX IF NOT EXISTS "{table}_{rule[2]}" ON {table} ({", ".join(sql_query.quoted(c) for c in rule[side])})')
+
+@pytest.mark.parametrize("rules", [matched_data.RULES, matched_data.RULES[::-1]], ids=["in order", "reversed"])
+def test_rules_on_sqlite_match_process_rules(mixed_feeds, rules):
+    # The rule statements run on sqlite pair the same rows, under the same
+    # rule, as process_rules; mixed_feeds has duplicate references, so the
+    # one-to-one ranking is exercised.
+    gl_df, swift_df = matched_data.load_inputs(**mixed_feeds)
+    matched_gl, _, matched_swift, _ = matched_data.process_rules(gl_df, swift_df, rules)
+    expected = sorted(matched_data.pair_ledger(matched_gl, matched_swift, rules).select("GL_Row_Id", "SWIFT_Row_Id", pl.col("Matching_Rule").cast(pl.Utf8)).iter_rows())
+
+    db = sqlite3.connect(":memory:")
+    sqlite_table(db, "nostro_gl_raw", matched_data.with_row_ids(gl_df))
+    sqlite_table(db, "nostro_swift_raw", matched_data.with_row_ids(swift_df))
+    for statement in sql_query.MATCH_TABLES.replace("UNLOGGED ", "").split(";"):
+        if not statement.strip().startswith("ANALYZE"):
+            db.execute(statement)
+    for rank, (gl_cols, swift_cols, rule_name) in enumerate(rules):
+        for statement in sql_query.rule_statements(rank, gl_cols, swift_cols):
+            db.execute(statement.replace("%(rule_name)s", ":rule_name"), {"rule_name": rule_name})
+
+    pairs = sorted(db.execute('SELECT "GL_Row_Id", "SWIFT_Row_Id", "Matching_Rule" FROM match_pairs'))
+    assert pairs == expected
+    assert len(pairs) > gl_df.height // 2
+    # Both match tables point back at the pairs.
+    assert sorted(db.execute('SELECT "_row", "_pair" FROM gl_rule_match')) == sorted((g, s) for g, s, _ in pairs)
+    assert sorted(db.execute('SELECT "_pair", "_row" FROM swift_rule_match')) == sorted((g, s) for g, s, _ in pairs)
@@ -0,0 +1,116 @@
+import atexit
+import json
+import os
+
+import polars as pl
+import pytest
+
+import matched_data
+from stage_metrics import StageMetrics, metrics
+
+ENV = ("RECON_METRICS", "RECON_METRICS_PLANS", "RECON_METRICS_RUN")
+
+@pytest.fixture
+def recorder(tmp_path, monkeypatch):
+    # A recorder writing to tmp_path; configure() exports its settings, so the
+    # environment is put back afterwards (setenv remembers unset variables,
+    # delenv alone does not).
+    for env in ENV:
+        monkeypatch.setenv(env, "")
+        monkeypatch.delenv(env)
+    recorders = []
+    def make(target=None, plans=False):
+        target = target or StageMetrics()
+        target.configure(str(tmp_path / "metrics.jsonl"), plans)
+        recorders.append(target)
+        return target
+    yield make
+    for target in recorders:
+        atexit.unregister(target.close)
+    monkeypatch.undo()
+    metrics.configure(os.environ.get("RECON_METRICS"), os.environ.get("RECON_METRICS_PLANS") == "1")
+
+def lines(recorder):
+    with open(recorder.path) as out:
+        return [json.loads(line) for line in out]
+
+def test_stages_and_events_are_written_as_json_lines(recorder):
+    recorded = recorder(plans=True)
+    df = pl.DataFrame({"a": [1, 2, 3]})
+    with recorded.stage("load", rows_in=3, file="a.csv") as record:
+        record["rows_out"] = 2
+        recorded.plan(record, "filter", df.lazy().filter(pl.col("a") > 1))
+    recorded.event("rule_skipped", rule="Rule 1")
+
+    stage, event = lines(recorded)
+    assert stage["type"] == "stage" and stage["stage"] == "load"
+    assert (stage["rows_in"], stage["rows_out"], stage["file"]) == (3, 2, "a.csv")
+    assert stage["seconds"] >= 0 and stage["peak_rss_mb"] > 0
+    assert "FILTER" in stage["plans"]["filter"]
+    assert event == {"run_id": recorded.run_id, "pid": os.getpid(), "type": "event", "event": "rule_skipped", "rule": "Rule 1"}
+    # Workers pick the run up from the environment.
+    assert os.environ["RECON_METRICS_RUN"] == recorded.run_id
+
+def test_stage_is_written_when_it_raises(recorder):
+    recorded = recorder()
+    with pytest.raises(ValueError):
+        with recorded.stage("write"):
+            raise ValueError("disk full")
+    assert [record["stage"] for record in lines(recorded)] == ["write"]
+
+def test_summary_totals_each_stage_once_per_run(recorder, capsys):
+    recorded = recorder()
+    for rows_out in (5, 7):
+        with recorded.stage("rule:Rule 1") as record:
+            record["rows_out"] = rows_out
+    with recorded.stage("write"):
+        pass
+    # Another run appending to the same file is left out of the summary.
+    with open(recorded.path, "a") as out:
+        out.write(json.dumps({"run_id": "other", "type": "stage", "stage": "write", "seconds": 1.0, "peak_rss_mb": 1.0}) + "\n")
+
+    recorded.close()
+    summary = lines(recorded)[-1]
+    assert summary["type"] == "summary" and summary["run_id"] == recorded.run_id
+    assert summary["stages"]["rule:Rule 1"]["calls"] == 2
+    assert summary["stages"]["rule:Rule 1"]["rows_out"] == 12
+    assert summary["stages"]["write"]["calls"] == 1
+    output = capsys.readouterr().out
+    assert f"Stage metrics for run {recorded.run_id} written to {recorded.path}" in output
+    # One table row per stage after the header.
+    assert sorted(line[:36].strip() for line in output.splitlines()[1:3]) == ["rule:Rule 1", "write"]
+
+    # The summary is written once, even if close runs again at exit.
+    recorded.close()
+    assert [record["type"] for record in lines(recorded)].count("summary") == 1
+
+def test_disabled_metrics_do_nothing(tmp_path, monkeypatch, capsys):
+    for env in ENV:
+        monkeypatch.delenv(env, raising=False)
+    disabled = StageMetrics()
+    assert not disabled.enabled
+    with disabled.stage("load", rows_in=3) as record:
+        record["rows_out"] = 3
+        disabled.plan(record, "scan", pl.LazyFrame({"a": [1]}))
+    disabled.event("rule_skipped", rule="Rule 1")
+    disabled.close()
+
+    assert record == {"stage": "load", "rows_in": 3, "rows_out": 3}
+    assert disabled.records == []
+    assert capsys.readouterr().out == ""
+    assert not any(env in os.environ for env in ENV)
+    assert os.listdir(tmp_path) == []
+
+def test_sharded_workers_write_under_the_same_run(recorder, mixed_feeds):
+    recorded = recorder(metrics)
+    gl_df, swift_df = matched_data.load_inputs(**mixed_feeds)
+    matched_data.process_rules_sharded(gl_df, swift_df, matched_data.RULES, workers=2, shards=4)
+
+    records = lines(recorded)
+    assert {record["run_id"] for record in records} == {recorded.run_id}
+    workers = {record["pid"] for record in records if record.get("stage") == "process_rules"}
+    assert len(workers) >= 1 and os.getpid() not in workers
+    # One process_rules stage per shard, each with its rule stages.
+    assert sum(record.get("stage") == "process_rules" for record in records) == 4
+    assert {record["stage"] for record in records if record["pid"] in workers} >= {"process_rules", "rule:Rule 1"}
+    assert [record["stage"] for record in records if record["pid"] == os.getpid() and record["type"] == "stage"][-1] == "process_rules_sharded"
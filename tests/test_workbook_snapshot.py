@@ -0,0 +1,64 @@
+import glob
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import polars as pl
+import xlsxwriter
+
+from columnar_io import SHEETS
+from workbook_snapshot import workbook_snapshot
+
+def write_workbook(path, rows):
+    with xlsxwriter.Workbook(path) as workbook:
+        for i, sheet in enumerate(SHEETS):
+            pl.DataFrame({"GL_NUMBER": [f"{i}{n}" for n in range(rows)], "DC_AMOUNT": [n * 1.5 for n in range(rows)]}).write_excel(workbook, sheet)
+
+def test_concurrent_builds(tmp_path):
+    workbook = str(tmp_path / "ConsolidatedReport.xlsx")
+    cache_dir = str(tmp_path / "snapshots")
+    write_workbook(workbook, 500)
+    start = threading.Barrier(4)
+
+    def build():
+        start.wait()
+        paths = workbook_snapshot(workbook, SHEETS, cache_dir)
+        return {sheet: pl.read_parquet(path) for sheet, path in paths.items()}
+
+    with ThreadPoolExecutor(4) as pool:
+        results = list(pool.map(lambda _: build(), range(4)))
+    for result in results:
+        assert all(df.height == 500 for df in result.values())
+    assert len(glob.glob(os.path.join(cache_dir, "*"))) == len(SHEETS)
+
+def test_rewritten_workbook_replaces_old_version(tmp_path):
+    workbook = str(tmp_path / "ConsolidatedReport.xlsx")
+    cache_dir = str(tmp_path / "snapshots")
+    write_workbook(workbook, 10)
+    old = workbook_snapshot(workbook, SHEETS, cache_dir)
+    write_workbook(workbook, 20)
+    os.utime(workbook, ns=(os.stat(workbook).st_atime_ns, os.stat(workbook).st_mtime_ns + 1))
+    new = workbook_snapshot(workbook, SHEETS, cache_dir)
+
+    assert sorted(glob.glob(os.path.join(cache_dir, "*"))) == sorted(new.values())
+    assert not any(os.path.exists(path) for path in old.values())
+    assert pl.read_parquet(new["NOSTRO_GL"]).height == 20
+
+def test_snapshot_evicted_during_cache_hit_is_rebuilt(tmp_path, monkeypatch):
+    workbook = str(tmp_path / "ConsolidatedReport.xlsx")
+    cache_dir = str(tmp_path / "snapshots")
+    write_workbook(workbook, 10)
+    paths = workbook_snapshot(workbook, SHEETS, cache_dir)
+
+    # Another process evicts the last sheet between the lookup and the touch.
+    utime = os.utime
+    def evicted(path, *args, **kwargs):
+        if path == paths[list(SHEETS)[-1]] and os.path.exists(path):
+            os.remove(path)
+        return utime(path, *args, **kwargs)
+    monkeypatch.setattr(os, "utime", evicted)
+    rebuilt = workbook_snapshot(workbook, SHEETS, cache_dir)
+    monkeypatch.undo()
+
+    assert rebuilt == paths
+    assert all(pl.read_parquet(path).height == 10 for path in rebuilt.values())
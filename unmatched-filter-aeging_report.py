@@ -1,75 +1,236 @@
+import argparse
+from datetime import date, timedelta
+
 import polars as pl
 
+from columnar_io import load_sheets, write_table
+from compact_schema import compact_report, major_units
+from excel_writer import EXCEL_MAX_ROWS
+from stage_metrics import metrics
+
+DEFAULT_BUCKETS = [(0, 5), (6, 27), (28, 59), (60, None)]
+REGULATORY_BUCKETS = [(0, 1), (2, 3), (4, 7), (8, 30), (31, None)]
+BUCKET_PRESETS = {"default": DEFAULT_BUCKETS, "regulatory": REGULATORY_BUCKETS}
+
+def parse_buckets(text):
+    # A preset name, or boundaries such as "0-1,2-3,4-7,8-30,31+".
+    if text in BUCKET_PRESETS:
+        return BUCKET_PRESETS[text]
+    buckets = []
+    for part in text.split(","):
+        low, _, high = part.strip().partition("-")
+        if part.strip().endswith("+"):
+            buckets.append((int(part.strip()[:-1]), None))
+        elif high:
+            buckets.append((int(low), int(high)))
+        else:
+            raise ValueError(f"bucket '{part}' is neither LOW-HIGH nor LOW+")
+    for (low, high), (next_low, _) in zip(buckets, buckets[1:]):
+        if high is None or next_low <= high:
+            raise ValueError(f"buckets must be in ascending order without overlaps: {text}")
+    return buckets
+
+def as_date(df, column):
+    # Statement dates arrive as dates, datetimes or "YYYY-MM-DD[ time]" text.
+    if df.schema[column].is_temporal():
+        return pl.col(column).cast(pl.Date)
+    return pl.col(column).cast(pl.Utf8).str.slice(0, 10).str.to_date(strict=False)
+
 class AegingReport:
-    def __init__(self, input_file, output_file):
+    columns = ["GL_NUMBER", "SOURCE", "CURRENCY", "AGEING", "MATCHING_STATUS","DC_AMOUNT"]
+
+    def __init__(self, input_file, output_file, buckets=None, as_of=None, date_column="EXECUTION_STATEMENTDATE", closed_column=None):
+        # With as_of unset the precomputed AGEING column is bucketed. As_of
+        # set to a date ages each item from date_column instead; a list of
+        # dates gives one snapshot per date, told apart by an AS_OF column.
+        # closed_column, if given, holds the date a matched item was closed,
+        # so it still counts as open in snapshots before that date.
         self.input_file = input_file
         self.output_file = output_file
+        self.buckets = buckets or DEFAULT_BUCKETS
+        self.as_of = as_of
+        self.date_column = date_column
+        self.closed_column = closed_column
+
+    def input_columns(self):
+        if self.as_of is None:
+            return self.columns
+        dates = [self.date_column] + ([self.closed_column] if self.closed_column else [])
+        return [c for c in self.columns if c != "AGEING"] + dates
 
     def load_data(self):
-        gl_df = pl.read_excel(self.input_file, sheet_name="NOSTRO_GL")
-        swift_df = pl.read_excel(self.input_file, sheet_name="NOSTRO_SWIFT")
+        gl_df, swift_df = load_sheets(self.input_file, self.input_columns())
         return gl_df, swift_df
 
+    def bucket_label(self, low, high):
+        return f"{low}+ day" if high is None else f"{low}-{high} day"
+
+    def bucket_condition(self, low, high):
+        if high is None:
+            return pl.col("AGEING") >= low
+        return pl.col("AGEING").is_between(low, high)
+
+    def bucket_columns(self):
+        labels = [self.bucket_label(low, high) for low, high in self.buckets]
+        return [f"{label} No." for label in labels], [f"{label} Value." for label in labels]
+
+    def skeleton(self, combined_df, sources):
+        # Every (account, currency) seen in the data gets a row per source,
+        # including those with no unmatched items.
+        return (
+            combined_df.select("GL_NUMBER", "CURRENCY").unique(maintain_order=True)
+            .join(pl.DataFrame({"SOURCE": sources}, schema={"SOURCE": pl.Categorical}), how="cross")
+        )
+
     def process_data(self, gl_df, swift_df):
-        columns = ["GL_NUMBER", "SOURCE", "CURRENCY", "AGEING", "MATCHING_STATUS","DC_AMOUNT"]
-        
-        combined_df = pl.concat([gl_df.select(columns), swift_df.select(columns)], how="vertical")
-        unique_accounts = combined_df.select("GL_NUMBER").unique().to_series().to_list()
-        results = []
-
-        for account in unique_accounts:
-            account_df = combined_df.filter(pl.col("GL_NUMBER") == account)
-            currencies = account_df.select("CURRENCY").unique().to_series().to_list()
-            
-            for currency in currencies:
-                for source in ["NOSTRO_GL", "NOSTRO_SWIFT"]:
-                    unmatched_df = combined_df.filter(
-                        (pl.col("GL_NUMBER") == account) &
-                        (pl.col("SOURCE") == source) &
-                        (pl.col("CURRENCY") == currency) &
-
-                        (pl.col("MATCHING_STATUS") == "UNMATCHED")
-                    )
-                    
-                    aging_counts = {
-                        "0-5 day No.": unmatched_df.filter(pl.col("AGEING").is_between(0, 5)).height,
-                        "0-5 day Value.": unmatched_df.filter(pl.col("AGEING").is_between(0, 5)).select(pl.sum("DC_AMOUNT")).item(),
-                        "6-27 day No.": unmatched_df.filter(pl.col("AGEING").is_between(6, 27)).height,
-                        "6-27 day Value.": unmatched_df.filter(pl.col("AGEING").is_between(6, 27)).select(pl.sum("DC_AMOUNT")).item(),
-                        "28-59 day No.": unmatched_df.filter(pl.col("AGEING").is_between(28, 59)).height,
-                        "28-59 day Value.": unmatched_df.filter(pl.col("AGEING").is_between(28, 59)).select(pl.sum("DC_AMOUNT")).item(),
-                        "60+ day No.": unmatched_df.filter(pl.col("AGEING") >= 60).height,
-                        "60+ day Value.": unmatched_df.filter(pl.col("AGEING") >= 60).select(pl.sum("DC_AMOUNT")).item(),
-                    }
-                    total_no = sum(
-                        aging_counts[key] for key in aging_counts if key.endswith("day No.")
-                    )
-                    total_value = sum(
-                        aging_counts[key] for key in aging_counts if key.endswith("day Value.")
-                    )
-
-                    aging_counts["Total No."] = total_no
-                    aging_counts["Total Value."] = total_value
-
-                    
-                    results.append({
-                        "GL_NUMBER": account,
-                        "CURRENCY": currency,
-                        "SOURCE": source,
-                        **aging_counts
-                        
-                    })
-
-        return pl.DataFrame(results)
-                
+        columns = self.input_columns()
+
+        combined_df = pl.concat([compact_report(gl_df.select(columns)), compact_report(swift_df.select(columns))], how="vertical")
+        if self.as_of is None:
+            return self.bucket_report(combined_df)
+        if isinstance(self.as_of, (list, tuple)):
+            return self.snapshots(combined_df, self.as_of)
+        return self.snapshots(combined_df, [self.as_of]).drop("AS_OF")
+
+    def bucket_report(self, combined_df):
+        sources = ["NOSTRO_GL", "NOSTRO_SWIFT"]
+        keys = ["GL_NUMBER", "CURRENCY", "SOURCE"]
+
+        aggs = []
+        count_columns, value_columns = self.bucket_columns()
+        for (low, high), count_column, value_column in zip(self.buckets, count_columns, value_columns):
+            in_bucket = self.bucket_condition(low, high).fill_null(False)
+            aggs += [
+                in_bucket.sum().cast(pl.Int64).alias(count_column),
+                pl.col("DC_AMOUNT").filter(in_bucket).sum().alias(value_column),
+            ]
+
+        grouped = (
+            combined_df
+            .filter((pl.col("MATCHING_STATUS") == "UNMATCHED") & pl.col("SOURCE").is_in(sources))
+            .group_by(keys)
+            .agg(aggs)
+        )
+
+        bucket_columns = [c for pair in zip(count_columns, value_columns) for c in pair]
+
+        return (
+            self.skeleton(combined_df, sources).join(grouped, on=keys, how="left")
+            .with_columns([pl.col(c).fill_null(0) for c in bucket_columns])
+            .with_columns(
+                pl.sum_horizontal(count_columns).alias("Total No."),
+                pl.sum_horizontal(value_columns).alias("Total Value."),
+            )
+            .with_columns([major_units(pl.col(c)) for c in value_columns + ["Total Value."]])
+            .select(keys + bucket_columns + ["Total No.", "Total Value."])
+        )
+
+    def snapshots(self, combined_df, as_of_dates):
+        # The bucket report as of every date in one pass. An item open from
+        # day d enters bucket (low, high) on d + low and leaves it on
+        # d + high + 1 (or when it is closed), so each item adds a +1/-1 pair
+        # per bucket. Each change is filed under the first as-of date on or
+        # after it, and running sums per key give the report on every date.
+        # The work grows with items x buckets plus keys x dates, not with
+        # items x dates.
+        sources = ["NOSTRO_GL", "NOSTRO_SWIFT"]
+        keys = ["GL_NUMBER", "CURRENCY", "SOURCE"]
+        count_columns, value_columns = self.bucket_columns()
+        bucket_columns = [c for pair in zip(count_columns, value_columns) for c in pair]
+        dates = pl.Series("AS_OF", sorted(set(as_of_dates)), dtype=pl.Date)
+
+        status = pl.col("MATCHING_STATUS")
+        open_items = status == "UNMATCHED"
+        closed = pl.lit(None, pl.Date)
+        if self.closed_column:
+            closed = as_date(combined_df, self.closed_column)
+            open_items = open_items | ((status == "MATCHED") & closed.is_not_null())
+        items = combined_df.filter(open_items.fill_null(False) & pl.col("SOURCE").is_in(sources)).select(
+            *keys, "DC_AMOUNT", as_date(combined_df, self.date_column).alias("_opened"), closed.alias("_closed")
+        ).drop_nulls("_opened")
+
+        events = []
+        for (low, high), count_column, value_column in zip(self.buckets, count_columns, value_columns):
+            enters = pl.col("_opened") + pl.duration(days=low)
+            leaves = pl.col("_closed") if high is None else pl.min_horizontal(pl.col("_opened") + pl.duration(days=high + 1), pl.col("_closed"))
+            reached = items.filter(pl.col("_closed").is_null() | (enters < pl.col("_closed")))
+            changes = {c: pl.lit(0, pl.Int64) for c in bucket_columns}
+            for day, sign in ((enters, 1), (leaves, -1)):
+                changes[count_column] = pl.lit(sign, pl.Int64)
+                changes[value_column] = pl.col("DC_AMOUNT") * sign
+                events.append(reached.select(*keys, day.alias("_day"), *[change.alias(c) for c, change in changes.items()]))
+
+        # A running sum over rows sorted by key, less the total carried into
+        # each key's first row; cum_sum().over(keys) pays a cost per key.
+        first = pl.any_horizontal([pl.col(k).ne_missing(pl.col(k).shift()) for k in keys])
+        carried = pl.when(first).then(pl.col(bucket_columns).cum_sum() - pl.col(bucket_columns)).forward_fill()
+        levels = (
+            pl.concat(events)
+            .drop_nulls("_day")
+            .with_columns(pl.lit(dates).search_sorted(pl.col("_day")).alias("_slot"))
+            .filter(pl.col("_slot") < dates.len())
+            .group_by(*keys, "_slot")
+            .agg(pl.col(bucket_columns).sum())
+            .sort(*keys, "_slot")
+            .with_columns(pl.col(bucket_columns).cum_sum() - carried)
+        )
+
+        grid = dates.to_frame().with_row_index("_slot").with_columns(pl.col("_slot").cast(levels.schema["_slot"]))
+        return (
+            grid.join(self.skeleton(combined_df, sources), how="cross")
+            .join_asof(levels, on="_slot", by=keys, strategy="backward", check_sortedness=False)
+            .with_columns([pl.col(c).fill_null(0) for c in bucket_columns])
+            .with_columns(
+                pl.sum_horizontal(count_columns).alias("Total No."),
+                pl.sum_horizontal(value_columns).alias("Total Value."),
+            )
+            .with_columns([major_units(pl.col(c)) for c in value_columns + ["Total Value."]])
+            .select(["AS_OF"] + keys + bucket_columns + ["Total No.", "Total Value."])
+        )
+
     def save_to_excel(self, combined_df):
         combined_df.write_excel(self.output_file)
 
+    def save(self, combined_df):
+        # A long ageing trend outgrows a worksheet; it can go to Parquet,
+        # Arrow IPC or CSV instead.
+        if not self.output_file.lower().endswith(".xlsx"):
+            write_table(combined_df, self.output_file)
+        elif combined_df.height >= EXCEL_MAX_ROWS:
+            raise ValueError(f"{combined_df.height:,} rows do not fit in {self.output_file}; write a .parquet or .csv file instead")
+        else:
+            self.save_to_excel(combined_df)
+
     def generate_report(self):
-        gl_df, swift_df = self.load_data()
-        processed_data = self.process_data(gl_df, swift_df)
-        self.save_to_excel(processed_data)
+        with metrics.stage("AegingReport.load") as record:
+            gl_df, swift_df = self.load_data()
+            record["rows_out"] = gl_df.height + swift_df.height
+        self.build_report(gl_df, swift_df)
+
+    def build_report(self, gl_df, swift_df):
+        # Sheets already loaded, possibly with other reports' columns too.
+        with metrics.stage("AegingReport.process", rows_in=gl_df.height + swift_df.height) as record:
+            processed_data = self.process_data(gl_df, swift_df)
+            record["rows_out"] = processed_data.height
+        with metrics.stage("AegingReport.save", rows_in=processed_data.height):
+            self.save(processed_data)
 
 if __name__ == "__main__":
-    report = AegingReport('ConsolidatedReport.xlsx', 'AegingReport.xlsx')
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--input", default="ConsolidatedReport.xlsx")
+    parser.add_argument("--output", default="AegingReport.xlsx", help="an .xlsx workbook, or .parquet/.arrow/.csv for long trends")
+    parser.add_argument("--as-of", type=date.fromisoformat, nargs="+", metavar="YYYY-MM-DD",
+                        help="age items from EXECUTION_STATEMENTDATE as of these dates instead of reading AGEING")
+    parser.add_argument("--days", type=int, help="with one --as-of date, a snapshot for each of the DAYS days up to it")
+    parser.add_argument("--closed-column", help="column holding the date a matched item was closed, so it counts as open before then")
+    parser.add_argument("--buckets", type=parse_buckets, default=DEFAULT_BUCKETS,
+                        help=f"ageing buckets: a preset ({', '.join(BUCKET_PRESETS)}) or boundaries such as 0-1,2-3,4-7,8-30,31+")
+    args = parser.parse_args()
+
+    as_of = args.as_of
+    if as_of and args.days:
+        as_of = [as_of[-1] - timedelta(days=n) for n in range(args.days)]
+    elif as_of and len(as_of) == 1:
+        as_of = as_of[0]
+    report = AegingReport(args.input, args.output, buckets=args.buckets, as_of=as_of, closed_column=args.closed_column)
     report.generate_report()
@@ -1,55 +1,109 @@
+import os
+
 import polars as pl
-import xlsxwriter
 
-class unmatchedtransactionsreport:
+from account_index import AccountIndex, name_lookup
+from columnar_io import read_table
+from excel_writer import BlockWorkbook
+from mapping_cache import MappingLookups
+from stage_metrics import metrics
+
+def unmatched_exports(unmatched_gl, unmatched_swift):
+    # The GL_NUMBER-style exports this report reads, derived from the
+    # unmatched output of matched_data.process_rules. DC_AMOUNT is Float64,
+    # as in the CSV exports, so header totals print the same either way.
+    gl = unmatched_gl.select(
+        pl.col("Account_Number").alias("GL_NUMBER"),
+        pl.col("Account Name").alias("GL_NAME"),
+        pl.col("Account Currency").alias("CURRENCY"),
+        pl.col("Dr/Cr").alias("Dr/Cr Ind"),
+        pl.col("DC_AMOUNT").cast(pl.Float64),
+        "Val/Settle Date",
+        pl.lit(None, pl.Utf8).alias("Value Date"),
+        pl.col("Nostro/Vostro/ Sett Entity ID").alias("Sierra Account Numbers"),
+        "Account_Number",
+    )
+    swift = unmatched_swift.select(
+        pl.col("Nostro Account").alias("GL_NUMBER"),
+        pl.col("Account Name").alias("GL_NAME"),
+        pl.col("Account Currency").alias("CURRENCY"),
+        pl.col("Dr/Cr").alias("Dr/Cr Ind"),
+        pl.col("DC_AMOUNT").cast(pl.Float64),
+        pl.lit(None, pl.Utf8).alias("Val/Settle Date"),
+        "Value Date",
+        pl.lit(None, pl.Utf8).alias("Sierra Account Numbers"),
+        pl.col("Nostro Account").alias("Account_Number"),
+    )
+    return gl, swift
 
-    def __init__(self, gl_file, swift_file, output_file):
+class unmatchedtransactionsreport:
+    schema = {
+        'GL_NUMBER': pl.Utf8, 'GL_NAME': pl.Utf8, 'CURRENCY': pl.Utf8, 'Dr/Cr Ind': pl.Utf8, 'DC_AMOUNT': pl.Float64,
+        'Val/Settle Date': pl.Utf8, 'Value Date': pl.Utf8, 'Sierra Account Numbers': pl.Utf8, 'Account_Number': pl.Utf8
+    }
+    columns = list(schema)
+
+    def __init__(self, gl_file, swift_file, output_file, mapping_file=None):
+        mapping = MappingLookups(mapping_file) if mapping_file else None
+        with metrics.stage("unmatchedtransactionsreport.load") as record:
+            gl_unmatched = self.load_data(gl_file)
+            swift_unmatched = self.load_data(swift_file)
+            record["rows_out"] = gl_unmatched.height + swift_unmatched.height
+        self.prepare(gl_unmatched, swift_unmatched, output_file, mapping)
+
+    @classmethod
+    def from_frames(cls, gl_unmatched, swift_unmatched, output_file, mapping=None):
+        # Exports already in memory, e.g. unmatched_exports of process_rules.
+        report = cls.__new__(cls)
+        report.prepare(gl_unmatched.select(cls.columns), swift_unmatched.select(cls.columns), output_file, mapping)
+        return report
+
+    def prepare(self, gl_unmatched, swift_unmatched, output_file, mapping):
         self.output_file = output_file
-        self.gl_unmatched = self.load_data(gl_file)
-        self.swift_unmatched = self.load_data(swift_file)
-        self.account_numbers = self.unique_account_numbers()
-        
+        self.mapping = mapping
+        self.gl_unmatched = gl_unmatched.with_columns(pl.col('GL_NUMBER').cast(pl.Utf8))
+        self.swift_unmatched = swift_unmatched.with_columns(pl.col('GL_NUMBER').cast(pl.Utf8))
+        with metrics.stage("unmatchedtransactionsreport.index", rows_in=self.gl_unmatched.height + self.swift_unmatched.height) as record:
+            self.account_index = self.build_account_index()
+            record["rows_out"] = len(self.account_index)
+
     def load_data(self, file_path):
-        return pl.read_csv(file_path, ignore_errors=True).with_columns(pl.col('GL_NUMBER').cast(pl.Utf8))
-
-    def unique_account_numbers(self):
-        return pl.concat([
-            self.swift_unmatched.select(pl.col('GL_NUMBER')),
-            self.gl_unmatched.select(pl.col('GL_NUMBER'))
-        ]).unique().drop_nulls()
-    
-    def create_report(self):
-        workbook = xlsxwriter.Workbook(self.output_file)
-        worksheet = workbook.add_worksheet('Unmatched Data')
+        return read_table(file_path, self.columns, self.schema)
+
+    def build_account_index(self):
+        # Names found in the unmatched rows come first; the cached mapping
+        # fills in accounts whose rows carry none.
+        sources = [
+            self.gl_unmatched.select(pl.col('Sierra Account Numbers').alias('Account'), pl.col('GL_NAME').alias('Account_Name')),
+            self.swift_unmatched.select(pl.col('Account_Number').alias('Account'), pl.col('GL_NAME').alias('Account_Name')),
+        ]
+        if self.mapping is not None:
+            sources.append(self.mapping.account_names())
+        names = name_lookup('Account', *sources)
+        return AccountIndex(self.combined_transactions(), 'GL_NUMBER', names)
 
-        header_format = workbook.add_format({'bold': True, 'bg_color': 'yellow', 'align': 'center', 'valign': 'vcenter'})
-        column_header_format = workbook.add_format({'bold': True, 'align': 'center', 'valign': 'vcenter'})
-        data_format = workbook.add_format({'border': 1})
+    def create_report(self):
+        header_format = {'bold': True, 'bg_color': 'yellow', 'align': 'center', 'valign': 'vcenter'}
+        column_header_format = {'bold': True, 'align': 'center', 'valign': 'vcenter'}
+        data_format = {'border': 1}
 
-        row_counter = 0
         detailed_columns = ['Side', 'Value_Date', 'GL_NUMBER', 'Currency','Dr/Cr', 'DC_AMOUNT','Debit_Amount', 'Credit_Amount']
 
-        for account in self.account_numbers['GL_NUMBER'].to_list():
-            combined_transactions = self.combined_transactions(account)
-            credit_total = combined_transactions.filter(pl.col('Dr/Cr') == 'Cr')['Credit_Amount'].sum()
-            debit_total = combined_transactions.filter(pl.col('Dr/Cr') == 'Dr')['Debit_Amount'].sum()
-            credit_count = combined_transactions.filter(pl.col('Dr/Cr') == 'Cr').height
-            debit_count = combined_transactions.filter(pl.col('Dr/Cr') == 'Dr').height
-
-            account_name = self.get_account_name(account)
-
-            self.write_header(worksheet, row_counter, account, account_name ,credit_count, credit_total, debit_count, debit_total, header_format, detailed_columns)
-            row_counter += 2
-
-            self.write_column_headers(worksheet, row_counter, detailed_columns, column_header_format)
-            row_counter += 1
-
-            self.write_data(worksheet, row_counter, combined_transactions, data_format)
-            row_counter += len(combined_transactions) + 2
-        workbook.close()
-
-    def combined_transactions(self,account):
-        account_gl = self.gl_unmatched.filter(pl.col('GL_NUMBER') == account).select([
+        titles = []
+        blocks = []
+        for account, combined_transactions, totals in self.account_index:
+            account_name = self.account_index.account_name(account)
+            titles.append(self.header_string(
+                account, account_name, totals['credit_count'], totals['credit_total'], totals['debit_count'], totals['debit_total']
+            ))
+            blocks.append(combined_transactions)
+
+        with metrics.stage("unmatchedtransactionsreport.save", rows_in=sum(block.height for block in blocks), accounts=len(blocks)):
+            with BlockWorkbook(self.output_file, 'Unmatched Data', header_format, column_header_format, data_format) as workbook:
+                workbook.write_blocks(titles, detailed_columns, blocks)
+
+    def combined_transactions(self):
+        gl_rows = self.gl_unmatched.select([
             pl.lit('NOSTRO_GL').alias('Side'),
             pl.col('Val/Settle Date').alias('Value_Date'),
             pl.col('GL_NUMBER'),
@@ -57,7 +111,7 @@ class unmatchedtransactionsreport:
             pl.col('Dr/Cr Ind').alias('Dr/Cr'),
             pl.col('DC_AMOUNT').alias('Amount')
         ])
-        account_swift = self.swift_unmatched.filter(pl.col('GL_NUMBER') == account).select([
+        swift_rows = self.swift_unmatched.select([
             pl.lit('NOSTRO_SWIFT').alias('Side'),
             pl.col('Value Date').alias('Value_Date'),
             pl.col('GL_NUMBER'),
@@ -65,19 +119,13 @@ class unmatchedtransactionsreport:
             pl.col('Dr/Cr Ind').alias('Dr/Cr'),
             pl.col('DC_AMOUNT').alias('Amount')
         ])
-        return pl.concat([account_gl, account_swift]).with_columns(
+        return pl.concat([gl_rows, swift_rows]).with_columns(
             pl.when(pl.col('Dr/Cr') == 'Dr').then(pl.col('Amount')).otherwise(0).alias('Debit_Amount'),
             pl.when(pl.col('Dr/Cr') == 'Cr').then(pl.col('Amount')).otherwise(0).alias('Credit_Amount')
         )
-    def get_account_name(self, account):
-        return (
-        self.gl_unmatched.filter(pl.col('Sierra Account Numbers').cast(pl.Utf8) == account)['GL_NAME'].head(1).to_list() or
-        self.swift_unmatched.filter(pl.col('Account_Number').cast(pl.Utf8) == account)['GL_NAME'].head(1).to_list() or
-        ['N/A']
-    )[0]
 
-    def write_header(self, worksheet, row_counter, account, account_name, credit_count, credit_total, debit_count, debit_total, header_format, detailed_columns):
-        header_string = (
+    def header_string(self, account, account_name, credit_count, credit_total, debit_count, debit_total):
+        return (
             f'Account_Number: {account}  '
             f'Account_Name: {account_name}  '
             f'Total_Credit_Count: {credit_count}  '
@@ -85,19 +133,9 @@ class unmatchedtransactionsreport:
             f'Total_Debit_Count: {debit_count}  '
             f'Total_Debit_Amount: {debit_total}'
         )
-        worksheet.merge_range(row_counter, 0, row_counter,len(detailed_columns) - 1, header_string, header_format)
-
-    def write_column_headers(self, worksheet, row_counter, detailed_columns, column_header_format):
-        for col_num, header_name in enumerate(detailed_columns):
-            worksheet.write(row_counter, col_num, header_name, column_header_format)
-
-    def write_data(self, worksheet, row_counter, combined_transactions, data_format):
-        for row in combined_transactions.iter_rows():
-            for col_num, cell_value in enumerate(row):
-                worksheet.write(row_counter, col_num, cell_value, data_format)
-            row_counter += 1
 
 
 if __name__ == "__main__":
-    report = unmatchedtransactionsreport('NOSTRO_GL_UnMatched.csv', 'NOSTRO_SWIFT_UnMatched.csv', 'unmatchedtransactionsreport.xlsx')
+    mapping_file = 'Nostro_Mapping.csv' if os.path.exists('Nostro_Mapping.csv') else None
+    report = unmatchedtransactionsreport('NOSTRO_GL_UnMatched.csv', 'NOSTRO_SWIFT_UnMatched.csv', 'unmatchedtransactionsreport.xlsx', mapping_file)
     report.create_report()
@@ -0,0 +1,94 @@
+import glob
+import hashlib
+import os
+import threading
+
+import polars as pl
+
+from stage_metrics import metrics
+
+SNAPSHOT_MAX_BYTES = 2 * 1024**3
+
+def snapshot_dir(workbook):
+    return os.path.join(os.path.dirname(os.path.abspath(workbook)), ".workbook_snapshots")
+
+def snapshot_prefix(workbook, cache_dir):
+    # One name per workbook path; the version part changes whenever the file
+    # is rewritten, so an edited workbook never serves an old snapshot.
+    path_key = hashlib.sha256(os.path.abspath(workbook).encode()).hexdigest()[:16]
+    stat = os.stat(workbook)
+    return os.path.join(cache_dir, path_key), f"{stat.st_mtime_ns}_{stat.st_size}"
+
+def snapshot_paths(prefix, version, sheets):
+    return {sheet: f"{prefix}_{version}_{name}.parquet" for sheet, name in sheets.items()}
+
+def remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def write_parquet(df, path):
+    # Written under a name of its own and renamed into place, so concurrent
+    # builds never read or clobber each other's half-written files.
+    temporary = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        df.write_parquet(temporary)
+        os.replace(temporary, path)
+    except BaseException:
+        remove(temporary)
+        raise
+
+def build_snapshot(workbook, prefix, version, sheets):
+    # Only other versions of the workbook are removed, once this one is in
+    # place; a build of the same version running alongside keeps its files.
+    paths = snapshot_paths(prefix, version, sheets)
+    for sheet, df in pl.read_excel(workbook, sheet_name=list(sheets)).items():
+        write_parquet(df, paths[sheet])
+    for stale in glob.glob(prefix + "_*.parquet"):
+        if stale not in paths.values():
+            remove(stale)
+    return paths
+
+def touch(paths):
+    # Marks a cached snapshot as just read. False when another process's
+    # eviction removed one of its files after the cache lookup.
+    try:
+        for path in paths:
+            os.utime(path)
+    except FileNotFoundError:
+        return False
+    return True
+
+def evict(cache_dir, max_bytes, keep):
+    # Least recently read snapshots go first; the one being served stays.
+    # Another process may remove a file while this runs.
+    files = []
+    for path in glob.glob(os.path.join(cache_dir, "*.parquet")):
+        try:
+            files.append((os.stat(path), path))
+        except FileNotFoundError:
+            pass
+    total = sum(stat.st_size for stat, _ in files)
+    for stat, path in sorted(files, key=lambda item: item[0].st_atime_ns):
+        if total <= max_bytes:
+            break
+        if path in keep:
+            continue
+        remove(path)
+        total -= stat.st_size
+
+def workbook_snapshot(workbook, sheets, cache_dir=None, max_bytes=SNAPSHOT_MAX_BYTES):
+    # Parquet copies of the given sheets of workbook ({sheet: file suffix}),
+    # built on first use. Every report then reads only its own columns from
+    # them instead of parsing the workbook again.
+    cache_dir = cache_dir or snapshot_dir(workbook)
+    os.makedirs(cache_dir, exist_ok=True)
+    prefix, version = snapshot_prefix(workbook, cache_dir)
+    paths = snapshot_paths(prefix, version, sheets)
+    with metrics.stage("workbook_snapshot") as record:
+        record["cached"] = touch(paths.values())
+        if not record["cached"]:
+            paths = build_snapshot(workbook, prefix, version, sheets)
+        evict(cache_dir, max_bytes, set(paths.values()))
+    return paths